@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+"""Check a scoring engine against the reference row-wise chain.
+
+An engine (lib.pipeline.ENGINES) replaces some stages of the annotation
+chain; by default the engine of scoring runs (pipeline.PRODUCTION_ENGINE)
+is checked. Both engines are run stage by stage on identical copies of the
+variants of `--input`, plus `--n_synthetic` variants derived from them by
+jittering the SpliceAI scores/positions and the variant position. After
+every stage the columns written by that stage are compared (NaN equals NaN,
+"12" equals 12). Each engine continues on its own output, so a difference
+shows up at the stage that introduced it and usually in later stages too;
+only the first stage where a variant diverges is reported.
+
+Before the stages, the parse is checked the same way: the bulk decoder
+(vcfdecode.decode_vcf) against the original per-record parser
+(decode_vcf_rowwise) on the first `--n_parse_records` records, and the
+ENST index lookup (posparser.resolve_enst_full) against the per-row query
+(fetch_enst_full). The per-record parser reads one row per record, so
+only records with one ALT allele, one CSQ and at most one SpliceAI entry
+are compared there.
+
+Written files:
+  * `<output>.mismatches.tsv`: one line per differing column at the first
+    diverging stage of each variant, and per differing parsed value
+    (source "parse").
+  * `<output>.stages.tsv`: wall time of both engines per stage, speed-up,
+    worker pool IPC time (lib.workerpool.overhead) and the number of
+    variants first diverging there.
+
+ps.py flags (--resources, --release, --assembly, thresholds, --weights,
+--n_workers) are accepted and used as in a scoring run. The baseline runs
+each stage first, so first-call costs (e.g. cold file caches) fall on it.
+Exits with status 1 if any variant differs.
+"""
+import os
+import sys
+import tempfile
+import importlib
+
+import numpy as np
+import pandas as pd
+from absl import app
+from absl import flags
+from absl import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ps  # noqa: E402
+from lib import pipeline  # noqa: E402
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string(
+    'engine', pipeline.PRODUCTION_ENGINE,
+    'Engine to check: a name in lib.pipeline.ENGINES or module:attribute')
+flags.DEFINE_string(
+    'baseline', 'reference', 'Engine used as the reference')
+flags.DEFINE_integer(
+    'n_synthetic', 1000, 'Number of synthetic variants added to the input variants')
+flags.DEFINE_integer(
+    'seed', 0, 'Random seed for the synthetic variants')
+flags.DEFINE_integer(
+    'n_parse_records', 2000,
+    'Number of input records decoded by both VCF parsers (0 skips the parse checks)')
+flags.DEFINE_integer(
+    'max_pos_shift', 50, 'Synthetic variants: largest shift (bp) of POS')
+flags.DEFINE_float(
+    'ds_jitter', 0.1, 'Synthetic variants: standard deviation of the DS_* jitter')
+flags.DEFINE_integer(
+    'dp_jitter', 5, 'Synthetic variants: largest change of the DP_* positions')
+
+
+def load_engine(name: str) -> dict:
+    if name in pipeline.ENGINES:
+        return pipeline.ENGINES[name]
+    module, _, attr = name.partition(':')
+    if not attr:
+        raise app.UsageError(f"Unknown engine {name}; use one of "
+                             f"{', '.join(pipeline.ENGINES)} or module:attribute.")
+    return getattr(importlib.import_module(module), attr)
+
+
+def synthetic_variants(df: pd.DataFrame, n: int, seed: int) -> pd.DataFrame:
+    """Resample rows of df and jitter their SpliceAI scores, positions and POS."""
+    from lib.schema import SPLICEAI_DS_COLS, SPLICEAI_DP_COLS
+
+    rng = np.random.default_rng(seed)
+    syn = df.iloc[rng.integers(0, len(df), size=n)].copy()
+    syn.index = pd.RangeIndex(df.index.max() + 1, df.index.max() + 1 + n)
+
+    for col in SPLICEAI_DS_COLS:
+        jittered = syn[col] + rng.normal(0, FLAGS.ds_jitter, size=n)
+        syn[col] = jittered.clip(0, 1).round(2)
+    for col in SPLICEAI_DP_COLS:
+        syn[col] = (syn[col] + rng.integers(-FLAGS.dp_jitter, FLAGS.dp_jitter + 1, size=n)
+                    ).astype(syn[col].dtype)
+    syn['maxsplai'] = syn[SPLICEAI_DS_COLS].max(axis=1)
+    syn['POS'] = (syn['POS'] + rng.integers(-FLAGS.max_pos_shift, FLAGS.max_pos_shift + 1,
+                                            size=n)).clip(lower=1).astype(syn['POS'].dtype)
+    return syn
+
+
+def _numeric(sr: pd.Series) -> pd.Series:
+    try:
+        return pd.to_numeric(sr, errors='coerce')
+    except TypeError:  # lists, dicts
+        return pd.Series(np.nan, index=sr.index)
+
+def same_values(ref: pd.Series, cand: pd.Series) -> pd.Series:
+    """Elementwise equality; NaN/None/<NA> are equal, numbers compare by value."""
+    ref, cand = ref.astype(object), cand.astype(object)
+    ref_num, cand_num = _numeric(ref), _numeric(cand)
+    return ((ref.isna() & cand.isna())
+            | (ref_num.notna() & (ref_num == cand_num))
+            | (ref.notna() & cand.notna() & (ref.astype(str) == cand.astype(str))))
+
+
+def variant_keys(df: pd.DataFrame) -> pd.Series:
+    return (df['CHROM'].astype(str) + '-' + df['POS'].astype(str)
+            + '-' + df['REF'].astype(str) + '-' + df['ALT'].astype(str))
+
+
+def head_vcf(input_vcf: str, n_records: int, output_vcf: str) -> tuple:
+    """
+    Write the first n_records records of input_vcf. Returns the number of
+    records written and the keys of those that decode_vcf_rowwise reads
+    like decode_vcf.
+    """
+    from cyvcf2 import VCF, Writer
+
+    vcf_in = VCF(input_vcf)
+    vcf_out = Writer(output_vcf, vcf_in)
+    comparable, n_written = set(), 0
+    for var in vcf_in:
+        if n_written >= n_records:
+            break
+        splai = var.INFO.get('SpliceAI')
+        if len(var.ALT) == 1 and ',' not in var.INFO.get('CSQ') and not (splai and ',' in splai):
+            comparable.add(f"{var.CHROM}-{var.POS}-{var.REF}-{var.ALT[0]}")
+        vcf_out.write_record(var)
+        n_written += 1
+    vcf_out.close()
+    vcf_in.close()
+    return n_written, comparable
+
+
+def compare_parse(res: dict) -> list:
+    """
+    Parse-level checks (see the module docstring). Returns mismatches as
+    (row, variant_id, 'parse', check, column, reference value, candidate value).
+    """
+    from lib import workerpool
+    from lib.posparser import fetch_enst_full, resolve_enst_full
+    from lib.schema import apply_parsed_schema
+    from lib.vcfdecode import decode_vcf, decode_vcf_rowwise
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        small_vcf = os.path.join(tmpdir, 'parse.vcf')
+        n_records, comparable = head_vcf(FLAGS.input, FLAGS.n_parse_records, small_vcf)
+        fast = apply_parsed_schema(decode_vcf(small_vcf))
+        reference = apply_parsed_schema(decode_vcf_rowwise(small_vcf))
+
+    mismatches = []
+    def collect(check, ref, cand, columns):
+        keys = variant_keys(ref)
+        if len(ref) != len(cand) or not (keys.to_numpy() == variant_keys(cand).to_numpy()).all():
+            mismatches.append((-1, None, 'parse', check, '<rows>', len(ref), len(cand)))
+            return
+        for col in columns:
+            differs = (~same_values(ref[col], cand[col])).to_numpy()
+            mismatches.extend((row, keys.iat[row], 'parse', check, col,
+                               ref[col].iat[row], cand[col].iat[row])
+                              for row in np.flatnonzero(differs))
+
+    collect('decode_vcf', reference[variant_keys(reference).isin(comparable)],
+            fast[variant_keys(fast).isin(comparable)], reference.columns)
+    n_decode = len(mismatches)
+
+    enst = fast.assign(ENST_Full=workerpool.apply(fast, fetch_enst_full, db=res['db'], axis=1))
+    collect('resolve_enst_full', enst,
+            fast.assign(ENST_Full=resolve_enst_full(fast, res['enst_index'])), ['ENST_Full'])
+    logging.info('Parse: %d of %d records compared by both decoders, %d values differ; '
+                 '%d of %d ENST_Full differ', len(comparable), n_records, n_decode,
+                 len(mismatches) - n_decode, len(fast))
+    return mismatches
+
+
+def compare_stage(stage, ref: pd.DataFrame, cand: pd.DataFrame) -> list:
+    """Return (row, column, reference value, candidate value) of differing cells."""
+    if not ref.index.equals(cand.index):
+        missing = ref.index.symmetric_difference(cand.index)
+        return [(row, '<rows>', row in ref.index, row in cand.index) for row in missing]
+
+    diffs = []
+    for col in stage.columns:
+        if col not in cand.columns:
+            diffs.extend((row, col, ref.at[row, col], '<missing>') for row in ref.index)
+            continue
+        differs = ~same_values(ref[col], cand[col])
+        for row in ref.index[differs.to_numpy()]:
+            diffs.append((row, col, ref.at[row, col], cand.at[row, col]))
+    return diffs
+
+
+def main(argv):
+    del argv  # Unused.
+    if FLAGS.input is None or FLAGS.resources is None or FLAGS.output is None:
+        raise app.UsageError("--input, --resources and --output are required.")
+
+    from lib.preprocess import parse_vcf, plan_annotation
+
+    baseline, engine = load_engine(FLAGS.baseline), load_engine(FLAGS.engine)
+    ps.init_parallel(FLAGS.n_workers)
+    res = ps.open_resources()
+    thresholds = [ps.thresholds_from_flags()]
+
+    real, _, _ = plan_annotation(parse_vcf(raw_vcf=FLAGS.input, db=res['db']),
+                                 res['genic_index'])
+    frames = [real]
+    if FLAGS.n_synthetic > 0 and not real.empty:
+        frames.append(synthetic_variants(real, FLAGS.n_synthetic, FLAGS.seed))
+    df = pd.concat(frames)
+    source = pd.Series('real', index=df.index)
+    source.iloc[len(real):] = 'synthetic'
+    keys = variant_keys(df)
+    logging.info('%d real and %d synthetic variants', len(real), len(df) - len(real))
+
+    parse_mismatches = compare_parse(res) if FLAGS.n_parse_records > 0 else []
+
+    ref, cand = df.copy(), df.copy()
+    first_stage = {}
+    mismatches, timings = list(parse_mismatches), []
+    for stage in pipeline.STAGES:
+        ref_timing, cand_timing = [], []
+        ref = pipeline.run_stages(ref, [stage], res, thresholds, engine=baseline,
+                                  timings=ref_timing)
+        cand = pipeline.run_stages(cand, [stage], res, thresholds, engine=engine,
+                                   timings=cand_timing)
+        (_, ref_elapsed, ref_pool), = ref_timing
+        (_, cand_elapsed, cand_pool), = cand_timing
+
+        for row, col, ref_value, cand_value in compare_stage(stage, ref, cand):
+            if first_stage.setdefault(row, stage.name) != stage.name:
+                continue
+            mismatches.append((row, keys.get(row), source.get(row), stage.name, col,
+                               ref_value, cand_value))
+        n_first = sum(stage_name == stage.name for stage_name in first_stage.values())
+
+        timings.append((stage.name, stage.name in engine, ref_elapsed, cand_elapsed,
+                        ref_elapsed / cand_elapsed if cand_elapsed > 0 else np.nan,
+                        ref_pool['ipc_s'], cand_pool['ipc_s'], n_first))
+        logging.info('%-18s reference %7.3f s  candidate %7.3f s  %d variants diverged',
+                     stage.name, ref_elapsed, cand_elapsed, n_first)
+
+    pd.DataFrame(mismatches, columns=['row', 'variant_id', 'source', 'stage', 'column',
+                                      'reference', 'candidate']
+                 ).to_csv(f"{FLAGS.output}.mismatches.tsv", sep='\t', index=False)
+    stages = pd.DataFrame(timings, columns=['stage', 'replaced', 'reference_s', 'candidate_s',
+                                            'speedup', 'reference_ipc_s', 'candidate_ipc_s',
+                                            'first_diverged'])
+    stages.to_csv(f"{FLAGS.output}.stages.tsv", sep='\t', index=False)
+
+    total_ref, total_cand = stages['reference_s'].sum(), stages['candidate_s'].sum()
+    logging.info('Total: reference %.2f s, candidate %.2f s (%.2fx); %d of %d variants differ',
+                 total_ref, total_cand, total_ref / total_cand, len(first_stage), len(df))
+    if first_stage or parse_mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    app.run(main)
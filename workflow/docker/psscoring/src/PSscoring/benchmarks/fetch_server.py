@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""Check lib/fetch.py against a local HTTP server.
+
+The server holds a few in-memory files, answers Range requests and can be told
+to fail the next requests of a file (503, a truncated body, ignoring Range).
+Each case downloads into a temporary directory and is reported as OK or
+FAILED together with the requests the server saw; the exit status is the
+number of failed cases.
+"""
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from absl import app
+from absl import flags
+from absl import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib import fetch  # noqa: E402
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer(
+    'size', 3 << 20, 'Size of the served files (bytes)')
+flags.DEFINE_integer(
+    'chunk_size', 1 << 16, 'Chunk size passed to fetch()')
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Serves server.files; server.faults[name] lists the faults of the next GETs."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _lookup(self):
+        name = self.path.lstrip('/')
+        self.server.seen.append((self.command, name, self.headers.get('Range')))
+        data = self.server.files.get(name)
+        if data is None:
+            self.send_error(404)
+        return name, data
+
+    def do_HEAD(self):
+        name, data = self._lookup()
+        if data is None:
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+
+    def do_GET(self):
+        name, data = self._lookup()
+        range_header = self.headers.get('Range')
+        if data is None:
+            return
+        faults = self.server.faults.get(name, [])
+        fault = faults.pop(0) if faults else None
+
+        if fault == '503':
+            self.send_error(503)
+            return
+        offset = 0
+        if range_header and fault != 'norange':
+            offset = int(range_header[len('bytes='):].split('-')[0])
+            if offset >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{len(data)}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {offset}-{len(data) - 1}/{len(data)}")
+        else:
+            self.send_response(200)
+        body = data[offset:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if fault == 'truncate':
+            # Promise the whole body but close the connection halfway
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+def serve(files: dict) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    server.files, server.faults, server.seen = files, {}, []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_cases(server: ThreadingHTTPServer, tmpdir: str) -> int:
+    data = server.files['data.bin']
+    md5 = hashlib.md5(data).hexdigest()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    kwargs = {'chunk_size': FLAGS.chunk_size, 'timeout': 10}
+
+    def remote(name, checksum=md5):
+        return fetch.Remote(f"{url}/data.bin", os.path.join(tmpdir, name), checksum)
+
+    def write_part(name, content):
+        with open(os.path.join(tmpdir, f"{name}.part"), 'wb') as f:
+            f.write(content)
+
+    def downloaded(name, expected='downloaded'):
+        def check(result):
+            with open(os.path.join(tmpdir, name), 'rb') as f:
+                return result == expected and f.read() == data
+        return check
+
+    def raises(error):
+        def check(result):
+            return isinstance(result, error)
+        return check
+
+    # (label, remote, setup, faults of data.bin, check)
+    cases = [
+        ('fresh download', remote('a'), None, [], downloaded('a')),
+        ('existing file', remote('a'), None, [], downloaded('a', 'skipped')),
+        ('resume from part file', remote('b'), lambda: write_part('b', data[:len(data) // 3]),
+         [], downloaded('b')),
+        ('server ignores Range', remote('c'), lambda: write_part('c', data[:100]),
+         ['norange'], downloaded('c')),
+        ('truncated body', remote('d'), None, ['truncate'], downloaded('d')),
+        ('503 is retried', remote('e'), None, ['503', '503'], downloaded('e')),
+        ('416, complete part file', remote('f', None), lambda: write_part('f', data),
+         [], downloaded('f')),
+        ('416, stale part file', remote('g', None), lambda: write_part('g', data + b'stale'),
+         [], downloaded('g')),
+        ('checksum mismatch', remote('h', '0' * 32), None, [], raises(fetch.ChecksumError)),
+        ('404 is not retried', fetch.Remote(f"{url}/missing.bin", os.path.join(tmpdir, 'i')),
+         None, [], raises(requests.exceptions.HTTPError)),
+    ]
+
+    n_failed = 0
+    for label, rem, setup, faults, check in cases:
+        if setup is not None:
+            setup()
+        server.faults['data.bin'] = list(faults)
+        del server.seen[:]
+        try:
+            result = fetch.fetch(rem, retries=3, **kwargs)
+        except Exception as e:  # noqa: BLE001
+            result = e
+        ok = check(result)
+        n_failed += not ok
+        requests_seen = ', '.join(f"{method} {rng or ''}".strip() for method, _, rng in server.seen)
+        logging.info('%-26s %-6s %s', label, 'OK' if ok else 'FAILED', requests_seen)
+        if not ok:
+            logging.error('%s: %r', label, result)
+    return n_failed
+
+
+def main(argv):
+    del argv  # Unused.
+    files = {'data.bin': os.urandom(FLAGS.size)}
+    server = serve(files)
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            n_failed = run_cases(server, tmpdir)
+    finally:
+        server.shutdown()
+    logging.info('%d case(s) failed', n_failed)
+    sys.exit(n_failed)
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Compare the gffutils and streaming GENCODE DB builders.
+
+Both builders are run on `--gtf` and their wall time is reported. The two
+resulting DB pairs are then checked for identical feature rows (id, location,
+attributes) and parent/child relations for every feature type the scoring
+stages query.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from absl import app
+from absl import flags
+from absl import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import generatedbs  # noqa: E402
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string(
+    'gtf', None, 'GENCODE GTF (gzipped) to build from', short_name='g')
+flags.DEFINE_string(
+    'workdir', None, 'Directory for the built DBs (default: a temporary directory)')
+flags.DEFINE_integer(
+    'n_workers', os.cpu_count(), 'Number of processes for the streaming builder')
+flags.DEFINE_bool(
+    'skip_legacy', False, 'Only time the streaming builder')
+flags.mark_flag_as_required('gtf')
+
+QUERIED_FEATURETYPES = ('gene', 'transcript', 'exon', 'CDS', 'intron')
+
+
+def dump_db(path: str) -> tuple:
+    conn = sqlite3.connect(path)
+    placeholders = ','.join('?' * len(QUERIED_FEATURETYPES))
+    features = conn.execute(
+        'SELECT id, seqid, start, end, strand, featuretype, attributes, bin FROM features '
+        f'WHERE featuretype IN ({placeholders})', QUERIED_FEATURETYPES).fetchall()
+    ids = {row[0] for row in features}
+    relations = [row for row in conn.execute('SELECT parent, child, level FROM relations')
+                 if row[1] in ids]
+    conn.close()
+    return sorted(features), sorted(relations)
+
+
+def compare_dbs(legacy: str, fast: str) -> bool:
+    legacy_features, legacy_relations = dump_db(legacy)
+    fast_features, fast_relations = dump_db(fast)
+    same = legacy_features == fast_features and legacy_relations == fast_relations
+    logging.info('%s: %d/%d features, %d/%d relations (legacy/fast) -> %s',
+                 os.path.basename(fast), len(legacy_features), len(fast_features),
+                 len(legacy_relations), len(fast_relations),
+                 'identical' if same else 'DIFFERENT')
+    return same
+
+
+def remove_outputs(paths) -> None:
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def run(workdir: str) -> None:
+    fast_dbs = (os.path.join(workdir, 'fast.gtf.db'),
+                os.path.join(workdir, 'fast.intron.gtf.db'))
+    remove_outputs(fast_dbs)
+    start = time.perf_counter()
+    generatedbs.build_dbs(FLAGS.gtf, *fast_dbs, n_workers=FLAGS.n_workers)
+    logging.info('streaming builder (n_workers=%d): %.1f s',
+                 FLAGS.n_workers, time.perf_counter() - start)
+
+    if FLAGS.skip_legacy:
+        return
+
+    legacy_dbs = (os.path.join(workdir, 'legacy.gtf.db'),
+                  os.path.join(workdir, 'legacy.intron.gtf.db'))
+    legacy_intron_gtf = os.path.join(workdir, 'legacy.intron.gtf.gz')
+    remove_outputs(legacy_dbs + (legacy_intron_gtf,))
+    start = time.perf_counter()
+    generatedbs.build_dbs_gffutils(FLAGS.gtf, legacy_dbs[0], legacy_intron_gtf, legacy_dbs[1])
+    logging.info('gffutils builder: %.1f s', time.perf_counter() - start)
+
+    if not all([compare_dbs(legacy, fast) for legacy, fast in zip(legacy_dbs, fast_dbs)]):
+        raise SystemExit(1)
+
+
+def main(argv):
+    del argv  # Unused.
+    if FLAGS.workdir is not None:
+        os.makedirs(FLAGS.workdir, exist_ok=True)
+        run(FLAGS.workdir)
+        return
+    with tempfile.TemporaryDirectory() as tmpdir:
+        run(tmpdir)
+
+
+if __name__ == '__main__':
+    app.run(main)
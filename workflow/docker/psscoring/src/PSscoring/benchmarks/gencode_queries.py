@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""Measure GENCODE DB query latency: gffutils.FeatureDB vs lib/gencodedb.GencodeDB.
+
+`--n_queries` transcripts are drawn from the GENCODE DB, and the lookups the
+scoring stages make are timed on both interfaces:
+  * exons and CDS of the transcript (GENCODE DB) and its introns (intron DB),
+  * its exons overlapping one exon position (children with `limit`),
+  * the transcripts overlapping that position (region).
+Every lookup runs once untimed first, so both interfaces are timed with warm
+page caches. The features returned by both interfaces are compared (id,
+location, exon_number). Run `ps.py prepare` on the resources first to time
+the child_features table rather than the relations join.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+from absl import app
+from absl import flags
+from absl import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib.gencodedb import GencodeDB, SQLITE_MMAP_SIZE  # noqa: E402
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string(
+    'gencode_db', None, 'GENCODE DB (<base>.gtf.db)')
+flags.DEFINE_string(
+    'intron_db', None, 'Intron DB (<base>.intron.gtf.db)')
+flags.DEFINE_integer(
+    'n_queries', 10000, 'Number of lookups per query type')
+flags.DEFINE_integer(
+    'seed', 0, 'Random seed for the sampled transcripts')
+flags.mark_flag_as_required('gencode_db')
+flags.mark_flag_as_required('intron_db')
+
+
+def open_featuredb(path: str):
+    import gffutils
+    from gffutils import constants
+
+    pragmas = dict(constants.default_pragmas, mmap_size=SQLITE_MMAP_SIZE)
+    return gffutils.FeatureDB(path, pragmas=pragmas)
+
+
+def sample_queries(db: GencodeDB, n: int, seed: int) -> list:
+    """(transcript ID, seqid, position) with the position inside one of its exons."""
+    rows = db.conn.execute(
+        "SELECT relations.parent, features.seqid, features.start, features.end "
+        "FROM relations JOIN features ON features.id = relations.child "
+        "WHERE relations.level = 1 AND features.featuretype = 'exon'").fetchall()
+    if not rows:
+        raise ValueError(f"{db.path} has no exons.")
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in rng.integers(0, len(rows), size=n):
+        enst, seqid, start, end = rows[i]
+        queries.append((enst, seqid, int(rng.integers(start, end + 1))))
+    return queries
+
+
+def summary(features) -> list:
+    return sorted((f.id, f.seqid, f.start, f.end, f.strand,
+                   tuple(f.attributes.get('exon_number', ()))) for f in features)
+
+
+def lookups(gencode, intron) -> dict:
+    """Query name -> function of (transcript ID, seqid, position)."""
+    return {
+        'exons': lambda enst, seqid, pos: gencode.children(enst, featuretype='exon'),
+        'CDS': lambda enst, seqid, pos: gencode.children(enst, featuretype='CDS'),
+        'introns': lambda enst, seqid, pos: intron.children(enst, featuretype='intron'),
+        'exon at position': lambda enst, seqid, pos: gencode.children(
+            enst, featuretype='exon', limit=(seqid, pos - 1, pos)),
+        'transcripts at position': lambda enst, seqid, pos: gencode.region(
+            region=(seqid, pos - 1, pos), featuretype='transcript'),
+    }
+
+
+def timed(func, queries: list) -> tuple:
+    start = time.perf_counter()
+    results = [list(func(*query)) for query in queries]
+    return results, time.perf_counter() - start
+
+
+def main(argv):
+    del argv  # Unused.
+    fast_gencode, fast_intron = GencodeDB(FLAGS.gencode_db), GencodeDB(FLAGS.intron_db)
+    plain = lookups(open_featuredb(FLAGS.gencode_db), open_featuredb(FLAGS.intron_db))
+    fast = lookups(fast_gencode, fast_intron)
+    logging.info('child_features table: %s',
+                 'yes' if fast_gencode.indexed else 'no (relations join)')
+
+    queries = sample_queries(fast_gencode, FLAGS.n_queries, FLAGS.seed)
+    differ = False
+    for name in plain:
+        timed(plain[name], queries)
+        timed(fast[name], queries)
+        plain_results, plain_s = timed(plain[name], queries)
+        fast_results, fast_s = timed(fast[name], queries)
+        n_diff = sum(summary(p) != summary(f) for p, f in zip(plain_results, fast_results))
+        differ |= n_diff > 0
+        logging.info('%-24s FeatureDB %7.1f us  GencodeDB %7.1f us  (%.1fx)  %s',
+                     name, 1e6 * plain_s / len(queries), 1e6 * fast_s / len(queries),
+                     plain_s / fast_s if fast_s > 0 else np.nan,
+                     f'{n_diff} lookups differ' if n_diff else 'identical')
+    if differ:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    app.run(main)
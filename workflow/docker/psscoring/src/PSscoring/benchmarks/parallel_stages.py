@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Measure the per-stage speed-up of the worker pool across worker counts.
+
+The variants of `--input` (repeated `--n_copies` times, so that the stages
+have enough rows to split) are run through the whole chain once for each
+count in `--worker_counts`, after an untimed pass over the input variants. Resources are reopened for every count, and the
+workers open their own GENCODE DB, GFF3 and ClinVar handles
+(lib/handles.py). The frames of all counts are compared with that of the
+first count after the last stage.
+
+Written file:
+  * `<output>.parallel.tsv`: wall time per stage and worker count, and the
+    speed-up over the first count.
+
+ps.py flags (--resources, --release, --assembly, thresholds, --weights) are
+accepted and used as in a scoring run. Exits with status 1 if the frames
+differ.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from absl import app
+from absl import flags
+from absl import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ps  # noqa: E402
+from lib import pipeline  # noqa: E402
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_list(
+    'worker_counts', ['1', '2', '4', '8'], 'Worker counts to compare; the first is the baseline')
+flags.DEFINE_integer(
+    'n_copies', 10, 'Number of copies of the input variants')
+
+
+def differing_columns(ref: pd.DataFrame, cand: pd.DataFrame) -> list:
+    """Columns whose values differ (compared as strings, so lists and NaN compare too)."""
+    return [col for col in ref.columns
+            if col not in cand.columns
+            or not ref[col].astype(str).equals(cand[col].astype(str))]
+
+
+def run_chain(df: pd.DataFrame, n_workers: int) -> tuple:
+    ps.init_parallel(n_workers)
+    res = ps.open_resources()
+    timings = []
+    df = pipeline.run_stages(df.copy(), pipeline.STAGES, res, [ps.thresholds_from_flags()],
+                             timings=timings)
+    return df, {name: elapsed for name, elapsed, _ in timings}
+
+
+def main(argv):
+    del argv  # Unused.
+    if FLAGS.input is None or FLAGS.resources is None or FLAGS.output is None:
+        raise app.UsageError("--input, --resources and --output are required.")
+
+    from lib.preprocess import parse_vcf, plan_annotation
+
+    counts = [int(n) for n in FLAGS.worker_counts]
+    ps.init_parallel(1)
+    res = ps.open_resources()
+    parsed, _, _ = plan_annotation(parse_vcf(raw_vcf=FLAGS.input, db=res['db']),
+                                   res['genic_index'])
+    df = pd.concat([parsed] * FLAGS.n_copies, ignore_index=True)
+    logging.info('%d variants (%d copies of %d)', len(df), FLAGS.n_copies, len(parsed))
+    # Untimed pass, so that first-call costs (cold file caches) fall on no count
+    run_chain(parsed, counts[0])
+
+    baseline, columns, differ = None, {}, False
+    for n in counts:
+        out, timings = run_chain(df, n)
+        columns[f'{n}_workers_s'] = timings
+        logging.info('%d worker(s): %.2f s', n, sum(timings.values()))
+        if baseline is None:
+            baseline = out
+            continue
+        diffs = differing_columns(baseline, out)
+        if diffs:
+            differ = True
+            logging.info('%d worker(s): %s differ from %d worker(s)', n, ', '.join(diffs), counts[0])
+
+    times = pd.DataFrame(columns)
+    times.loc['total'] = times.sum()
+    speedup = times.rdiv(times.iloc[:, 0], axis=0).replace(np.inf, np.nan)
+    speedup.columns = [col.replace('_s', '_speedup') for col in times.columns]
+    table = pd.concat([times, speedup.iloc[:, 1:]], axis=1)
+    table.index.name = 'stage'
+    table.to_csv(f"{FLAGS.output}.parallel.tsv", sep='\t', float_format='%.3f')
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        logging.info('\n%s', table.round(3))
+    if differ:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    app.run(main)
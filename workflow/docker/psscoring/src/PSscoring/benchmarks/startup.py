@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Measure cold-start wall time of ps.py.
+
+Two numbers are reported:
+  * `ps.py --help`, i.e. interpreter start + module import + flag parsing.
+  * A full scoring run on a small VCF (the first `--n_variants` records of
+    `--input`), which adds resource opening and worker start-up.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from absl import app
+from absl import flags
+from absl import logging
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string(
+    'ps_py', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ps.py'),
+    'Path to ps.py')
+flags.DEFINE_string(
+    'input', None, 'Annotated VCF used for the small end-to-end run (optional)', short_name='i')
+flags.DEFINE_string(
+    'resources', None, 'Path to resources directory', short_name='r')
+flags.DEFINE_integer(
+    'n_variants', 10, 'Number of records taken from --input for the end-to-end run')
+flags.DEFINE_integer(
+    'repeats', 5, 'Number of repeated runs per measurement')
+flags.DEFINE_integer(
+    'n_workers', 2, 'Number of workers passed to ps.py')
+
+
+def time_command(cmd: list, repeats: int) -> list:
+    elapsed = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       stdin=subprocess.DEVNULL, check=False)
+        elapsed.append(time.perf_counter() - start)
+    return elapsed
+
+
+def head_vcf(input_vcf: str, n_variants: int, output_vcf: str) -> None:
+    from cyvcf2 import VCF, Writer
+
+    vcf_in = VCF(input_vcf)
+    vcf_out = Writer(output_vcf, vcf_in)
+    for i, var in enumerate(vcf_in):
+        if i >= n_variants:
+            break
+        vcf_out.write_record(var)
+    vcf_out.close()
+    vcf_in.close()
+
+
+def report(label: str, elapsed: list) -> None:
+    logging.info('%-28s median %.3f s  min %.3f s  (n=%d)',
+                 label, statistics.median(elapsed), min(elapsed), len(elapsed))
+
+
+def main(argv):
+    del argv  # Unused.
+    report('ps.py --help', time_command(
+        [sys.executable, FLAGS.ps_py, '--help'], FLAGS.repeats))
+
+    if FLAGS.input is None:
+        return
+    if FLAGS.resources is None:
+        raise ValueError("--resources is required together with --input.")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        small_vcf = os.path.join(tmpdir, f'head{FLAGS.n_variants}.vcf')
+        head_vcf(FLAGS.input, FLAGS.n_variants, small_vcf)
+        cmd = [sys.executable, FLAGS.ps_py,
+               '--input', small_vcf,
+               '--output', os.path.join(tmpdir, 'out.vcf'),
+               '--resources', FLAGS.resources,
+               '--n_workers', str(FLAGS.n_workers)]
+        report(f'ps.py {FLAGS.n_variants}-variant VCF', time_command(cmd, FLAGS.repeats))
+
+
+if __name__ == '__main__':
+    app.run(main)
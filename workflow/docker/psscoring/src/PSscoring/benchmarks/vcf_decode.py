@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Measure CSQ/SpliceAI decode throughput.
+
+A VCF of `--n_records` records is made by repeating the records of
+`--input` at shifted positions. The bulk decoder (lib/vcfdecode.decode_vcf)
+is timed on all of it. The original per-record parser, whose cost grows
+quadratically, is timed on the first `--n_reference` records, and its output
+is compared with the bulk decoder's on these records. maxsplai is compared
+separately, since the original takes the lexical maximum of the score
+strings.
+"""
+import os
+import sys
+import gzip
+import tempfile
+import time
+
+import pandas as pd
+from absl import app
+from absl import flags
+from absl import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib.schema import apply_parsed_schema  # noqa: E402
+from lib.vcfdecode import decode_vcf, decode_vcf_rowwise  # noqa: E402
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string(
+    'input', None, 'VEP- and SpliceAI-annotated VCF used as the record template', short_name='i')
+flags.DEFINE_integer(
+    'n_records', 1_000_000, 'Number of records decoded by the bulk decoder')
+flags.DEFINE_integer(
+    'n_reference', 2000, 'Number of records decoded by the original parser (0 skips it)')
+flags.DEFINE_string(
+    'workdir', None, 'Directory for the generated VCFs (default: a temporary directory)')
+flags.mark_flag_as_required('input')
+
+
+def make_vcf(template: str, n_records: int, output: str) -> None:
+    """Write n_records records, cycling through the template's records."""
+    header, body = [], []
+    opener = gzip.open if template.endswith('.gz') else open
+    with opener(template, 'rt') as f:
+        for line in f:
+            (header if line.startswith('#') else body).append(line.split('\t', 2))
+    if not body:
+        raise ValueError(f"{template} has no records.")
+
+    # Each pass over the template is shifted so that records stay distinct
+    shift = max(int(pos) for _, pos, _ in body) + 1
+    with gzip.open(output, 'wt', compresslevel=1) as out:
+        out.writelines('\t'.join(fields) for fields in header)
+        for i in range(n_records):
+            chrom, pos, rest = body[i % len(body)]
+            out.write(f"{chrom}\t{int(pos) + (i // len(body)) * shift}\t{rest}")
+
+
+def timed(func, *args) -> tuple:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def compare(fast: pd.DataFrame, reference: pd.DataFrame) -> None:
+    fast, reference = apply_parsed_schema(fast.copy()), apply_parsed_schema(reference.copy())
+    for col in reference.columns:
+        x, y = fast[col].astype(object), reference[col].astype(object)
+        differs = ~((x == y) | (x.isna() & y.isna()))
+        if differs.any():
+            logging.info('%-12s %d of %d records differ, e.g. %s', col, differs.sum(), len(x),
+                         list(zip(x[differs][:3], y[differs][:3])))
+        else:
+            logging.info('%-12s identical', col)
+
+
+def main(argv):
+    del argv  # Unused.
+    with tempfile.TemporaryDirectory(dir=FLAGS.workdir) as tmpdir:
+        big_vcf = os.path.join(tmpdir, 'decode.vcf.gz')
+        _, elapsed = timed(make_vcf, FLAGS.input, FLAGS.n_records, big_vcf)
+        logging.info('Generated %d records in %.1f s', FLAGS.n_records, elapsed)
+
+        fast, elapsed = timed(decode_vcf, big_vcf)
+        logging.info('Bulk decoder: %d records in %.2f s (%.0f records/s)',
+                     len(fast), elapsed, len(fast) / elapsed)
+
+        if FLAGS.n_reference > 0:
+            small_vcf = os.path.join(tmpdir, 'reference.vcf.gz')
+            make_vcf(FLAGS.input, FLAGS.n_reference, small_vcf)
+            reference, elapsed = timed(decode_vcf_rowwise, small_vcf)
+            logging.info('Per-record parser: %d records in %.2f s (%.0f records/s)',
+                         len(reference), elapsed, len(reference) / elapsed)
+            compare(fast.head(len(reference)).reset_index(drop=True), reference)
+
+
+if __name__ == '__main__':
+    app.run(main)
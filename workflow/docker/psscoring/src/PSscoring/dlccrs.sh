@@ -16,27 +16,15 @@ readonly BASE_URI="https://s3.us-east-2.amazonaws.com/ccrs/ccrs"
 readonly autosomes="ccrs.autosomes.v2.20180420.bed.gz"
 readonly xchrom="ccrs.xchrom.v2.20180420.bed.gz"
 
-function remove_old_files() {
-  if [ -e "$autosomes" ]; then
-    echo "Old autosomes file exists."
-    rm -rf "$autosomes"
-    echo "Removed old autosomes file"
-  fi
-  if [ -e "$xchrom" ]; then
-    echo "Old xchrom file exists."
-    rm -rf "$xchrom"
-    echo "Removed old xchrom file"
-  fi
-}
-
 function download_with_curl() {
   echo "Downloading with curl: $1"
-  curl -O -sL "$1"
+  # -C - resumes a partial file; a complete file is left as it is
+  curl -C - -O -sL "$1"
 }
 
 function download_with_wget() {
   echo "Downloading with wget: $1"
-  wget -nv "$1"
+  wget -c -nv "$1"
 }
 
 function download_file() {
@@ -51,7 +39,6 @@ function download_file() {
 }
 
 function download_ccrs() {
-  remove_old_files
   download_file "${BASE_URI}/${autosomes}"
   download_file "${BASE_URI}/${xchrom}"
 }
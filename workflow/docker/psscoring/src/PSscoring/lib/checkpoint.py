@@ -0,0 +1,93 @@
+"""
+Checkpoints of the working DataFrame between pipeline stages.
+
+After the parse and after each expensive stage, the frame is pickled to
+`<directory>/<key>/<stage>.pkl` (written to a temporary file and renamed,
+so a crash never leaves a partial checkpoint behind). The key is a hash of
+the input VCF's content and of every setting that changes the frame
+(thresholds, weights, resources, filters), so a checkpoint is only reused
+for exactly the same run. Pickle keeps the mixed-type object columns of the
+annotation chain as they are.
+"""
+import os
+import json
+import shutil
+import hashlib
+from logging import getLogger
+
+import pandas as pd
+
+logger = getLogger(__name__)
+
+PARSED = 'parsed'
+# Stages after which the frame is saved (lib.pipeline stage names)
+CHECKPOINT_STAGES = ['intron_dist', 'exon_loc', 'clinvar', 'exint_info', 'multiexs', 'ccrs']
+
+
+def make_key(input_digest: str, settings: dict) -> str:
+    """Hash of the input digest and the JSON-serialisable run settings."""
+    blob = json.dumps({'input': input_digest, 'settings': settings},
+                      sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()[:16]
+
+
+class Checkpoints:
+    def __init__(self, directory: str, key: str, stages: list = CHECKPOINT_STAGES):
+        self.path = os.path.join(directory, key)
+        self.stages = set(stages) | {PARSED}
+        self._loaded = {}
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.pkl")
+
+    def save(self, name: str, df: pd.DataFrame) -> None:
+        """Save df as the checkpoint of `name` if it is a checkpointed stage."""
+        if name not in self.stages:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        tmp = f"{self._file(name)}.tmp"
+        df.to_pickle(tmp)
+        os.replace(tmp, self._file(name))
+        logger.debug(f"Checkpoint {name}: {len(df)} rows")
+
+    def load(self, name: str) -> pd.DataFrame:
+        """The checkpoint of `name`, or None if there is none or it is unreadable."""
+        if name in self._loaded:
+            return self._loaded.pop(name)
+        path = self._file(name)
+        if not os.path.exists(path):
+            return None
+        try:
+            return pd.read_pickle(path)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+            return None
+
+    def latest(self, names: list) -> str:
+        """
+        The last of `names` with a valid checkpoint, or None. Its frame is
+        kept for the next `load`/`resume`.
+        """
+        first, df = self.resume(names)
+        if df is None:
+            return None
+        self._loaded[names[first - 1]] = df
+        return names[first - 1]
+
+    def resume(self, names: list) -> tuple:
+        """
+        Find the last valid checkpoint among `names` (in order).
+        Returns:
+            tuple: (index of the first name still to run, saved frame or None)
+        """
+        for i in range(len(names) - 1, -1, -1):
+            if names[i] in self.stages:
+                df = self.load(names[i])
+                if df is not None:
+                    return i + 1, df
+        return 0, None
+
+    def clear(self) -> None:
+        """Remove the checkpoints of this key (after a completed run)."""
+        self._loaded.clear()
+        shutil.rmtree(self.path, ignore_errors=True)
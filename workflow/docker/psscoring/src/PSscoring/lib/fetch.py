@@ -0,0 +1,145 @@
+"""
+Resumable downloads of resource files.
+
+Files are streamed to `<path>.part` in chunks and moved into place once they
+are complete and their checksum matches. An interrupted download is resumed
+from the end of the `.part` file with an HTTP Range request; servers that
+ignore Range restart it from the beginning. Files that already exist and
+match their checksum are not downloaded again. Connection errors and 5xx
+responses are retried.
+
+`benchmarks/fetch_server.py` runs these cases against a local HTTP server.
+"""
+import os
+import time
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+
+import requests
+
+logger = getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+
+# checksum: expected hex digest or None; algorithm: hashlib name
+Remote = namedtuple('Remote', ['url', 'path', 'checksum', 'algorithm'])
+Remote.__new__.__defaults__ = (None, 'md5')
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+def file_digest(path: str, algorithm: str = 'md5', chunk_size: int = CHUNK_SIZE) -> str:
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_checksums(url: str, timeout: float = 60) -> dict:
+    """
+    Read an MD5SUMS-style listing ("<digest>  <file name>" per line).
+    Returns:
+        dict: {file name: digest}
+    """
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    checksums = {}
+    for line in response.text.splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            checksums[os.path.basename(fields[1].lstrip('*'))] = fields[0].lower()
+    return checksums
+
+def _is_valid(path: str, remote: Remote) -> bool:
+    return remote.checksum is None or file_digest(path, remote.algorithm) == remote.checksum.lower()
+
+def _remote_size(url: str, timeout: float):
+    response = requests.head(url, allow_redirects=True, timeout=timeout)
+    response.raise_for_status()
+    length = response.headers.get('Content-Length')
+    return int(length) if length is not None else None
+
+def _download(remote: Remote, part: str, chunk_size: int, timeout: float) -> None:
+    """Append the missing bytes of remote.url to part."""
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {'Range': f"bytes={offset}-"} if offset else {}
+
+    with requests.get(remote.url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 416:
+            # The part file is complete only if it has the remote size; it may
+            # also be longer, e.g. if the remote file was replaced
+            if _remote_size(remote.url, timeout) == offset:
+                return
+            logger.warning(f"{part} does not match the size of {remote.url}, discarding it")
+            os.remove(part)
+            return _download(remote, part, chunk_size, timeout)
+        response.raise_for_status()
+
+        if offset and response.status_code == 206:
+            logger.info(f"Resuming {remote.url} at {offset} bytes")
+            mode, expected = 'ab', offset
+        else:
+            mode, expected = 'wb', 0
+        length = response.headers.get('Content-Length')
+        expected = expected + int(length) if length is not None else None
+
+        with open(part, mode) as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+
+    if expected is not None and os.path.getsize(part) != expected:
+        raise requests.exceptions.ChunkedEncodingError(
+            f"{remote.url}: got {os.path.getsize(part)} of {expected} bytes")
+
+def fetch(remote: Remote, retries: int = 3, chunk_size: int = CHUNK_SIZE,
+          timeout: float = 60) -> str:
+    """
+    Download remote.url to remote.path unless a valid file is already there.
+    Connection errors and 5xx responses are retried (resuming); a checksum
+    mismatch discards the download and starts over.
+    Returns:
+        str: 'skipped' or 'downloaded'
+    """
+    if os.path.exists(remote.path):
+        if _is_valid(remote.path, remote):
+            logger.info(f"{remote.path} already exists")
+            return 'skipped'
+        logger.warning(f"{remote.path} does not match its checksum, downloading again")
+
+    os.makedirs(os.path.dirname(os.path.abspath(remote.path)), exist_ok=True)
+    part = f"{remote.path}.part"
+    for attempt in range(1, retries + 1):
+        try:
+            _download(remote, part, chunk_size, timeout)
+            if not _is_valid(part, remote):
+                os.remove(part)
+                raise ChecksumError(f"Checksum mismatch for {remote.url}")
+            os.replace(part, remote.path)
+            logger.info(f"Downloaded {remote.url} to {remote.path}")
+            return 'downloaded'
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError, requests.exceptions.HTTPError,
+                ChecksumError) as e:
+            if (isinstance(e, requests.exceptions.HTTPError)
+                    and (e.response is None or e.response.status_code < 500)):
+                raise
+            if attempt == retries:
+                raise
+            logger.warning(f"{e} (attempt {attempt}/{retries}), retrying...")
+            time.sleep(attempt)
+
+def fetch_all(remotes: list, n_workers: int = 4, **kwargs) -> dict:
+    """
+    Fetch several files concurrently.
+    Returns:
+        dict: {path: 'skipped' or 'downloaded'}
+    """
+    if not remotes:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(n_workers, len(remotes))) as executor:
+        futures = {remote.path: executor.submit(fetch, remote, **kwargs) for remote in remotes}
+    return {path: future.result() for path, future in futures.items()}
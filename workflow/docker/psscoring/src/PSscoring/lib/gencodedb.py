@@ -0,0 +1,174 @@
+"""
+Read-only access to the GENCODE gffutils databases.
+
+The scoring stages only read two kinds of records: the exons, introns or CDS
+of a transcript (`children`) and the transcripts overlapping a position
+(`region`). GencodeDB answers both with fixed SQL statements, which sqlite3
+keeps prepared in the connection's statement cache, and selects only the
+columns the stages use. The file is opened read-only and immutable (no
+locks, no journal or change checks) and memory-mapped. Any other FeatureDB
+method is passed on to a gffutils.FeatureDB opened on first use.
+
+Databases built by generatedbs.build_dbs have a `child_features` table: the
+direct children of every feature, as a WITHOUT ROWID table keyed by
+(parent, featuretype, start, id). It is a covering index for `children`,
+so a lookup is one range scan that never touches `features`. Older
+databases are queried through the relations join instead; `ps.py prepare`
+adds the table to them.
+
+Features are returned as lightweight Feature objects with the GFF columns
+and only the `exon_number` attribute.
+"""
+import os
+import json
+import sqlite3
+
+from gffutils import bins
+
+# Page cache is shared between processes, so mapping the SQLite files lets
+# concurrent runs on one host reuse the same pages instead of copying them
+# into each connection's cache.
+SQLITE_MMAP_SIZE = 1 << 32
+
+CHILD_FEATURES_SCHEMA = """
+CREATE TABLE child_features (
+    parent TEXT NOT NULL,
+    featuretype TEXT NOT NULL,
+    start INT NOT NULL,
+    end INT NOT NULL,
+    seqid TEXT,
+    strand TEXT,
+    id TEXT NOT NULL,
+    exon_number TEXT,
+    PRIMARY KEY (parent, featuretype, start, id)
+) WITHOUT ROWID
+"""
+
+_COLUMNS = 'id, seqid, featuretype, start, end, strand'
+_REGION = ' AND seqid = ? AND start <= ? AND end >= ?'
+_CHILDREN = (f"SELECT {_COLUMNS}, exon_number FROM child_features "
+             "WHERE parent = ? AND featuretype = ?")
+# Databases without child_features; attributes are reduced to exon_number in Python
+_CHILDREN_JOIN = (f"SELECT {_COLUMNS}, attributes FROM relations "
+                  "JOIN features ON features.id = relations.child "
+                  "WHERE parent = ? AND level = 1 AND featuretype = ?")
+_ORDER = ' ORDER BY start'
+
+def _exon_number(attributes: str) -> str:
+    """exon_number attribute of a gffutils attributes JSON, comma-joined, or None."""
+    numbers = json.loads(attributes).get('exon_number') if attributes else None
+    return ','.join(numbers) if numbers else None
+
+def has_child_features(conn: sqlite3.Connection) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'child_features'"
+    ).fetchone() is not None
+
+def add_child_features(conn: sqlite3.Connection) -> None:
+    """Create and fill the child_features table from features and relations."""
+    conn.execute(CHILD_FEATURES_SCHEMA)
+    rows = conn.execute(
+        'SELECT relations.parent, features.featuretype, features.start, features.end, '
+        'features.seqid, features.strand, features.id, features.attributes '
+        'FROM relations JOIN features ON features.id = relations.child '
+        'WHERE relations.level = 1').fetchall()
+    conn.executemany(
+        'INSERT INTO child_features VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        sorted(row[:7] + (_exon_number(row[7]),) for row in rows))
+
+def index_children(path: str) -> bool:
+    """Add child_features to the database at `path` if it has none. True if added."""
+    conn = sqlite3.connect(path)
+    try:
+        if has_child_features(conn):
+            return False
+        add_child_features(conn)
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+
+class Feature:
+    """The columns of a GENCODE feature the scoring stages use."""
+    __slots__ = ('id', 'seqid', 'featuretype', 'start', 'end', 'strand', 'attributes')
+
+    def __init__(self, id, seqid, featuretype, start, end, strand, exon_number):
+        self.id, self.seqid, self.featuretype = id, seqid, featuretype
+        self.start, self.end, self.strand = start, end, strand
+        self.attributes = {'exon_number': exon_number.split(',')} if exon_number else {}
+
+    def __repr__(self):
+        return f"<Feature {self.featuretype} ({self.seqid}:{self.start}-{self.end}[{self.strand}]) {self.id}>"
+
+
+class GencodeDB:
+    def __init__(self, path: str, mmap_size: int = SQLITE_MMAP_SIZE):
+        self.path = path
+        self._featuredb = None
+        uri = f"file:{os.path.abspath(path)}?mode=ro&immutable=1"
+        self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.conn.execute(f'PRAGMA mmap_size = {int(mmap_size)}')
+        self.conn.execute('PRAGMA query_only = ON')
+        self.conn.execute('PRAGMA temp_store = MEMORY')
+        self.indexed = has_child_features(self.conn)
+        if self.indexed:
+            query, self._decode = _CHILDREN, None
+        else:
+            query, self._decode = _CHILDREN_JOIN, _exon_number
+        self._children = query + _ORDER
+        self._children_in_region = query + _REGION + _ORDER
+
+    def children(self, id, featuretype=None, limit=None, **kwargs):
+        """
+        Direct children of `id` of one feature type, ordered by start. With
+        `limit` (seqid, start, end), only those overlapping the region.
+        Other arguments are handled by gffutils.FeatureDB.children.
+        """
+        if featuretype is None or not isinstance(featuretype, str) or kwargs \
+                or not isinstance(id, str):
+            return self.featuredb.children(id, featuretype=featuretype, limit=limit, **kwargs)
+        if limit is None:
+            rows = self.conn.execute(self._children, (id, featuretype))
+        else:
+            seqid, start, end = limit
+            rows = self.conn.execute(self._children_in_region,
+                                     (id, featuretype, seqid, int(end), int(start)))
+        if self._decode is None:
+            return (Feature(*row) for row in rows)
+        return (Feature(*row[:6], self._decode(row[6])) for row in rows)
+
+    def region(self, region=None, featuretype=None, **kwargs):
+        """
+        Features of one type overlapping region (seqid, start, end). Bins
+        restrict the scan as in gffutils' completely_within queries; the
+        overlap test is the one of FeatureDB.region. Other arguments are
+        handled by gffutils.FeatureDB.region.
+        """
+        if not isinstance(region, tuple) or not isinstance(featuretype, str) or kwargs:
+            return self.featuredb.region(region=region, featuretype=featuretype, **kwargs)
+        seqid, start, end = region
+        _bins = tuple(bins.bins(int(start), int(end), one=False))
+        rows = self.conn.execute(
+            f"SELECT {_COLUMNS} FROM features WHERE seqid = ? AND featuretype = ? "
+            f"AND start <= ? AND end >= ? AND bin IN ({','.join('?' * len(_bins))})",
+            (seqid, featuretype, int(end), int(start)) + _bins)
+        return (Feature(*row, None) for row in rows)
+
+    def execute(self, query: str, args: tuple = ()):
+        """Run a read-only SQL query (as FeatureDB.execute)."""
+        return self.conn.execute(query, args)
+
+    @property
+    def featuredb(self):
+        """gffutils.FeatureDB on the same file, for everything else."""
+        if self._featuredb is None:
+            import gffutils
+            from gffutils import constants
+
+            pragmas = dict(constants.default_pragmas, mmap_size=SQLITE_MMAP_SIZE)
+            self._featuredb = gffutils.FeatureDB(self.path, pragmas=pragmas)
+        return self._featuredb
+
+    def __getattr__(self, name):
+        return getattr(self.featuredb, name)
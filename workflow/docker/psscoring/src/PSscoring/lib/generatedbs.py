@@ -1,68 +1,71 @@
 import os
 import sys
+import gzip
+import json
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
 import requests
 
 from pathlib2 import Path
 import gffutils
 import gffutils.pybedtools_integration
+from gffutils import bins, constants
 from absl import app
 from absl import flags
 from absl import logging
 
+try:
+    from lib import fetch
+    from lib.gencodedb import add_child_features
+except ImportError:  # run as a script from lib/
+    import fetch
+    from gencodedb import add_child_features
+
 
 FLAGS = flags.FLAGS
-flags.DEFINE_string(
-    'output_dir', '.', 'Path to output directory', short_name='o')
-flags.DEFINE_string(
-    'release', '43', 'GENCODE release version (e.g., 43)', short_name='r')
-flags.DEFINE_string(
-    'assembly', 'GRCh37', 'Assembly version (GRCh37 or GRCh38)', short_name='a')
 
+# Feature types kept in the GENCODE DB. Everything the scoring stages query
+# (transcript regions, exons, CDS) is covered; UTRs and codons are skipped.
+GTF_FEATURETYPES = ('gene', 'transcript', 'exon', 'CDS')
+
+# For using this script by itself, the GENCODE FTP site can be reached with "https";
+# in the Docker container it is reached with "http"
+GENCODE_BASE_URL = "http://ftp.ebi.ac.uk/pub/databases/gencode/Gencode_human"
 
-def download_gencode_files(release: str, assembly: str, output_dir: str) -> Path:
+
+def download_gencode_files(release: str, assembly: str, output_dir: str,
+                           base_url: str = GENCODE_BASE_URL) -> Path:
     """
-    Download GENCODE GTF file from the GENCODE website.
+    Download GENCODE GTF and GFF3 files from the GENCODE website.
+    Both files are fetched concurrently, resumed if interrupted, and checked
+    against the MD5SUMS of the release.
     """
-    # For using this script by itself, set the base URL to the GENCODE FTP site with "https"
-    # BASE_URL = f"https://ftp.ebi.ac.uk/pub/databases/gencode/Gencode_human/release_{release}"
-    # For using this script in the Docker container, set the base URL to the GENCODE FTP site with "http"
-    BASE_URL = f"http://ftp.ebi.ac.uk/pub/databases/gencode/Gencode_human/release_{release}"
+    release_url = f"{base_url}/release_{release}"
 
     if assembly == 'GRCh37':
         gtf_fn, gff_fn = f"gencode.v{release}lift37.annotation.gtf.gz", f"gencode.v{release}lift37.annotation.gff3.gz"
-        gtf_url, gff_url = f"{BASE_URL}/GRCh37_mapping/{gtf_fn}", f"{BASE_URL}/GRCh37_mapping/{gff_fn}"
+        dir_url = f"{release_url}/GRCh37_mapping"
     elif assembly == 'GRCh38':
         gtf_fn, gff_fn = f"gencode.v{release}.annotation.gtf.gz", f"gencode.v{release}.annotation.gff3.gz"
-        gtf_url, gff_url = f"{BASE_URL}/{gtf_fn}", f"{BASE_URL}/{gff_fn}"
+        dir_url = release_url
     else:
         raise ValueError("Assembly must be either 'GRCh37' or 'GRCh38'.")
 
-    # Check if the GTF file already exists
+    try:
+        checksums = fetch.read_checksums(f"{dir_url}/MD5SUMS")
+    except requests.exceptions.RequestException as e:
+        logging.warning(f"Cannot read GENCODE MD5SUMS ({e}); files are not verified")
+        checksums = {}
+
     gtf_path, gff_path = Path(f"{output_dir}/{gtf_fn}"), Path(f"{output_dir}/{gff_fn}")
-    
-    if gtf_path.exists():
-        logging.info(f"GTF file already exists: {gtf_path}")
-    else:
-        logging.info(f"Downloading GTF file from {gtf_url}")
-        response = requests.get(gtf_url, stream=True)
-        if response.status_code == 200:
-            with open(f"{output_dir}/{gtf_fn}", 'wb') as f:
-                f.write(response.content)
-            logging.info(f"GTF file downloaded to {output_dir}")
-        else:
-            raise f"Failed to download GTF file: {response.status_code}"
-    
-    if gff_path.exists():
-        logging.info(f"GFF file already exists: {gff_path}")
-    else:
-        logging.info(f"Downloading GFF3 file from {gff_url}")
-        response = requests.get(gff_url, stream=True)
-        if response.status_code == 200:
-            with open(f"{output_dir}/{gff_fn}", 'wb') as f:
-                f.write(response.content)
-            logging.info(f"GFF3 file downloaded to {output_dir}")
-        else:
-            raise f"Failed to download GFF3 file: {response.status_code}"
+    fetch.fetch_all([
+        fetch.Remote(f"{dir_url}/{fn}", str(path), checksums.get(fn), 'md5')
+        for fn, path in ((gtf_fn, gtf_path), (gff_fn, gff_path))
+    ])
 
     return gtf_path
 
@@ -76,22 +79,18 @@ def generate_intoron_gtf(db: gffutils.FeatureDB, output: str) -> None:
     
     return None
 
-def main(argv):
-    del argv  # Unused.
-    gtf_path: Path = download_gencode_files(FLAGS.release, FLAGS.assembly, FLAGS.output_dir)
-    
-    # Set the output file names
-    gtf_base_name: str = gtf_path.name.rstrip('.gtf.gz')
-    db_anno_gencode = f"{FLAGS.output_dir}/{gtf_base_name}.gtf.db"
-    intron_gtf = f"{FLAGS.output_dir}/{gtf_base_name}.intron.gtf.gz"
-    db_anno_intron = f"{FLAGS.output_dir}/{gtf_base_name}.intron.gtf.db"
-
+def build_dbs_gffutils(gtf_path: str, db_anno_gencode: str,
+                       intron_gtf: str, db_anno_intron: str) -> None:
+    """
+    Original build path through gffutils.create_db and create_introns.
+    Kept as the reference for benchmarks/gencode_build.py.
+    """
     if not os.path.exists(db_anno_gencode):
-        db = gffutils.create_db(str(gtf_path), db_anno_gencode,
-                                disable_infer_genes=True, 
-                                disable_infer_transcripts=True,
-                                keep_order=True)
-    
+        gffutils.create_db(str(gtf_path), db_anno_gencode,
+                           disable_infer_genes=True,
+                           disable_infer_transcripts=True,
+                           keep_order=True)
+
     if not os.path.exists(db_anno_intron):
         # Create intron information file as GTF
         db = gffutils.FeatureDB(db_anno_gencode)
@@ -99,10 +98,267 @@ def main(argv):
 
         # Create intron DB from above GTF
         gffutils.create_db(intron_gtf, db_anno_intron,
-                        disable_infer_genes=True, 
-                        disable_infer_transcripts=True, 
+                        disable_infer_genes=True,
+                        disable_infer_transcripts=True,
                         keep_order=True,
                         merge_strategy="merge")
 
+
+################################################################################
+##                    Streaming GTF -> gffutils DB builder                    ##
+################################################################################
+
+def _parse_gtf_attributes(attr_str: str) -> dict:
+    attrs = {}
+    for item in attr_str.split(';'):
+        item = item.strip()
+        if not item:
+            continue
+        key, _, value = item.partition(' ')
+        attrs.setdefault(key, []).append(value.strip('"'))
+    return attrs
+
+def _merge_attributes(attr1: dict, attr2: dict) -> dict:
+    """
+    Same result as gffutils.helpers.merge_attributes(numeric_sort=True),
+    without the deep copies.
+    """
+    merged = {}
+    for key in list(attr1) + [k for k in attr2 if k not in attr1]:
+        values = set(attr1.get(key, ())) | set(attr2.get(key, ()))
+        try:
+            merged[key] = [v for _, v in sorted((float(v), v) for v in values)]
+        except ValueError:
+            merged[key] = sorted(values)
+    return merged
+
+def _derive_introns(exons: pd.DataFrame) -> pd.DataFrame:
+    """
+    Introns are the gaps between consecutive exons of a transcript after
+    sorting by start, i.e. what FeatureDB.create_introns yields.
+    """
+    exons = exons.sort_values(['transcript_id', 'start'], kind='stable')
+    tx = exons['transcript_id'].to_numpy()
+    start = exons['start'].to_numpy()
+    end = exons['end'].to_numpy()
+    strand = exons['strand'].to_numpy()
+    row = exons['row'].to_numpy()
+
+    same_tx = tx[:-1] == tx[1:]
+    intron_start = end[:-1] + 1
+    intron_end = start[1:] - 1
+    keep = same_tx & (intron_start <= intron_end)
+
+    return pd.DataFrame({
+        'start': intron_start[keep],
+        'end': intron_end[keep],
+        'strand': np.where(strand[:-1] == strand[1:], strand[1:], '.')[keep],
+        'row_up': row[:-1][keep],
+        'row_down': row[1:][keep],
+    })
+
+def _build_chrom_features(lines: list) -> tuple:
+    """
+    Parse the GTF lines of one chromosome and derive its introns.
+
+    Returns:
+        tuple: (features, introns), both lists of
+               (featuretype, seqid, source, start, end, score, strand, frame,
+                attributes_json, bin, gene_id, transcript_id)
+    """
+    features, parsed = [], []
+    exon_rows = {'transcript_id': [], 'start': [], 'end': [], 'strand': [], 'row': []}
+    for line in lines:
+        seqid, source, featuretype, start, end, score, strand, frame, attr_str = \
+            line.rstrip('\n').split('\t')
+        start, end = int(start), int(end)
+        attrs = _parse_gtf_attributes(attr_str)
+        parsed.append(attrs)
+        gene_id = attrs['gene_id'][0] if attrs.get('gene_id') else None
+        transcript_id = attrs['transcript_id'][0] if attrs.get('transcript_id') else None
+        features.append((featuretype, seqid, source, start, end, score, strand, frame,
+                         json.dumps(attrs, separators=(',', ':')),
+                         bins.bins(start, end, one=True), gene_id, transcript_id))
+        if featuretype == 'exon' and transcript_id is not None:
+            exon_rows['transcript_id'].append(transcript_id)
+            exon_rows['start'].append(start)
+            exon_rows['end'].append(end)
+            exon_rows['strand'].append(strand)
+            exon_rows['row'].append(len(features) - 1)
+
+    introns = []
+    if exon_rows['row']:
+        derived = _derive_introns(pd.DataFrame(exon_rows))
+        for start, end, strand, up, down in derived.itertuples(index=False):
+            attrs = _merge_attributes(parsed[up], parsed[down])
+            introns.append(('intron', features[up][1], 'gffutils_derived', int(start), int(end),
+                            '.', strand, '.', json.dumps(attrs, separators=(',', ':')),
+                            bins.bins(int(start), int(end), one=True),
+                            attrs['gene_id'][0] if attrs.get('gene_id') else None,
+                            attrs['transcript_id'][0] if attrs.get('transcript_id') else None))
+    return features, introns
+
+def iter_gtf_chroms(gtf_path: str, featuretypes: tuple = GTF_FEATURETYPES):
+    """
+    Stream a (gzipped) GTF and yield its feature lines one chromosome at a
+    time. GENCODE GTFs are grouped by chromosome, so only one chromosome is
+    held in memory per pending task.
+    """
+    opener = gzip.open if str(gtf_path).endswith('.gz') else open
+    current, lines = None, []
+    with opener(gtf_path, 'rt') as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            fields = line.split('\t', 3)
+            if fields[2] not in featuretypes:
+                continue
+            if fields[0] != current:
+                if lines:
+                    yield current, lines
+                current, lines = fields[0], []
+            lines.append(line)
+    if lines:
+        yield current, lines
+
+def read_gtf_directives(gtf_path: str) -> list:
+    opener = gzip.open if str(gtf_path).endswith('.gz') else open
+    directives = []
+    with opener(gtf_path, 'rt') as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            if line.startswith('##'):
+                directives.append(line[2:].rstrip('\n'))
+    return directives
+
+class _FeatureDBWriter:
+    """Writes features and relations with the same schema as gffutils.create_db."""
+    def __init__(self, path: str, dialect: dict, directives: list):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self.conn = sqlite3.connect(self.tmp_path)
+        self.conn.execute('PRAGMA synchronous = OFF')
+        self.conn.execute('PRAGMA journal_mode = OFF')
+        self.conn.executescript(constants.SCHEMA)
+        self.dialect = dialect
+        self.directives = directives
+        self.autoincrements = {}
+
+    def _feature_id(self, featuretype: str, gene_id: str, transcript_id: str) -> str:
+        # Default GTF id_spec of gffutils: genes and transcripts by their
+        # attribute, everything else autoincremented per feature type.
+        if featuretype == 'gene' and gene_id:
+            return gene_id
+        if featuretype == 'transcript' and transcript_id:
+            return transcript_id
+        n = self.autoincrements.get(featuretype, 0) + 1
+        self.autoincrements[featuretype] = n
+        return f"{featuretype}_{n}"
+
+    def add(self, rows: list) -> None:
+        features, relations = [], set()
+        for (featuretype, seqid, source, start, end, score, strand, frame,
+             attributes, _bin, gene_id, transcript_id) in rows:
+            fid = self._feature_id(featuretype, gene_id, transcript_id)
+            features.append((fid, seqid, source, featuretype, start, end, score,
+                             strand, frame, attributes, '[]', _bin))
+            if transcript_id is not None:
+                relations.add((transcript_id, fid, 1))
+            if gene_id is not None:
+                relations.add((gene_id, fid, 2))
+                if transcript_id is not None:
+                    relations.add((gene_id, transcript_id, 1))
+        self.conn.executemany(constants._INSERT, features)
+        # Sorted inserts keep the primary key B-tree appends local.
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO relations (parent, child, level) VALUES (?, ?, ?)',
+            sorted(relations))
+
+    def close(self) -> None:
+        c = self.conn
+        c.executemany('INSERT INTO directives VALUES (?)', ((d,) for d in self.directives))
+        c.execute('INSERT INTO meta (version, dialect) VALUES (?, ?)',
+                  (gffutils.version.version, json.dumps(self.dialect, separators=(',', ':'))))
+        c.executemany('INSERT OR REPLACE INTO autoincrements VALUES (?, ?)',
+                      list(self.autoincrements.items()))
+        c.execute('CREATE INDEX relationsparent ON relations (parent)')
+        c.execute('CREATE INDEX relationschild ON relations (child)')
+        c.execute('CREATE INDEX featuretype ON features (featuretype)')
+        c.execute('CREATE INDEX seqidstartend ON features (seqid, start, end)')
+        c.execute('CREATE INDEX seqidstartendstrand ON features (seqid, start, end, strand)')
+        # Covering index of the children lookups (lib/gencodedb.py)
+        add_child_features(c)
+        c.execute('ANALYZE features')
+        c.commit()
+        c.close()
+        os.replace(self.tmp_path, self.path)
+
+def build_dbs(gtf_path: str, db_anno_gencode: str, db_anno_intron: str,
+              n_workers: int = 1) -> None:
+    """
+    Build the GENCODE DB and the intron DB in a single streaming pass over
+    the GTF. Chromosomes are parsed in parallel; the two SQLite files are
+    written by this process and moved into place when complete.
+    """
+    dialect = gffutils.iterators.DataIterator(str(gtf_path), checklines=10).dialect
+    directives = read_gtf_directives(gtf_path)
+    db_writer = _FeatureDBWriter(db_anno_gencode, dialect, directives)
+    intron_writer = _FeatureDBWriter(db_anno_intron, dialect, [])
+
+    n_workers = max(1, n_workers)
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        # Keep at most two chromosomes per worker in flight, and consume the
+        # results in file order so that IDs match gffutils' numbering.
+        pending = deque()
+        for seqid, lines in iter_gtf_chroms(gtf_path):
+            pending.append((seqid, executor.submit(_build_chrom_features, lines)))
+            while len(pending) >= 2 * n_workers:
+                _write_chrom(pending.popleft(), db_writer, intron_writer)
+        while pending:
+            _write_chrom(pending.popleft(), db_writer, intron_writer)
+
+    db_writer.close()
+    intron_writer.close()
+
+def _write_chrom(item: tuple, db_writer: _FeatureDBWriter,
+                 intron_writer: _FeatureDBWriter) -> None:
+    seqid, future = item
+    features, introns = future.result()
+    db_writer.add(features)
+    intron_writer.add(introns)
+    logging.info(f"{seqid}: {len(features)} features, {len(introns)} introns")
+
+
+def main(argv):
+    del argv  # Unused.
+    gtf_path: Path = download_gencode_files(FLAGS.release, FLAGS.assembly, FLAGS.output_dir)
+
+    # Set the output file names
+    gtf_base_name: str = gtf_path.name.rstrip('.gtf.gz')
+    db_anno_gencode = f"{FLAGS.output_dir}/{gtf_base_name}.gtf.db"
+    intron_gtf = f"{FLAGS.output_dir}/{gtf_base_name}.intron.gtf.gz"
+    db_anno_intron = f"{FLAGS.output_dir}/{gtf_base_name}.intron.gtf.db"
+
+    if FLAGS.engine == 'gffutils':
+        build_dbs_gffutils(gtf_path, db_anno_gencode, intron_gtf, db_anno_intron)
+    elif not (os.path.exists(db_anno_gencode) and os.path.exists(db_anno_intron)):
+        build_dbs(str(gtf_path), db_anno_gencode, db_anno_intron, FLAGS.n_workers)
+
 if __name__ == '__main__':
-    app.run(main)
\ No newline at end of file
+    # Flags are defined here so that the module can be imported without
+    # clashing with the importer's own flags.
+    flags.DEFINE_string(
+        'output_dir', '.', 'Path to output directory', short_name='o')
+    flags.DEFINE_string(
+        'release', '43', 'GENCODE release version (e.g., 43)', short_name='r')
+    flags.DEFINE_string(
+        'assembly', 'GRCh37', 'Assembly version (GRCh37 or GRCh38)', short_name='a')
+    flags.DEFINE_enum(
+        'engine', 'fast', ['fast', 'gffutils'],
+        'DB build path: streaming builder (fast) or gffutils.create_db (gffutils)')
+    flags.DEFINE_integer(
+        'n_workers', os.cpu_count(), 'Number of processes for per-chromosome parsing')
+    app.run(main)
@@ -0,0 +1,245 @@
+"""
+Genic-region prefilter and gene panels.
+
+Keeps variants within a given distance of annotated transcripts and/or of
+splice sites (exon-intron junctions) of the GENCODE transcript model. The
+regions are merged into one sorted interval list per contig, so checking a
+variant costs a single binary search.
+
+Panel regions (a BED file and/or genes resolved through the GENCODE model)
+use the same index. With a tabix/CSI-indexed input only the records in
+these regions are read.
+"""
+import os
+import gzip
+import bisect
+from collections import defaultdict
+from logging import getLogger
+
+import numpy as np
+import pandas as pd
+
+logger = getLogger(__name__)
+
+
+def _norm_chrom(chrom: str) -> str:
+    return chrom[3:] if chrom.startswith('chr') else chrom
+
+def _attribute(attrs: str, key: str) -> str:
+    for item in attrs.rstrip('\n').split(';'):
+        if item.startswith(f"{key}="):
+            return item[len(key) + 1:]
+    return None
+
+def read_transcript_model(gencode_gff: str) -> tuple:
+    """
+    Read transcript spans and exon coordinates from the GENCODE GFF3.
+    Returns:
+        tuple: ({transcript_id: (contig, start, end)}, [(transcript_id, start, end), ...])
+    """
+    transcripts, exons = {}, []
+    with gzip.open(gencode_gff, 'rt') as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            fields = line.split('\t', 8)
+            if fields[2] == 'transcript':
+                transcripts[_attribute(fields[8], 'ID')] = (
+                    _norm_chrom(fields[0]), int(fields[3]), int(fields[4]))
+            elif fields[2] == 'exon':
+                exons.append((_attribute(fields[8], 'Parent'), int(fields[3]), int(fields[4])))
+
+    return transcripts, exons
+
+def _merge(intervals: list) -> tuple:
+    intervals.sort()
+    starts, ends = [], []
+    for start, end in intervals:
+        if starts and start <= ends[-1] + 1:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+def build_genic_index(gencode_gff: str, transcript_flank: int = 0,
+                      splice_flank: int = None) -> dict:
+    """
+    Build the interval index used by the prefilter.
+    Args:
+        gencode_gff (str): Path to the GENCODE GFF3 (gzip or BGZF).
+        transcript_flank (int): Keep variants within this distance (bp) of a
+            transcript. None disables this region type.
+        splice_flank (int): Keep variants within this distance (bp) of an
+            exon-intron junction. None disables this region type.
+    Returns:
+        dict: {contig (without 'chr'): (starts, ends)} of merged, sorted,
+              1-based closed intervals.
+    """
+    if transcript_flank is None and splice_flank is None:
+        raise ValueError("At least one of transcript_flank and splice_flank is required.")
+
+    transcripts, exons = read_transcript_model(gencode_gff)
+
+    regions = defaultdict(list)
+    if transcript_flank is not None:
+        for chrom, start, end in transcripts.values():
+            regions[chrom].append((max(1, start - transcript_flank), end + transcript_flank))
+    if splice_flank is not None:
+        for transcript_id, start, end in exons:
+            chrom, tx_start, tx_end = transcripts[transcript_id]
+            # Junctions lie between start-1/start and end/end+1, except at
+            # the ends of the transcript
+            if start != tx_start:
+                regions[chrom].append((max(1, start - splice_flank), start + splice_flank - 1))
+            if end != tx_end:
+                regions[chrom].append((end - splice_flank + 1, end + splice_flank))
+
+    index = {chrom: _merge(intervals) for chrom, intervals in regions.items()}
+    covered = sum(e - s + 1 for starts, ends in index.values() for s, e in zip(starts, ends))
+    logger.info(f"Genic index: {len(transcripts)} transcripts, "
+                f"{sum(len(s) for s, _ in index.values())} intervals, {covered} bp")
+    return index
+
+def in_genic_regions(index: dict, chrom: str, pos: int) -> bool:
+    starts, ends = index.get(_norm_chrom(chrom), ((), ()))
+    i = bisect.bisect_right(starts, pos) - 1
+    return i >= 0 and pos <= ends[i]
+
+def genic_mask(index: dict, df: pd.DataFrame) -> pd.Series:
+    """Boolean Series, True for rows of df (CHROM, POS) inside the index."""
+    mask = pd.Series(False, index=df.index)
+    chroms = df['CHROM'].astype(str).map(_norm_chrom)
+    for chrom, rows in df.groupby(chroms, sort=False).groups.items():
+        if chrom not in index:
+            continue
+        starts, ends = (np.asarray(a) for a in index[chrom])
+        pos = df.loc[rows, 'POS'].to_numpy(dtype=np.int64)
+        i = np.searchsorted(starts, pos, side='right') - 1
+        mask.loc[rows] = (i >= 0) & (pos <= ends[np.maximum(i, 0)])
+    return mask
+
+def filter_vcf(input_vcf: str, output_vcf: str, index: dict, threads: int = 1) -> tuple:
+    """
+    Stream input_vcf into output_vcf, keeping records inside the index.
+    "-" reads stdin / writes stdout. Output ending with .gz is written as
+    BGZF (with `threads` compression threads) and indexed with tabix.
+    Returns:
+        tuple: (number of records read, number of records kept)
+    """
+    import pysam
+
+    compressed = output_vcf.endswith('.gz')
+    n_read, n_kept = 0, 0
+    with pysam.VariantFile(input_vcf, threads=threads) as vcf_in, \
+         pysam.VariantFile(output_vcf, 'wz' if compressed else 'w', header=vcf_in.header,
+                           threads=threads) as vcf_out:
+        for record in vcf_in:
+            n_read += 1
+            if in_genic_regions(index, record.chrom, record.pos):
+                vcf_out.write(record)
+                n_kept += 1
+
+    if compressed:
+        pysam.tabix_index(output_vcf, preset='vcf', force=True)
+
+    return n_read, n_kept
+
+
+#===============================================================================
+# Gene panels
+#===============================================================================
+def read_bed(bed: str) -> dict:
+    """
+    Read the regions of a BED file (plain or gzip).
+    Returns:
+        dict: {contig (without 'chr'): [(start, end), ...]}, 1-based closed
+    """
+    regions = defaultdict(list)
+    opener = gzip.open if bed.endswith('.gz') else open
+    with opener(bed, 'rt') as f:
+        for line in f:
+            if line.startswith(('#', 'track', 'browser')) or not line.strip():
+                continue
+            chrom, start, end = line.split('\t', 3)[:3]
+            regions[_norm_chrom(chrom)].append((int(start) + 1, int(end)))
+    return regions
+
+def read_gene_list(genes: str) -> list:
+    """Genes from a comma-separated list or a file with one gene per line."""
+    if os.path.isfile(genes):
+        with open(genes) as f:
+            return [line.split('\t')[0].strip() for line in f
+                    if line.strip() and not line.startswith('#')]
+    return [gene.strip() for gene in genes.split(',') if gene.strip()]
+
+def gene_regions(gencode_gff: str, genes: list) -> dict:
+    """
+    Spans of the given genes in the GENCODE GFF3. A gene is matched by
+    symbol (gene_name), HGNC ID (hgnc_id) or Ensembl gene ID with or
+    without version. Raises ValueError if a gene is not found.
+    Returns:
+        dict: {contig (without 'chr'): [(start, end), ...]}
+    """
+    wanted = set(genes)
+    found, regions = set(), defaultdict(list)
+    with gzip.open(gencode_gff, 'rt') as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            fields = line.split('\t', 8)
+            if fields[2] != 'gene':
+                continue
+            gene_id = _attribute(fields[8], 'gene_id') or ''
+            names = {_attribute(fields[8], 'gene_name'), _attribute(fields[8], 'hgnc_id'),
+                     gene_id, gene_id.split('.')[0]} & wanted
+            if names:
+                found |= names
+                regions[_norm_chrom(fields[0])].append((int(fields[3]), int(fields[4])))
+
+    missing = wanted - found
+    if missing:
+        raise ValueError(f"Genes not found in {gencode_gff}: {', '.join(sorted(missing))}")
+    return regions
+
+def build_region_index(*region_sets: dict) -> dict:
+    """Merge region dicts (read_bed, gene_regions) into a genic-style index."""
+    regions = defaultdict(list)
+    for region_set in region_sets:
+        for chrom, intervals in region_set.items():
+            regions[chrom].extend(intervals)
+    index = {chrom: _merge(intervals) for chrom, intervals in regions.items()}
+    covered = sum(e - s + 1 for starts, ends in index.values() for s, e in zip(starts, ends))
+    logger.info(f"Panel index: {sum(len(s) for s, _ in index.values())} intervals, {covered} bp")
+    return index
+
+def overlaps(index: dict, chrom: str, start: int, end: int) -> bool:
+    """True if the 1-based closed interval start-end overlaps the index."""
+    starts, ends = index.get(_norm_chrom(chrom), ((), ()))
+    i = bisect.bisect_right(starts, end) - 1
+    return i >= 0 and ends[i] >= start
+
+def has_index(vcf_path: str) -> bool:
+    return any(os.path.exists(f"{vcf_path}{ext}") for ext in ('.tbi', '.csi'))
+
+def fetch_records(vcf, index: dict, indexed: bool):
+    """
+    Yield the records of an open cyvcf2.VCF that overlap the index, in file
+    order. With `indexed`, each interval is fetched through the
+    tabix/CSI index; otherwise the whole file is scanned.
+    """
+    if not indexed:
+        for v in vcf:
+            if overlaps(index, v.CHROM, v.start + 1, v.end):
+                yield v
+        return
+
+    for contig in vcf.seqnames:
+        starts, ends = index.get(_norm_chrom(contig), ((), ()))
+        prev_end = 0
+        for start, end in zip(starts, ends):
+            for v in vcf(f"{contig}:{start}-{end}"):
+                # A record overlapping the previous interval was already yielded
+                if v.start + 1 >= start or v.start + 1 > prev_end:
+                    yield v
+            prev_end = end
@@ -0,0 +1,57 @@
+"""
+Per-process handles of the file-backed resources.
+
+pysam files and SQLite connections cannot be pickled, so the stages that
+query them (IntronDist, exon_loc, ClinVar, ExInt_INFO, CDS length and the
+pseudoexon check) used to run with DataFrame.apply in the parent process.
+A Handle is a picklable reference to such a resource: the function that
+opens it and its arguments (paths, options). Each process opens the
+resource on first use and keeps it for later calls, so these stages run in
+the worker pool like the others. Attribute access is passed on to the
+opened object.
+"""
+import os
+
+# (process ID, opener key) -> opened object
+_opened = {}
+
+
+class Handle:
+    def __init__(self, opener, *args, attribute: str = None, **kwargs):
+        """
+        Args:
+            opener: Picklable callable (class or module-level function)
+            args, kwargs: Its hashable arguments
+            attribute (str): Hand out this attribute of the opened object,
+                             e.g. one of several resources opened together
+        """
+        self._key = (opener, args, tuple(sorted(kwargs.items())))
+        self._attribute = attribute
+
+    def get(self):
+        """The resource, opened in this process if it is not yet."""
+        key = (os.getpid(), self._key)
+        obj = _opened.get(key)
+        if obj is None:
+            opener, args, kwargs = self._key
+            obj = _opened[key] = opener(*args, **dict(kwargs))
+        return obj if self._attribute is None else getattr(obj, self._attribute)
+
+    def __getattr__(self, name):
+        # Private and special names are never looked up on the resource, so
+        # that pickling (before _key is set) does not recurse
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __repr__(self):
+        opener, args, _ = self._key
+        return f"Handle({getattr(opener, '__name__', opener)}, {', '.join(map(str, args))})"
+
+
+def report() -> dict:
+    """stats() of the resources opened in this process that have one, by opener name."""
+    pid = os.getpid()
+    return {getattr(key[0], '__name__', str(key[0])): obj.stats()
+            for (opened_pid, key), obj in _opened.items()
+            if opened_pid == pid and hasattr(obj, 'stats')}
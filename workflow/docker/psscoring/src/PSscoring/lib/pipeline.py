@@ -0,0 +1,492 @@
+"""
+The annotation chain as a sequence of named stages.
+
+Every stage takes the working DataFrame, the opened resources and the list
+of threshold sets, adds its columns and returns the DataFrame. An engine
+maps stage names to replacement implementations; stages it does not list
+run the reference (row-wise) implementation below. An engine is only used
+in production (PRODUCTION_ENGINE) once benchmarks/equivalence.py reports
+it identical to the reference engine.
+
+Stages declare the columns of other stages they read (`inputs`) next to the
+columns they write, which makes the chain a DAG: a stage waits only for the
+stages writing what it reads (or reading what it overwrites). With the
+worker pool, run_stages starts every stage whose predecessors are done,
+up to `concurrency` at a time, each in a thread of the parent process whose
+row-wise calls go to the shared pool. The parsed VCF columns, and in the
+event chain the annotation columns, are available to every stage.
+"""
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from logging import getLogger
+
+import numpy as np
+import pandas as pd
+
+from . import posparser, splaiparser, predeffect, anno_clinvar, workerpool
+from .handles import Handle
+from .schema import split_column
+from .scoring import map_and_calc_score
+from .transcripts import DEFAULT_SIZE, TranscriptCache
+
+logger = getLogger(__name__)
+
+# name: key used by engines, columns: what the stage writes (for diffing and
+# scheduling), message: progress message logged before the stage, inputs:
+# columns written by other stages that it reads
+Stage = namedtuple('Stage', ['name', 'func', 'columns', 'message', 'inputs'],
+                   defaults=((),))
+
+ELOF_GENES = "/opt/psscoring/eLoF_genes.tsv"
+
+
+def open_resources(paths: dict, weights: dict, genic_index: dict = None, 
+                   transcript_cache: int = DEFAULT_SIZE) -> dict:
+    """
+    Open everything that does not depend on the input VCF. In batch mode this
+    is done once and shared by all samples.
+    Args:
+        paths (dict): Resource paths from resources.load_manifest.
+        weights (dict): PriorityScore weights of the screening codes.
+        genic_index (dict): Optional index from genicfilter.build_genic_index.
+        transcript_cache (int): Number of transcripts kept by the gene model
+                                cache (lib/transcripts.py); 0 disables it.
+    The GENCODE DBs, the GFF3 and ClinVar are lib.handles.Handle, which the
+    parent and every worker open on first use.
+    """
+    import pysam
+    from .scoring import Scoring
+
+    ## eLoF genes list (only HGNC IDs)
+    elofs = pd.read_table(
+        ELOF_GENES, usecols=['HGNC_ID'], sep='\t')
+    elofs_hgnc_ids_with_prefix = elofs['HGNC_ID'].unique().tolist()
+    elofs_hgnc_ids = [re.sub('HGNC:', '', hgnc) for hgnc in elofs_hgnc_ids_with_prefix]
+
+    gene_models = (open_gene_models, paths['gencode_db'], paths['intron_db'], transcript_cache)
+    db = Handle(*gene_models, attribute='db')
+    return {
+        'db': db,
+        'db_intron': Handle(*gene_models, attribute='db_intron'),
+        'enst_index': posparser.build_enst_index(db),
+        'tbx_anno': Handle(pysam.TabixFile, paths['gencode_gff']),
+        'cln_bcf': Handle(pysam.VariantFile, paths['clinvar']),
+        'ccrs_auto': paths['ccrs_auto'],
+        'ccrs_x': paths['ccrs_x'],
+        'elofs_hgnc_ids': elofs_hgnc_ids,
+        'scoring': Scoring(),
+        'weights': weights,
+        'genic_index': genic_index,
+    }
+
+def open_gene_models(gencode_db: str, intron_db: str, transcript_cache: int) -> TranscriptCache:
+    """The GENCODE and intron DBs behind one transcript cache (a Handle opener)."""
+    from .resources import open_gencode_dbs
+
+    db, db_intron = open_gencode_dbs({'gencode_db': gencode_db, 'intron_db': intron_db})
+    return TranscriptCache(db, db_intron, maxsize=transcript_cache)
+
+def apply_thresholds(df, func, thresholds: list, parallel: bool = True, **kwargs):
+    """
+    Row-wise func(row, thresholds=...). With several threshold sets each row
+    uses the set given by its `threshold_set` column.
+    """
+    apply = workerpool.apply if parallel else pd.DataFrame.apply
+    if len(thresholds) == 1:
+        return apply(df, func, thresholds=thresholds[0], axis=1, **kwargs)
+    return apply(df, splaiparser.with_threshold_set,
+                 event_func=func, grid=thresholds, axis=1, **kwargs)
+
+
+#===============================================================================
+# Threshold-independent stages
+#===============================================================================
+def intron_dist(df, res, thresholds):
+    dist = workerpool.apply(
+        df, posparser.signed_distance_to_exon_boundary,
+        db=res['db'], db_intron=res['db_intron'], axis=1)
+    # Without any warning string the distances come back as float64 (also
+    # in the chunks of the worker pool that have none); the later stages
+    # tell exonic (NaN) from intronic variants by the type
+    if dist.dtype.kind == 'f':
+        dist = dist.astype('Int64').astype(object).where(dist.notna(), np.nan)
+    else:
+        dist = pd.Series([int(d) if isinstance(d, float) and not np.isnan(d) else d
+                          for d in dist], index=dist.index, dtype=object)
+    df['IntronDist'] = dist
+    return df
+
+def canonical(df, res, thresholds):
+    return posparser.classifying_canonical(df)
+
+def ex_or_int(df, res, thresholds):
+    df['Ex_or_Int'] = np.where(
+        df['IntronDist'] == "[Warning] Invalid ENST ID", "[Warning] Invalid ENST ID",
+        np.where(df['IntronDist'].isnull(), 'Exonic', 'Intronic'))
+    return df
+
+def exon_loc(df, res, thresholds):
+    df['exon_loc'] = workerpool.apply(
+        df, posparser.calc_exon_loc, tabixfile=res['tbx_anno'], enstcolname='ENST', axis=1)
+    df = pd.concat([df, df['exon_loc'].str.split(':', expand=True)], axis=1)
+    df.rename(columns={0: 'ex_up_dist', 1: 'ex_down_dist'}, inplace=True)
+    df.drop(columns=['exon_loc'], inplace=True)
+    return df
+
+def exon_pos(df, res, thresholds):
+    # Minimum of the upstream and downstream distance
+    df['exon_pos'] = workerpool.apply(df, posparser.select_exon_pos, axis=1)
+    return df
+
+def prc_exon_loc(df, res, thresholds):
+    # Relative exon location
+    df['prc_exon_loc'] = workerpool.apply(df, posparser.calc_prc_exon_loc, axis=1)
+    return df
+
+def exon_splice_site(df, res, thresholds):
+    # Exonic splice sites (1 nt in acceptor site or 3 nts on Donor site)
+    df['exon_splice_site'] = workerpool.apply(df, posparser.extract_splicing_region, axis=1)
+    return df
+
+def splice_type(df, res, thresholds):
+    # Splicing type ('Exonic Acceptor' etc.)
+    df['SpliceType'] = workerpool.apply(df, posparser.select_donor_acceptor, axis=1)
+    return df
+
+def clinvar(df, res, thresholds):
+    df['clinvar_same_pos'] = workerpool.apply(
+        df, anno_clinvar.anno_same_pos_vars, cln_bcf=res['cln_bcf'], axis=1)
+    df['clinvar_same_motif'] = workerpool.apply(
+        df, anno_clinvar.anno_same_motif_vars, cln_bcf=res['cln_bcf'], axis=1)
+    df['same_motif_clinsigs'] = workerpool.apply(
+        df['clinvar_same_motif'], anno_clinvar.extract_same_motif_clinsigs)
+    return df
+
+def exint_info(df, res, thresholds):
+    return splaiparser.annotate_exint_info(df, db=res['db'], db_intron=res['db_intron'])
+
+def variant_id(df, res, thresholds):
+    df['variant_id'] = df['CHROM'].astype(str) + '-' \
+        + df['POS'].astype(str) + '-' + df['REF'] + '-' + df['ALT']
+    return df
+
+def cds_length(df, res, thresholds):
+    df['CDS_Length'] = workerpool.apply(df, predeffect.calc_cds_len, db=res['db'], axis=1)
+    return df
+
+def elof(df, res, thresholds):
+    df['is_eLoF'] = workerpool.apply(
+        df, predeffect.elofs_judge, elofs_hgnc_ids=res['elofs_hgnc_ids'], axis=1
+        )
+    return df
+
+def nmd(df, res, thresholds):
+    df['is_NMD_at_Canon'] = workerpool.apply(df, predeffect.nmd_judge, axis=1)
+    return df
+
+
+#===============================================================================
+# Threshold-dependent stages
+#===============================================================================
+def _event_stage(column: str, func, parallel: bool = True, **res_kwargs):
+    def stage(df, res, thresholds):
+        kwargs = {k: res[v] for k, v in res_kwargs.items()}
+        values = apply_thresholds(df, func, thresholds, parallel=parallel, **kwargs)
+        for name, typed in split_column(column, values).items():
+            df[name] = typed
+        return df
+    stage.__name__ = column
+    return stage
+
+SIZE_COLS = ['Size_Part_ExDel', 'Size_Part_IntRet', 'Size_pseudoexon',
+             'Size_IntRet', 'Size_skipped_exon']
+FRAMESHIFT_COLS = ['is_Frameshift_Part_ExDel', 'is_Frameshift_Part_IntRet',
+                   'is_Frameshift_pseudoexon', 'is_Frameshift_IntRet',
+                   'is_Frameshift_skipped_exon']
+
+def truncation(df, res, thresholds):
+    df['is_10%_truncation'] = df.apply(predeffect.calc_cds_len_shorten, axis=1)
+    return df
+
+def frameshift(df, res, thresholds):
+    for size_col, frame_col in zip(SIZE_COLS, FRAMESHIFT_COLS):
+        df[frame_col] = workerpool.apply(df[size_col], predeffect.frame_check)
+    df['is_Frameshift'] = df[FRAMESHIFT_COLS].any(axis=1)
+    return df
+
+def regions(df, res, thresholds):
+    df['skipped_region'] = workerpool.apply(
+        df, splaiparser.anno_skipped_regions, axis=1)
+    df['deleted_region'] = apply_thresholds(
+        df, splaiparser.anno_deleted_regions, thresholds)
+    return df
+
+def ccrs(df, res, thresholds):
+    # One intersection for all threshold sets
+    return predeffect.anno_ccr_score(df, autoccr=res['ccrs_auto'], xccr=res['ccrs_x'])
+
+def screening(df, res, thresholds):
+    scoring = res['scoring']
+    df['insilico_screening'] = workerpool.apply(df, scoring.insilico_screening, axis=1)
+    df['clinvar_screening'] = workerpool.apply(df, scoring.clinvar_screening, axis=1)
+    df['recalibrated_splai'] = workerpool.apply(df, scoring.recal_scores_in_canon, axis=1)
+    return df
+
+def priority_score(df, res, thresholds):
+    df['PriorityScore'] = workerpool.apply(df, map_and_calc_score, args=(res['weights'],), axis=1)
+    return df
+
+
+EXON_DISTS = ['IntronDist', 'ex_up_dist', 'ex_down_dist', 'exon_pos']
+EXINT_COLS = splaiparser.EXINT_COLS
+
+ANNOTATION_STAGES = [
+    Stage('intron_dist', intron_dist, ['IntronDist'],
+          'Calculate the distance to the nearest splice site in intron variant...'),
+    Stage('canonical', canonical, ['is_Canonical'],
+          'Classify "Canonical" splice site or "Non-canonical" splice site...',
+          inputs=['IntronDist']),
+    Stage('ex_or_int', ex_or_int, ['Ex_or_Int'], None, inputs=['IntronDist']),
+    Stage('exon_loc', exon_loc, ['ex_up_dist', 'ex_down_dist'], None, inputs=['Ex_or_Int']),
+    Stage('exon_pos', exon_pos, ['exon_pos'], None, inputs=['ex_up_dist', 'ex_down_dist']),
+    Stage('prc_exon_loc', prc_exon_loc, ['prc_exon_loc'], None, inputs=EXON_DISTS),
+    Stage('exon_splice_site', exon_splice_site, ['exon_splice_site'], None,
+          inputs=['ex_up_dist', 'ex_down_dist']),
+    Stage('splice_type', splice_type, ['SpliceType'],
+          'Annotating splicing information...', inputs=EXON_DISTS),
+    Stage('clinvar', clinvar, ['clinvar_same_pos', 'clinvar_same_motif', 'same_motif_clinsigs'],
+          'Annotating ClinVar varaints interpretations...',
+          inputs=['IntronDist', 'exon_pos', 'SpliceType']),
+    Stage('exint_info', exint_info, EXINT_COLS,
+          'Annotating Exon/Intron position information...', inputs=['is_Canonical']),
+    Stage('variant_id', variant_id, ['variant_id'], None),
+    Stage('cds_length', cds_length, ['CDS_Length'], 'Predicting CDS change...'),
+    Stage('elof', elof, ['is_eLoF'], None),
+    Stage('nmd', nmd, ['is_NMD_at_Canon'], None, inputs=['curt_Int']),
+]
+
+EVENT_STAGES = [
+    Stage('pseudoexon', _event_stage('Pseudoexon', splaiparser.pseudoexon_activation,
+                                     db_intron='db_intron'),
+          ['Pseudoexon', 'Pseudoexon_status'], 'Predicting splicing events...', inputs=EXINT_COLS),
+    Stage('part_intret', _event_stage('Part_IntRet', splaiparser.partial_intron_retention),
+          ['Part_IntRet', 'Part_IntRet_status'], None, inputs=EXINT_COLS),
+    Stage('part_exdel', _event_stage('Part_ExDel', splaiparser.partial_exon_deletion),
+          ['Part_ExDel', 'Part_ExDel_status'], None, inputs=EXINT_COLS),
+    Stage('exon_skipping', _event_stage('Exon_skipping', splaiparser.exon_skipping),
+          ['Exon_skipping', 'Exon_skipping_status'], None, inputs=EXINT_COLS),
+    Stage('int_retention', _event_stage('Int_Retention', splaiparser.intron_retention),
+          ['Int_Retention', 'Int_Retention_status'], None, inputs=EXINT_COLS),
+    Stage('multiexs', _event_stage('multiexs', splaiparser.multi_exon_skipping),
+          ['multiexs'], None, inputs=EXINT_COLS + ['SpliceType', 'Exon_skipping']),
+    Stage('size_part_exdel',
+          _event_stage('Size_Part_ExDel', splaiparser.anno_partial_exon_del_size),
+          ['Size_Part_ExDel', 'Size_Part_ExDel_status'],
+          'Annotating aberrant splicing size (bp)...', inputs=EXINT_COLS + ['Part_ExDel']),
+    Stage('size_part_intret',
+          _event_stage('Size_Part_IntRet', splaiparser.anno_partial_intron_retention_size),
+          ['Size_Part_IntRet', 'Size_Part_IntRet_status'], None,
+          inputs=EXINT_COLS + ['Part_IntRet']),
+    Stage('size_pseudoexon',
+          _event_stage('Size_pseudoexon', splaiparser.anno_gained_exon_size),
+          ['Size_pseudoexon', 'Size_pseudoexon_status'], None, inputs=['Pseudoexon']),
+    Stage('size_intret',
+          _event_stage('Size_IntRet', splaiparser.anno_intron_retention_size),
+          ['Size_IntRet', 'Size_IntRet_status'], None, inputs=EXINT_COLS + ['Int_Retention']),
+    Stage('size_skipped_exon',
+          _event_stage('Size_skipped_exon', splaiparser.anno_skipped_exon_size),
+          ['Size_skipped_exon', 'Size_skipped_exon_status'], None,
+          inputs=EXINT_COLS + ['SpliceType', 'Exon_skipping', 'multiexs']),
+    Stage('truncation', truncation, ['is_10%_truncation'], None,
+          inputs=['variant_id', 'CDS_Length', 'Exon_skipping', 'Exon_skipping_status',
+                  'Part_ExDel', 'Part_ExDel_status', 'Size_Part_ExDel', 'Size_skipped_exon']),
+    Stage('frameshift', frameshift, FRAMESHIFT_COLS + ['is_Frameshift'], None,
+          inputs=SIZE_COLS),
+    Stage('regions', regions, ['skipped_region', 'deleted_region'], 'Setting up CCRs info...',
+          inputs=EXINT_COLS + ['Exon_skipping', 'Part_ExDel']),
+    Stage('ccrs', ccrs, ['skipped_ccrs', 'deleted_ccrs'], 'Annotating CCRs score',
+          inputs=['skipped_region', 'deleted_region']),
+    Stage('screening', screening,
+          ['insilico_screening', 'clinvar_screening', 'recalibrated_splai'], 'Scoring...',
+          inputs=['IntronDist', 'ex_up_dist', 'ex_down_dist', 'is_Canonical', 'SpliceType',
+                  'is_eLoF', 'is_NMD_at_Canon', 'clinvar_same_pos', 'same_motif_clinsigs',
+                  'is_10%_truncation', 'is_Frameshift', 'skipped_ccrs', 'deleted_ccrs']),
+    Stage('priority_score', priority_score, ['PriorityScore'], None,
+          inputs=['insilico_screening', 'clinvar_screening', 'recalibrated_splai']),
+]
+
+STAGES = ANNOTATION_STAGES + EVENT_STAGES
+
+#===============================================================================
+# Fast engine
+#===============================================================================
+def truncation_vectorized(df, res, thresholds):
+    df['is_10%_truncation'] = predeffect.cds_shortened(df)
+    return df
+
+def elof_vectorized(df, res, thresholds):
+    df['is_eLoF'] = df['HGNC_ID'].isin(res['elofs_hgnc_ids']).to_numpy()
+    return df
+
+def frameshift_vectorized(df, res, thresholds):
+    # Sizes without a value (no event, or a status) are in frame
+    for size_col, frame_col in zip(SIZE_COLS, FRAMESHIFT_COLS):
+        df[frame_col] = (df[size_col] % 3 != 0).to_numpy(dtype=bool, na_value=False)
+    df['is_Frameshift'] = df[FRAMESHIFT_COLS].any(axis=1)
+    return df
+
+# Engines: stage name -> implementation replacing the reference one
+ENGINES = {
+    'reference': {},
+    'fast': {
+        'elof': elof_vectorized,
+        'truncation': truncation_vectorized,
+        'frameshift': frameshift_vectorized,
+    },
+}
+# Engine of scoring runs (ps.py); checked with benchmarks/equivalence.py
+PRODUCTION_ENGINE = 'fast'
+
+
+def stage_graph(stages: list) -> dict:
+    """
+    Stage name -> names of the earlier stages of `stages` it has to wait for:
+    those writing a column it reads or writes, or reading one it writes.
+    """
+    graph = {}
+    for i, stage in enumerate(stages):
+        reads, writes = set(stage.inputs), set(stage.columns)
+        graph[stage.name] = [earlier.name for earlier in stages[:i]
+                             if set(earlier.columns) & (reads | writes)
+                             or set(earlier.inputs) & writes]
+    return graph
+
+def critical_path(stages: list, timings: list) -> tuple:
+    """
+    Longest chain of dependent stages by their time in `timings` (as filled
+    by run_stages), i.e. the shortest possible wall time of the chain.
+    Returns:
+        tuple: (stage names, seconds)
+    """
+    elapsed = {name: seconds for name, seconds, _ in timings}
+    graph = stage_graph([stage for stage in stages if stage.name in elapsed])
+    finish, previous = {}, {}
+    for name, waits_for in graph.items():
+        previous[name] = max(waits_for, key=finish.get, default=None)
+        finish[name] = elapsed[name] + finish.get(previous[name], 0.0)
+    if not finish:
+        return [], 0.0
+    name = max(finish, key=finish.get)
+    path, seconds = [], finish[name]
+    while name is not None:
+        path.append(name)
+        name = previous[name]
+    return path[::-1], seconds
+
+
+def _timed(func, df: pd.DataFrame, res: dict, thresholds: list) -> tuple:
+    start, before = time.perf_counter(), workerpool.snapshot()
+    df = func(df, res, thresholds)
+    return df, time.perf_counter() - start, workerpool.overhead(before, workerpool.snapshot())
+
+def run_stages(df: pd.DataFrame, stages: list, res: dict, thresholds: list,
+               engine: dict = None, log=None, timings: list = None, 
+               checkpoints=None, concurrency: int = 1) -> pd.DataFrame:
+    """
+    Run stages in order. `engine` overrides stage implementations by name;
+    `log` receives the progress messages (e.g. logger.info of the caller).
+    If `timings` is given, (stage name, seconds, worker pool activity) is
+    appended to it for every stage. With `checkpoints`
+    (lib.checkpoint.Checkpoints), the run continues after the last saved
+    stage of `stages`, replacing df by its frame, and checkpointed stages
+    save their output. With `concurrency` > 1 and the worker pool, up to
+    that many independent stages run at once (see _run_concurrently); the
+    result is the same.
+    """
+    engine = engine or {}
+    if checkpoints is not None:
+        first, saved = checkpoints.resume([stage.name for stage in stages])
+        if saved is not None:
+            if log:
+                log(f"Resuming from the checkpoint after stage {stages[first - 1].name}")
+            df, stages = saved, stages[first:]
+    if concurrency > 1 and workerpool.active() and len(df) > 1:
+        return _run_concurrently(df, stages, res, thresholds, engine, log, timings,
+                                 checkpoints, concurrency)
+    for stage in stages:
+        if stage.message and log:
+            log(stage.message)
+        df, elapsed, pool = _timed(engine.get(stage.name, stage.func), df, res, thresholds)
+        if timings is not None:
+            timings.append((stage.name, elapsed, pool))
+        if checkpoints is not None:
+            checkpoints.save(stage.name, df)
+    return df
+
+def _run_concurrently(df, stages, res, thresholds, engine, log, timings, checkpoints,
+                      concurrency):
+    """
+    Start each stage once the stages it waits for (stage_graph) are done,
+    on a shallow copy of the frame at that point, and take back the columns
+    it wrote. Stages run in threads, so their row-wise calls share the
+    worker pool; with fewer than two rows or without the pool the calls
+    would use the resource handles of the parent from several threads.
+    Columns end up in the order of a sequential run, and a checkpoint is
+    saved once all stages up to it are done, without the columns of later
+    stages.
+    """
+    graph = stage_graph(stages)
+    order = [stage.name for stage in stages]
+    added = {}      # stage name -> columns it added, in its order
+    written = {}    # stage name -> columns it replaced
+    running = {}    # future -> (stage, columns of the copy it got)
+    n_saved = 0
+
+    def frame_after(names: list) -> pd.DataFrame:
+        later = [col for name in added if name not in names for col in added[name]]
+        ordered = [col for col in df.columns if not any(col in cols for cols in added.values())]
+        ordered += [col for name in order if name in added for col in added[name]]
+        return df[[col for col in ordered if col not in later]]
+
+    with ThreadPoolExecutor(concurrency, thread_name_prefix='stage') as executor:
+        while len(added) < len(stages):
+            started = {stage.name for stage, _ in running.values()}
+            for stage in stages:
+                if len(running) >= concurrency:
+                    break
+                if stage.name in added or stage.name in started \
+                        or not all(name in added for name in graph[stage.name]):
+                    continue
+                if stage.message and log:
+                    log(stage.message)
+                func = engine.get(stage.name, stage.func)
+                future = executor.submit(_timed, func, df.copy(deep=False), res, thresholds)
+                running[future] = (stage, set(df.columns))
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            # In stage order, so that the same stages give the same frame
+            for future in sorted(done, key=lambda f: order.index(running[f][0].name)):
+                stage, had = running.pop(future)
+                out, elapsed, pool = future.result()
+                added[stage.name] = [col for col in out.columns if col not in had]
+                written[stage.name] = [col for col in stage.columns if col in had]
+                for col in added[stage.name] + written[stage.name]:
+                    df[col] = out[col]
+                if timings is not None:
+                    timings.append((stage.name, elapsed, pool))
+            if checkpoints is None:
+                continue
+            n_done = n_saved
+            while n_done < len(order) and order[n_done] in added:
+                n_done += 1
+            saved = [name for name in order[n_saved:n_done] if name in checkpoints.stages]
+            if not saved:
+                continue
+            names = order[:order.index(saved[-1]) + 1]
+            # The frame after names can not be rebuilt once a later stage
+            # has overwritten one of its columns
+            if not any(written[name] for name in added if name not in names):
+                checkpoints.save(saved[-1], frame_after(names))
+                n_saved = len(names)
+    return frame_after(order)
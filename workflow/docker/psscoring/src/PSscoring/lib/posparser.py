@@ -1,9 +1,13 @@
 import re
+from logging import getLogger
+
 import numpy as np
 import pandas as pd
 import gffutils
 import pysam
 
+logger = getLogger(__name__)
+
 ############ Functions for analysis ############
 def classifying_canonical(df: pd.DataFrame) -> pd.DataFrame:
     # IntronDist: -2, -1, 1, 2 → Canonical
@@ -105,7 +109,7 @@ def signed_distance_to_exon_boundary(
     try:
         abs(closest_distance_s) < abs(closest_distance_e)
     except TypeError:
-        print(boundaries)
+        logger.warning(f"No closest boundary among {boundaries}")
 
     if abs(closest_distance_s) < abs(closest_distance_e):
         closest_distance, closest_sign = closest_distance_s, closest_sign_s
@@ -223,14 +227,76 @@ def extract_splicing_region(row) -> str:
 #         else:
 #             return info
 
+ENST_NOT_AVAILABLE = '[Warning] ENST_with_Ver_not_available'
+
 def fetch_enst_full(row, db: gffutils.interface.FeatureDB):
+    """
+    Original per-row resolution (kept as the reference of resolve_enst_full).
+    """
     query_region = (f"chr{row['CHROM']}", int(row['POS']) - 1, int(row['POS']))
     for t in db.region(region=query_region, featuretype='transcript'):
         if t.id.startswith(row['ENST']):
             return t.id
         else:
             pass
-    return '[Warning] ENST_with_Ver_not_available'
+    return ENST_NOT_AVAILABLE
+
+def build_enst_index(db) -> pd.DataFrame:
+    """
+    Every GENCODE transcript: versionless ID (ENST), ID with version
+    (ENST_Full), contig and span. Built once per run.
+    """
+    rows = db.execute("SELECT id, seqid, start, end FROM features WHERE featuretype = 'transcript'")
+    index = pd.DataFrame([tuple(r) for r in rows], columns=['ENST_Full', 'seqid', 'start', 'end'])
+    index.insert(0, 'ENST', index['ENST_Full'].str.split('.', n=1).str[0])
+    return index
+
+def resolve_enst_full(df: pd.DataFrame, index: pd.DataFrame, 
+                      diagnostics: dict = None) -> pd.Series:
+    """
+    GENCODE ID with version of the VEP transcript (ENST) of every row, as
+    fetch_enst_full: a transcript on the variant's contig overlapping
+    POS-1..POS whose ID starts with the VEP ID. Rows are matched to the index
+    by the versionless ID in one merge.
+    Args:
+        df (pd.DataFrame): Parsed variants (CHROM, POS, ENST)
+        index (pd.DataFrame): build_enst_index
+        diagnostics (dict): If given, filled with the number of unresolved
+                            rows by cause ('not_in_gencode', 'version_mismatch',
+                            'outside_transcript') and 'mismatched_versions',
+                            up to 5 (VEP ID, GENCODE ID) pairs
+    Returns:
+        pd.Series: ENST_Full, ENST_NOT_AVAILABLE where unresolved
+    """
+    query = df['ENST'].astype(str)
+    rows = pd.DataFrame({
+        'row': np.arange(len(df)), 'query': query.to_numpy(), 
+        'ENST': query.str.split('.', n=1).str[0].to_numpy(),
+        'seqid': ('chr' + df['CHROM'].astype(str)).to_numpy(), 
+        'POS': df['POS'].astype(int).to_numpy()})
+    hits = rows.merge(index, on=['ENST', 'seqid'])
+    hits = hits[(hits['start'] <= hits['POS']) & (hits['end'] >= hits['POS'] - 1)
+                & [full.startswith(q) for full, q in zip(hits['ENST_Full'], hits['query'])]]
+    hits = hits.drop_duplicates('row')
+
+    resolved = np.full(len(df), ENST_NOT_AVAILABLE, dtype=object)
+    resolved[hits['row'].to_numpy()] = hits['ENST_Full'].to_numpy()
+    full = pd.Series(resolved, index=df.index)
+
+    if diagnostics is not None:
+        unresolved = rows[full.to_numpy() == ENST_NOT_AVAILABLE]
+        versions = index.groupby('ENST')['ENST_Full'].agg(list).to_dict()
+        known = unresolved['ENST'].isin(versions)
+        mismatch = known & [not any(v.startswith(q) for v in versions.get(key, ()))
+                            for key, q in zip(unresolved['ENST'], unresolved['query'])]
+        pairs = unresolved.loc[mismatch, ['query', 'ENST']].drop_duplicates('query')
+        diagnostics.update({
+            'not_in_gencode': int((~known).sum()),
+            'version_mismatch': int(mismatch.sum()),
+            'outside_transcript': int((known & ~mismatch).sum()),
+            'mismatched_versions': [(q, versions[key][0]) for q, key in pairs.head(5).to_numpy()],
+        })
+    return full
 
 
 def calc_ex_int_num(
@@ -1,21 +1,8 @@
-import os
-import subprocess
 import numpy as np
 import pandas as pd
-from pybedtools import BedTool
-from pandarallel import pandarallel
-
-########   Initialize and setup pandas methods   ########
-pandarallel.initialize(nb_workers=os.cpu_count()-1, progress_bar=False, 
-                       verbose=0, use_memory_fs=False) 
-os.environ['JOBLIB_TEMP_FOLDER'] = '/tmp' 
-
-### Logging setup
-from logging import getLogger, config
-import yaml
-config_path = '/opt/psscoring/logging.yaml'
-with open(config_path, 'r') as f:
-    config.dictConfig(yaml.safe_load(f))
+from logging import getLogger
+
+# Logging is configured by the entry point (ps.py); nothing is set up on import.
 logger = getLogger(__name__)
 
 
@@ -30,42 +17,50 @@ def calc_cds_len(row, db) -> int:
     return cds_length
 
 def calc_cds_len_shorten(row) -> bool:
-    if row['Exon_skipping'] == "Cannot predict splicing event":
+    if pd.notna(row['Exon_skipping_status']):
         return False
-    elif row['Part_ExDel'] == "Cannot predict splicing event":
+    elif pd.notna(row['Part_ExDel_status']):
         return False
     elif row['Exon_skipping']:
-        skipped = int(row['Size_skipped_exon'])
+        shorten = row['Size_skipped_exon']
     elif row['Part_ExDel']:
-        deleted = int(row['Size_Part_ExDel'])
+        shorten = row['Size_Part_ExDel']
     else:
         return False
-    
-    try:
-        skipped
-    except NameError:
-        skipped = 0
-    else:
-        pass
 
-    try:
-        deleted
-    except NameError:
-        deleted = 0
-    else:
-        pass
-    
     if row['CDS_Length'] == 0:
         logger.debug(f"Warning: CDS_Length == 0 in {row['variant_id']}")
         return False
-    
-    shorten_len: int = skipped + deleted
-    shorten_parcent = shorten_len / float(row['CDS_Length'])
+    # No size, e.g. an exon skipping whose exon is unknown
+    if pd.isna(shorten):
+        return False
+
+    shorten_parcent = int(shorten) / float(row['CDS_Length'])
     if shorten_parcent > 0.1:
         return True
     else:
         return False
 
+def cds_shortened(df: pd.DataFrame) -> np.ndarray:
+    """
+    is_10%_truncation for the whole frame; the vectorized calc_cds_len_shorten
+    (pipeline.ENGINES['fast']).
+    """
+    cannot_predict = (df['Exon_skipping_status'].notna() | df['Part_ExDel_status'].notna()
+                      ).to_numpy()
+    skipping = df['Exon_skipping'].to_numpy(dtype=bool, na_value=False)
+    deletion = df['Part_ExDel'].to_numpy(dtype=bool, na_value=False) & ~skipping
+    shorten = df['Size_skipped_exon'].where(
+        skipping, df['Size_Part_ExDel'].where(deletion, 0))
+    cds_length = df['CDS_Length'].astype('float64')
+
+    no_cds = ~cannot_predict & (skipping | deletion) & (cds_length == 0).to_numpy()
+    for variant_id in df.loc[no_cds, 'variant_id']:
+        logger.debug(f"Warning: CDS_Length == 0 in {variant_id}")
+    longer = (shorten / cds_length.where(cds_length != 0) > 0.1
+              ).to_numpy(dtype=bool, na_value=False)
+    return ~cannot_predict & (skipping | deletion) & longer
+
 def elofs_judge(row, elofs_hgnc_ids: list) -> bool:
     """
     Determine if the gene is included in eLoFs genes
@@ -87,9 +82,8 @@ def nmd_judge(row):
     else:
         max_intron: int = -1
 	
-    try:
-        curt_int = row['ExInt_INFO']['curt_Int']
-    except:
+    curt_int = row['curt_Int']
+    if pd.isna(curt_int):
         return 'Exonic (Non-Canonical)'
     else:
         # query_enst = row['ENST_Full']
@@ -110,21 +104,18 @@ def nmd_judge(row):
 
 # Determine inframe or frameshift
 def frame_check(x):
-    if np.isnan(x):
+    # <NA> when there is no event or it cannot be predicted
+    if pd.isna(x):
         return False
-    else:   
-        if x % 3 == 0:
-            return False
-        elif x % 3 != 0:
-            return True
-        else:
-            print('Error: frame_check()')
-            return False
-
+    elif x % 3 == 0:
+        return False
+    else:
+        return True
 
 def anno_ccr_score(df: pd.DataFrame, autoccr: str, xccr: str) -> pd.DataFrame:
-    def fetch_ccr_score(row, col):
-        region = row[col]
+    from pybedtools import BedTool
+
+    def fetch_ccr_score(region):
         if isinstance(region, str):
             split_region = region.split(' ')
             region_tuple = (split_region[0], split_region[1], split_region[2])
@@ -132,7 +123,7 @@ def anno_ccr_score(df: pd.DataFrame, autoccr: str, xccr: str) -> pd.DataFrame:
         else:
             return np.nan
         
-        return results_dict.get(region_tuple, None)
+        return results_dict.get(region_tuple, np.nan)
     
     # Create skipped or deleted region bed file
     df_skip = df[df['skipped_region'].notnull()].copy()
@@ -171,10 +162,9 @@ def anno_ccr_score(df: pd.DataFrame, autoccr: str, xccr: str) -> pd.DataFrame:
         if query_key not in results_dict or score > results_dict[query_key]:
             results_dict[query_key] = score
 
-    df['skipped_ccrs'] = df.parallel_apply(
-        fetch_ccr_score, col='skipped_region', axis=1)
-    df['deleted_ccrs'] = df.parallel_apply(
-        fetch_ccr_score, col='deleted_region', axis=1)
+    # A dict lookup per row: cheaper in-process than shipping rows to workers
+    df['skipped_ccrs'] = df['skipped_region'].map(fetch_ccr_score)
+    df['deleted_ccrs'] = df['deleted_region'].map(fetch_ccr_score)
 
     return df
 
@@ -1,97 +1,71 @@
-import re
 
 import gffutils
 import pandas as pd
-from cyvcf2 import VCF
 
 from . import posparser
+from .vcfdecode import decode_vcf
+from .schema import apply_parsed_schema
 # from .deco import print_filtering_count
 
 
-def parse_vcf(raw_vcf: str, db: gffutils.interface.FeatureDB) -> pd.DataFrame:
+def parse_vcf(raw_vcf, db: gffutils.interface.FeatureDB, threads: int = 1, 
+              records: list = None, regions: dict = None, indexed: bool = None, 
+              enst_index: pd.DataFrame = None, enst_diagnostics: dict = None, 
+              limit: int = None) -> pd.DataFrame:
     """Parse VCF file and extract relevant information
     Args:
-        raw_vcf (str): Path to the VCF file
+        raw_vcf (str or cyvcf2.VCF): Path to the VCF file, "-" or an open VCF
         db (str): Path to the GTF database
+        threads (int): BGZF decompression threads
+        records (list): Collects the input records (see vcfdecode.decode_vcf)
+        regions (dict): Only parse records in these regions
+        indexed (bool): Fetch the regions through the input's index
+        enst_index (pd.DataFrame): posparser.build_enst_index, built from db
+                                   if not given
+        enst_diagnostics (dict): Filled with the unresolved ENST IDs by cause
+                                 (see posparser.resolve_enst_full)
+        limit (int): Parse at most this many records (see vcfdecode.decode_vcf)
     Returns:
         pd.DataFrame: DataFrame containing parsed VCF information
     """
-
-    header = VCF(raw_vcf).header_iter()
-    for h in header:
-        try:
-            h['ID']
-        except KeyError:
-            continue
-        else:
-            if h['ID'] == 'CSQ':
-                vep_cols_list = h['Description'].split('Format: ')[1].rstrip('"').split('|')
-            elif h['ID'] == 'SpliceAI':
-                splai_cols_list = h['Description'].split('Format: ')[1].rstrip('"').split('|')
-            else:
-                pass
-
-    cols = [
-        'CHROM', 'POS', 'REF', 'ALT', 'GeneSymbol', 'SymbolSource', 'HGNC_ID', 
-        'ENST', 'HGVSc', 'Consequence', 'EXON', 'INTRON', 'Strand',
-        'DS_AG', 'DS_AL', 'DS_DG', 'DS_DL', 
-        'DP_AG', 'DP_AL', 'DP_DG', 'DP_DL', 'maxsplai', 'loftee' 
-    ]
-    vepidx: dict = {col: i for i, col in enumerate(vep_cols_list)}
-    splaidx: dict = {col: i for i, col in enumerate(splai_cols_list)}
-    df = pd.DataFrame(columns=cols)
-
-    for v in VCF(raw_vcf):
-        vep: list = v.INFO.get('CSQ').split('|')
-
-        # Get HGVSc from VEP
-        try:
-            hgvsc = re.search('(?<=:).*',vep[vepidx['HGVSc']])[0]
-        except TypeError:
-            hgvsc = "NA"
-
-        # Get SpliceAI scores
-        if v.INFO.get('SpliceAI'):
-            splai: list = v.INFO.get('SpliceAI').split(',')[0].split('|')
-        else:
-            splai = ['NA'] * len(splai_cols_list)
-
-        # Convert strand to +/- 
-        strand = lambda s: '+' if s == '1' else '-'
-
-        # Get max SpliceAI scores
-        ds_ag: float = splai[splaidx['DS_AG']]
-        ds_al: float = splai[splaidx['DS_AL']]
-        ds_dg: float = splai[splaidx['DS_DG']]
-        ds_dl: float = splai[splaidx['DS_DL']]
-        if splai[splaidx['DP_AG']] == 'NA':
-            maxsplai: str = "NA"
-        maxsplai: float = max(ds_ag, ds_al, ds_dg, ds_dl)
-    
-        # Add df row
-        df = pd.concat(
-            [df, pd.DataFrame(
-                [
-                    [
-                        v.CHROM, v.POS, v.REF, v.ALT[0], 
-                        vep[vepidx['SYMBOL']], vep[vepidx['SYMBOL_SOURCE']], 
-                        vep[vepidx['HGNC_ID']], vep[vepidx['Feature']], hgvsc, 
-                        vep[vepidx['Consequence']], vep[vepidx['EXON']], 
-                        vep[vepidx['INTRON']], strand(vep[vepidx['STRAND']]), 
-                        ds_ag, ds_al, ds_dg, ds_dl, 
-                        splai[splaidx['DP_AG']], splai[splaidx['DP_AL']], 
-                        splai[splaidx['DP_DG']], splai[splaidx['DP_DL']],
-                        maxsplai, vep[vepidx['LoF']], 
-                    ]
-                ],
-                columns=cols
-                )
-            ], ignore_index=True)
-        
+    df = decode_vcf(raw_vcf, threads=threads, records=records, 
+                    regions=regions, indexed=indexed, limit=limit)
     df.drop_duplicates(inplace=True)
 
     # Annotate full ENST IDs with GTF database
-    df['ENST_Full'] = df.apply(posparser.fetch_enst_full, db=db, axis=1)
+    if enst_index is None:
+        enst_index = posparser.build_enst_index(db)
+    df['ENST_Full'] = posparser.resolve_enst_full(df, enst_index, enst_diagnostics)
     df = df.fillna({'loftee': 'NANANANANNA'})
 
-    return df
+    return apply_parsed_schema(df)
+
+
+def plan_annotation(df: pd.DataFrame, genic_index: dict = None) -> tuple:
+    """
+    Split parsed variants into rows that go through the annotation chain and
+    rows that cannot receive a PriorityScore. Skipped rows are left unscored
+    in the output VCF.
+    - Non-HGNC symbols are dropped before scoring.
+    - With a genic index (lib.genicfilter), variants outside it are dropped.
+    - Variants without SpliceAI scores are scored "Not available"; these are
+      kept in the result (unscored) as before.
+    Args:
+        df (pd.DataFrame): DataFrame returned by parse_vcf
+        genic_index (dict): Optional index from genicfilter.build_genic_index
+    Returns:
+        tuple: (rows to annotate, rows to pass through unscored, skip counts)
+    """
+    not_hgnc = df['SymbolSource'] != 'HGNC'
+    if genic_index is not None:
+        from .genicfilter import genic_mask
+        outside_genic = ~not_hgnc & ~genic_mask(genic_index, df)
+    else:
+        outside_genic = pd.Series(False, index=df.index)
+    dropped = not_hgnc | outside_genic
+    no_spliceai = ~dropped & df['maxsplai'].isna()
+    counts = {'not_hgnc': int(not_hgnc.sum()), 
+              'outside_genic': int(outside_genic.sum()),
+              'no_spliceai': int(no_spliceai.sum())}
+
+    return df[~dropped & ~no_spliceai].copy(), df[no_spliceai].copy(), counts
@@ -0,0 +1,261 @@
+import os
+import json
+import glob
+import time
+import fcntl
+import hashlib
+import subprocess
+from contextlib import contextmanager
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+MANIFEST_NAME = 'psscoring.manifest.json'
+MANIFEST_VERSION = 1
+LOCK_NAME = '.psscoring.prepare.lock'
+
+CCRS_BASE_URL = "https://s3.us-east-2.amazonaws.com/ccrs/ccrs"
+CCRS_FILES = ('ccrs.autosomes.v2.20180420.bed.gz', 'ccrs.xchrom.v2.20180420.bed.gz')
+
+
+def gencode_base(resources: str, release: str, assembly: str) -> str:
+    if assembly == 'GRCh37':
+        return f"{resources}/gencode.v{release}lift37.annotation"
+    elif assembly == 'GRCh38':
+        return f"{resources}/gencode.v{release}.annotation"
+    else:
+        raise ValueError("Assembly must be either 'GRCh37' or 'GRCh38'.")
+
+def gencode_paths(resources: str, release: str, assembly: str) -> dict:
+    """
+    Derived GENCODE resources. The GFF3 is the sorted BGZF copy of the
+    downloaded `<base>.gff3.gz`, which is kept as is so that it still matches
+    the MD5SUMS of the release.
+    """
+    base = gencode_base(resources, release, assembly)
+    return {
+        'gencode_db': f"{base}.gtf.db",
+        'intron_db': f"{base}.intron.gtf.db",
+        'gencode_gff': f"{base}.sorted.gff3.gz",
+        'gencode_gff_index': f"{base}.sorted.gff3.gz.tbi",
+    }
+
+def find_clinvar(resources: str, assembly: str) -> dict:
+    """
+    The ClinVar dataset is built outside of ps.py (generate_clinvar_dataset.sh).
+    When several dated datasets exist, the newest one is used.
+    """
+    pattern = f"{resources}/Filtered_BCF_{assembly}_*-*/clinvar_{assembly}.germline.nocoflicted.bcf.gz"
+    for clinvar_file in sorted(glob.glob(pattern), reverse=True):
+        clinvar_index = glob.glob(f"{clinvar_file}.*i")
+        if clinvar_index:
+            return {'clinvar': clinvar_file, 'clinvar_index': clinvar_index[0]}
+
+    raise FileNotFoundError(
+        f"Cannot find the processed ClinVar bcf file in {resources} directory. "
+        f"Please check the directory and try again."
+        f"You can generate it using the 'ss_generate_clinvar_dataset.sh' script.")
+
+def find_ccrs(resources: str) -> dict:
+    ccrs_auto_file_list = glob.glob(f"{resources}/ccrs.autosomes.*.bed.gz")
+    ccrs_x_file_list = glob.glob(f"{resources}/ccrs.xchrom.*.bed.gz")
+    if len(ccrs_auto_file_list) == 0 or len(ccrs_x_file_list) == 0:
+        return {}
+
+    return {'ccrs_auto': sorted(ccrs_auto_file_list)[-1], 'ccrs_x': sorted(ccrs_x_file_list)[-1]}
+
+
+#===============================================================================
+# One-time preparation
+#===============================================================================
+@contextmanager
+def prepare_lock(resources: str):
+    """
+    Exclusive lock on the resources directory. Containers sharing the
+    directory wait here instead of building the same files concurrently.
+    """
+    with open(os.path.join(resources, LOCK_NAME), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def sort_and_index_gff3(gencode_gff: str, sorted_gff: str) -> None:
+    """
+    Write the GENCODE GFF3 as sorted BGZF to sorted_gff and create its tabix
+    index. Both files are built next to the target and moved into place at
+    the end; the downloaded gencode_gff is left unchanged.
+    """
+    sorted_bgz = f"{sorted_gff}.tmp.gz"
+    logger.info("Re-compressing and sorting GFF3 for BGZF+Tabix...")
+    cmd = (
+        f"gunzip -c {gencode_gff} | "
+        f"sort -k1,1 -k4,4n | "
+        f"bgzip -c > {sorted_bgz}"
+    )
+    subprocess.run(cmd, shell=True, check=True)
+
+    logger.info("Indexing sorted BGZF-compressed GFF3 with tabix...")
+    subprocess.run(["tabix", "-f", "-p", "gff", sorted_bgz], check=True)
+    os.replace(sorted_bgz, sorted_gff)
+    os.replace(f"{sorted_bgz}.tbi", f"{sorted_gff}.tbi")
+    logger.info("Tabix index created successfully.")
+
+def download_ccrs(resources: str, base_url: str = CCRS_BASE_URL) -> None:
+    """
+    Download the CCR files. No checksums are published for them, so a file
+    counts as complete once its size matches the Content-Length.
+    """
+    from lib import fetch
+
+    fetch.fetch_all([fetch.Remote(f"{base_url}/{fn}", os.path.join(resources, fn))
+                     for fn in CCRS_FILES])
+
+def sha256sum(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_record(path: str, resources: str) -> dict:
+    st = os.stat(path)
+    return {
+        'path': os.path.relpath(path, resources),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'sha256': sha256sum(path),
+    }
+
+def tool_versions() -> dict:
+    import gffutils
+    import pysam
+
+    return {'gffutils': gffutils.__version__, 'pysam': pysam.__version__}
+
+def write_manifest(resources: str, manifest: dict) -> str:
+    path = os.path.join(resources, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+def prepare(resources: str, release: str, assembly: str, n_workers: int = 1) -> dict:
+    """
+    Build every derived resource that is missing (GENCODE DBs, sorted and
+    indexed GFF3, CCR files), then record them with their checksums in
+    `psscoring.manifest.json`. Safe to run from several processes at once.
+    """
+    with prepare_lock(resources):
+        paths = gencode_paths(resources, release, assembly)
+        raw_gff = f"{gencode_base(resources, release, assembly)}.gff3.gz"
+
+        if not (os.path.exists(paths['gencode_db']) and os.path.exists(paths['intron_db'])
+                and (os.path.exists(paths['gencode_gff']) or os.path.exists(raw_gff))):
+            from lib import generatedbs
+
+            logger.info("Building GENCODE databases...")
+            gtf_path = generatedbs.download_gencode_files(release, assembly, resources)
+            generatedbs.build_dbs(str(gtf_path), paths['gencode_db'], paths['intron_db'],
+                                  n_workers)
+        else:
+            from lib.gencodedb import index_children
+
+            # DBs built before the child_features table existed
+            for db_path in (paths['gencode_db'], paths['intron_db']):
+                if index_children(db_path):
+                    logger.info(f"Added child_features to {db_path}")
+
+        is_sorted = (os.path.exists(paths['gencode_gff'])
+                     and os.path.exists(paths['gencode_gff_index']))
+        if is_sorted and os.path.exists(raw_gff):
+            # The GFF3 was (re)downloaded after the last sort
+            is_sorted = os.path.getmtime(raw_gff) <= os.path.getmtime(paths['gencode_gff_index'])
+        if not is_sorted:
+            sort_and_index_gff3(raw_gff, paths['gencode_gff'])
+
+        ccrs = find_ccrs(resources)
+        if not ccrs:
+            logger.info("Downloading CCRs...")
+            download_ccrs(resources)
+            ccrs = find_ccrs(resources)
+        paths.update(ccrs)
+        paths.update(find_clinvar(resources, assembly))
+
+        logger.info("Computing checksums...")
+        manifest = {
+            'manifest_version': MANIFEST_VERSION,
+            'release': release,
+            'assembly': assembly,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'tools': tool_versions(),
+            'files': {name: file_record(path, resources) for name, path in paths.items()},
+        }
+        manifest_path = write_manifest(resources, manifest)
+        logger.info(f"Manifest written: {manifest_path}")
+
+    return manifest
+
+
+#===============================================================================
+# Startup validation
+#===============================================================================
+def load_manifest(resources: str, release: str, assembly: str) -> dict:
+    """
+    Read the manifest written by `ps.py prepare` and return absolute paths of
+    the resources. Files are checked by size and mtime, so this costs one
+    stat call per file regardless of their size. A file whose mtime changed
+    but not its size (e.g. copied without preserving times) is checked
+    against its recorded sha256 instead.
+    """
+    manifest_path = os.path.join(resources, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(
+            f"{manifest_path} not found. Run `ps.py prepare --resources {resources}` first.")
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    if manifest.get('manifest_version') != MANIFEST_VERSION:
+        raise ValueError(
+            f"Unsupported manifest version in {manifest_path}. Re-run `ps.py prepare`.")
+    if (manifest['release'], manifest['assembly']) != (release, assembly):
+        raise ValueError(
+            f"{manifest_path} was prepared for release {manifest['release']} "
+            f"({manifest['assembly']}), not {release} ({assembly}). Re-run `ps.py prepare`.")
+
+    paths = {}
+    for name, record in manifest['files'].items():
+        path = os.path.join(resources, record['path'])
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"{path} listed in {manifest_path} is missing. "
+                                    f"Re-run `ps.py prepare`.")
+        if st.st_size != record['size']:
+            raise ValueError(f"{path} has changed since {manifest_path} was written. "
+                             f"Re-run `ps.py prepare`.")
+        if st.st_mtime_ns != record['mtime_ns']:
+            if sha256sum(path) != record['sha256']:
+                raise ValueError(f"{path} has changed since {manifest_path} was written. "
+                                 f"Re-run `ps.py prepare`.")
+            logger.warning(f"{path} has a different mtime than in {manifest_path} but the "
+                           f"same content; copy the resources with their times preserved "
+                           f"(cp -p, rsync -t) to skip this check")
+        paths[name] = path
+
+    return paths
+
+def manifest_checksums(resources: str) -> dict:
+    """{resource name: sha256} as recorded in the manifest."""
+    with open(os.path.join(resources, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    return {name: record['sha256'] for name, record in sorted(manifest['files'].items())}
+
+def open_gencode_dbs(paths: dict) -> tuple:
+    """Read-only GencodeDB (lib/gencodedb.py) of the GENCODE DB and the intron DB."""
+    from lib.gencodedb import GencodeDB
+
+    return GencodeDB(paths['gencode_db']), GencodeDB(paths['intron_db'])
@@ -0,0 +1,201 @@
+"""
+Column types of the working DataFrame.
+
+Columns filled by parse_vcf are typed as soon as they are parsed, so the
+annotation functions read numbers instead of re-parsing strings. The
+splicing event flags and sizes are typed as their stage writes them
+(split_column): sentinel strings such as "Cannot predict splicing event"
+are moved into a `<column>_status` category, so the later event stages
+work on boolean and integer columns. The other annotation columns are
+typed the same way once the chain has finished ("[Warning] Invalid ENST
+ID" and the like).
+
+SpliceAI delta scores are kept as float64 while scoring, because they are
+compared against thresholds given as decimals (e.g. 0.02 >= 0.02 does not
+hold in float32).
+"""
+import numpy as np
+import pandas as pd
+
+SPLICEAI_DS_COLS = ['DS_AG', 'DS_AL', 'DS_DG', 'DS_DL']
+SPLICEAI_DP_COLS = ['DP_AG', 'DP_AL', 'DP_DG', 'DP_DL']
+
+# Columns with a small vocabulary of repeated values
+PARSED_CATEGORY_COLS = ['CHROM', 'SymbolSource', 'Strand', 'Consequence', 'loftee']
+ANNOTATION_CATEGORY_COLS = [
+    'is_Canonical', 'Ex_or_Int', 'exon_splice_site', 'SpliceType', 'multiexs',
+    'is_NMD_at_Canon', 'insilico_screening', 'clinvar_screening', 'recalibrated_splai',
+]
+
+# Numeric columns that may also hold a status string instead of a value
+NUMERIC_STATUS_COLS = {
+    'IntronDist': 'Int32',
+    'ex_up_dist': 'Int32',
+    'ex_down_dist': 'Int32',
+    'exon_pos': 'Int32',
+    'prc_exon_loc': 'float32',
+    'Size_Part_ExDel': 'Int32',
+    'Size_Part_IntRet': 'Int32',
+    'Size_pseudoexon': 'Int32',
+    'Size_IntRet': 'Int32',
+    'Size_skipped_exon': 'Int32',
+    'CDS_Length': 'Int32',
+    'skipped_ccrs': 'float32',
+    'deleted_ccrs': 'float32',
+    'PriorityScore': 'Int32',
+}
+
+# Predicted splicing events: True/False, or "Cannot predict splicing event"
+EVENT_FLAG_COLS = ['Pseudoexon', 'Part_IntRet', 'Part_ExDel', 'Exon_skipping', 'Int_Retention']
+
+BOOL_COLS = [
+    'is_10%_truncation', 'is_eLoF', 'is_Frameshift_Part_ExDel', 'is_Frameshift_Part_IntRet',
+    'is_Frameshift_pseudoexon', 'is_Frameshift_IntRet', 'is_Frameshift_skipped_exon',
+    'is_Frameshift',
+]
+
+# Exon/intron context (splaiparser.EXINT_COLS): ExIntBoundary flags and coordinates
+EXINT_DTYPES = {
+    'ExInt_Boundary': 'UInt8',
+    'eStart': 'Int32', 'eEnd': 'Int32',
+    'curt_Ex': 'Int32', 'curt_ExStart': 'Int32', 'curt_ExEnd': 'Int32',
+    'curt_Int': 'Int32', 'curt_IntStart': 'Int32', 'curt_IntEnd': 'Int32',
+    'prev_Ex': 'Int32', 'prev_ExStart': 'Int32', 'prev_ExEnd': 'Int32',
+    'next_Ex': 'Int32', 'next_ExStart': 'Int32', 'next_ExEnd': 'Int32',
+}
+
+# Free text: parsed fields, ClinVar matches, regions
+STRING_COLS = [
+    'REF', 'ALT', 'GeneSymbol', 'HGNC_ID', 'ENST', 'HGVSc', 'EXON', 'INTRON', 'ENST_Full',
+    'clinvar_same_pos', 'clinvar_same_motif', 'same_motif_clinsigs', 'variant_id',
+    'skipped_region', 'deleted_region',
+]
+
+
+def table_dtypes() -> dict:
+    """
+    dtype of every column of the typed annotation table (after
+    apply_annotation_schema), for writing tables of all samples and runs
+    with the same schema.
+    """
+    dtypes = {'CHROM': 'string', 'POS': 'int32'}
+    dtypes.update(dict.fromkeys(STRING_COLS, 'string'))
+    dtypes.update(dict.fromkeys(PARSED_CATEGORY_COLS[1:] + ANNOTATION_CATEGORY_COLS, 'category'))
+    dtypes.update(dict.fromkeys(SPLICEAI_DS_COLS + ['maxsplai'], 'float32'))
+    dtypes.update(dict.fromkeys(SPLICEAI_DP_COLS, 'Int32'))
+    dtypes.update(EXINT_DTYPES)
+    dtypes.update(dict.fromkeys(BOOL_COLS, 'boolean'))
+    for col, dtype in NUMERIC_STATUS_COLS.items():
+        dtypes[col], dtypes[f"{col}_status"] = dtype, 'category'
+    for col in EVENT_FLAG_COLS:
+        dtypes[col], dtypes[f"{col}_status"] = 'boolean', 'category'
+    return dtypes
+
+
+def apply_parsed_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Type the columns extracted by parse_vcf. Missing SpliceAI scores ('NA')
+    become NaN / <NA>.
+    """
+    if df.empty:
+        return df
+
+    df['POS'] = df['POS'].astype('int32')
+    for col in SPLICEAI_DS_COLS + ['maxsplai']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    for col in SPLICEAI_DP_COLS:
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int32')
+    for col in PARSED_CATEGORY_COLS:
+        df[col] = df[col].astype(str).astype('category')
+
+    return df
+
+def split_status(sr: pd.Series, dtype: str) -> tuple:
+    """
+    Split a column holding numbers and status strings into a typed value
+    column and a categorical status column (<NA> where a value is present).
+    """
+    values = pd.to_numeric(sr, errors='coerce')
+    is_status = sr.notna() & values.isna()
+    return values.astype(dtype), sr.where(is_status).astype('string').astype('category')
+
+def split_flag(sr: pd.Series) -> tuple:
+    """As split_status, for a column of True/False and status strings."""
+    is_flag = sr.map(lambda v: isinstance(v, (bool, np.bool_)))
+    flags = sr.where(is_flag, None).astype('boolean')
+    status = sr.where(~is_flag & sr.notna()).astype('string').astype('category')
+    return flags, status
+
+def split_column(name: str, sr: pd.Series) -> dict:
+    """
+    Column name -> values for a stage writing `name`: an event flag or a
+    numeric column with its status column, anything else as it is.
+    """
+    if name in EVENT_FLAG_COLS:
+        values, status = split_flag(sr)
+    elif name in NUMERIC_STATUS_COLS:
+        values, status = split_status(sr, NUMERIC_STATUS_COLS[name])
+    else:
+        return {name: sr}
+    return {name: values, f"{name}_status": status}
+
+def _retype(df: pd.DataFrame, col: str, dtype: str) -> tuple:
+    """Value and status column of `col`, split now unless its stage did."""
+    status = f"{col}_status"
+    if status not in df.columns:
+        return split_flag(df[col]) if dtype == 'boolean' else split_status(df[col], dtype)
+    # Rows added after the chain (passthrough) hold NaN in both
+    values = df[col].astype(object).where(df[col].notna(), None)
+    if dtype != 'boolean':
+        values = pd.to_numeric(values)
+    return values.astype(dtype), df[status].astype('string').astype('category')
+
+def apply_annotation_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Type the annotation columns after scoring. Columns that are absent are
+    skipped, so this can be used on partial tables as well.
+    """
+    if df.empty:
+        return df
+
+    typed = {}
+    for col, dtype in NUMERIC_STATUS_COLS.items():
+        if col in df.columns:
+            typed[col], typed[f"{col}_status"] = _retype(df, col, dtype)
+    for col in EVENT_FLAG_COLS:
+        if col in df.columns:
+            typed[col], typed[f"{col}_status"] = _retype(df, col, 'boolean')
+    for col in BOOL_COLS:
+        if col in df.columns:
+            typed[col] = df[col].astype('boolean')
+    for col, dtype in EXINT_DTYPES.items():
+        if col in df.columns:
+            typed[col] = df[col].astype(dtype)
+    for col in ANNOTATION_CATEGORY_COLS:
+        if col in df.columns:
+            typed[col] = df[col].astype('category')
+    for col in SPLICEAI_DS_COLS + ['maxsplai']:
+        if col in df.columns:
+            typed[col] = df[col].astype('float32')
+
+    # Keep each status column next to its value column
+    status_cols = {f"{col}_status" for col in NUMERIC_STATUS_COLS} | \
+        {f"{col}_status" for col in EVENT_FLAG_COLS}
+    columns = []
+    for col in df.columns:
+        if col in status_cols:
+            continue
+        columns.append(col)
+        if f"{col}_status" in typed:
+            columns.append(f"{col}_status")
+
+    out = df.copy()
+    for col, values in typed.items():
+        out[col] = values
+    return out[columns]
+
+def memory_per_row(df: pd.DataFrame) -> float:
+    """Bytes per row, including the Python objects held by object columns."""
+    if df.empty:
+        return 0.0
+    return df.memory_usage(index=False, deep=True).sum() / len(df)
@@ -1,7 +1,16 @@
+import numpy as np
 import pandas as pd
 
 bp7_csq: set = {'intron_variant', 'synonymous_variant'}
 
+# Screening codes summed into PriorityScore and their default weights
+SCREENING_COLS: list = ['recalibrated_splai', 'insilico_screening', 'clinvar_screening']
+DEFAULT_WEIGHTS: dict = {
+    's1': 9.0, 's2': 6.0, 's3': 0.0, 's4': -5.0, 
+    's5': -3.0, 's6': 0.0, 's7': 2.0, 's8': 3.0, 's9': 2.0,
+    's10': 4.0, 's11': 2.0, 's12': -1.0, 's13': 0.0, 's14': 1.0, 
+    's15': -5.0, 's0': 0.0}
+
 class Scoring:
     def __init__(self) -> None: 
         self.scores: dict = {}
@@ -20,9 +29,8 @@ class Scoring:
 
     def insilico_screening(self, row) -> str:
         #0. No score
-        try:
-            maxsplai = float(row['maxsplai'])
-        except ValueError:
+        maxsplai = float(row['maxsplai'])
+        if np.isnan(maxsplai):
             return "Not available"
 
         #1. Canonical
@@ -117,5 +125,13 @@ class Scoring:
     def calc_priority_score2(self, df: pd.DataFrame) -> pd.DataFrame:
         df['PriorityScore'] = df['insilico_screening'] + df['clinvar_screening']
         return df
-    
-    
\ No newline at end of file
+
+
+def map_and_calc_score(row, score_map: dict) -> int:
+    """
+    PriortiyScore is the sum of the "clinvar_screening", "insilico_screening", and "recalibrated_splai"
+    """
+    if row['insilico_screening'] == "Not available":
+        return float('nan')
+
+    return int(score_map[row['recalibrated_splai']]) + int(score_map[row['insilico_screening']]) + int(score_map[row['clinvar_screening']])
@@ -1,4 +1,12 @@
+import enum
+from logging import getLogger
+
 import numpy as np
+import pandas as pd
+
+from . import workerpool
+
+logger = getLogger(__name__)
 
 """
 This file's code has been re-implemented in Python based on the SAI10k-calc code 
@@ -6,13 +14,49 @@ This file's code has been re-implemented in Python based on the SAI10k-calc code
 """
 
 def __exits_spliceai_scores(row):
-    if row['maxsplai'] == 'NA' or row['maxsplai'] == '.':
+    # maxsplai is NaN when the variant has no SpliceAI annotation
+    if np.isnan(row['maxsplai']):
         return False
     else:
         return True
 
 
-def calc_exint_info(row, db, db_intron):
+class ExIntBoundary(enum.IntFlag):
+    """Boundary conditions of the exon/intron containing the variant."""
+    NONE = 0
+    NOT_FOUND = 1         # No exon or intron of the transcript at the variant
+    FIRST_EXON = 2        # No previous exon
+    LAST_EXON = 4         # No next exon
+    CENTER_OF_INTRON = 8  # Same distance to both exons, no close exon
+    UNKNOWN = 16          # Close exon could not be determined
+
+
+# Columns filled by calc_exint_info (coordinates are 1-based, <NA> if absent)
+EXINT_COLS = [
+    'ExInt_Boundary', 'eStart', 'eEnd',
+    'curt_Ex', 'curt_ExStart', 'curt_ExEnd',
+    'curt_Int', 'curt_IntStart', 'curt_IntEnd',
+    'prev_Ex', 'prev_ExStart', 'prev_ExEnd',
+    'next_Ex', 'next_ExStart', 'next_ExEnd',
+]
+NA = pd.NA
+_NOT_FOUND = (int(ExIntBoundary.NOT_FOUND),) + (NA,) * (len(EXINT_COLS) - 1)
+
+
+def _boundary(row) -> ExIntBoundary:
+    return ExIntBoundary(int(row['ExInt_Boundary']))
+
+def _has_close_exon(row) -> bool:
+    return not _boundary(row) & (ExIntBoundary.NOT_FOUND
+                                 | ExIntBoundary.CENTER_OF_INTRON
+                                 | ExIntBoundary.UNKNOWN)
+
+
+def calc_exint_info(row, db, db_intron) -> tuple:
+    """
+    Locate the exon or intron of the variant and its neighbouring exons.
+    Returns a tuple of values in the order of EXINT_COLS.
+    """
     query_enst = row['ENST_Full'] 
     chrom, pos = f'chr{row["CHROM"]}', int(row['POS'])
     strand = row['Strand']
@@ -23,7 +67,7 @@ def calc_exint_info(row, db, db_intron):
     elif strand == '-':
         region: tuple = (chrom, pos, pos+1)
     else:
-        print(f'Warning: unkown strand -> {row["ENST_Full"]}')
+        logger.warning(f'Unknown strand -> {row["ENST_Full"]}')
         region: tuple = (chrom, pos-1, pos)
 
     # Fixed
@@ -47,7 +91,7 @@ def calc_exint_info(row, db, db_intron):
                 query_enst, limit=region, featuretype='intron')
             d = next(fetched_data)
         except StopIteration:
-            return 'Warning'
+            return _NOT_FOUND
         else:
             pass
     else:
@@ -61,6 +105,7 @@ def calc_exint_info(row, db, db_intron):
     ## Set attributes and current featuretype
     d_attr: list = d.attributes
     curtFeature = d.featuretype
+    boundary = ExIntBoundary.NONE
 
     ## This step is divided into two parts (Exon or Intron)
     if curtFeature == 'exon':
@@ -78,17 +123,20 @@ def calc_exint_info(row, db, db_intron):
                 else:
                     pass
         else:
-            prevExStart, prevExEnd = '1st_Exon', '1st_Exon'
+            prevExStart, prevExEnd = NA, NA
+            boundary |= ExIntBoundary.FIRST_EXON
 
         #3. Set next exon coordinates
         exons = db.children(query_enst, featuretype='exon')
-        nextExStart, nextExEnd = 'Last_Exon', 'Last_Exon'
+        nextExStart, nextExEnd = NA, NA
         for e in exons:
             if int(e.attributes['exon_number'][0]) == curtExNum + 1:
                 nextExStart, nextExEnd = e.start, e.end
                 break
             else:
                 pass
+        if nextExStart is NA:
+            boundary |= ExIntBoundary.LAST_EXON
 
         #4. Set eStart & eEnd
         eStart = curtExStart
@@ -121,45 +169,38 @@ def calc_exint_info(row, db, db_intron):
                 eStart = prevExStart
                 eEnd = prevExEnd
         elif up == down:
-            eStart = f'center_of_intron:{up}'
-            eEnd = f'center_of_intron:{up}'
+            # Distance to both exons is (variant - intron start + 1)
+            eStart, eEnd = NA, NA
+            boundary |= ExIntBoundary.CENTER_OF_INTRON
         else:
-            eStart = 'unk'
-            eEnd = 'unk'
+            eStart, eEnd = NA, NA
+            boundary |= ExIntBoundary.UNKNOWN
             
     else:
-        return 'Warning'
+        return _NOT_FOUND
 
-    ## Return results as dict type
+    ## Return results in the order of EXINT_COLS
     if d.featuretype == 'exon':
-        results = {'strand': strand, 
-                   'eStart': eStart, 
-                   'eEnd': eEnd,
-                   'curt_Ex': curtExNum, 
-                   'curt_ExStart': curtExStart,
-                   'curt_ExEnd': curtExEnd,
-                   'prev_Ex': int(curtExNum - 1),
-                   'prev_ExStart': prevExStart,
-                   'prev_ExEnd': prevExEnd,
-                   'next_Ex': int(curtExNum + 1), 
-                   'next_ExStart': nextExStart,
-                   'next_ExEnd': nextExEnd}
-
-    else:
-        results = {'strand': strand,
-                   'eStart': eStart,
-                   'eEnd': eEnd,
-                   'curt_Int': curtIntNum, 
-                   'curt_IntStart': curtIntStart, 
-                   'curt_IntEnd': curtIntEnd,
-                   'prev_Ex': curtIntNum, 
-                   'prev_ExStart': prevExStart,
-                   'prev_ExEnd': prevExEnd,
-                   'next_Ex': int(curtIntNum + 1), 
-                   'next_ExStart': nextExStart,
-                   'next_ExEnd': nextExEnd}
-    
-    return results
+        return (int(boundary), eStart, eEnd,
+                curtExNum, curtExStart, curtExEnd,
+                NA, NA, NA,
+                curtExNum - 1, prevExStart, prevExEnd,
+                curtExNum + 1, nextExStart, nextExEnd)
+    else:
+        return (int(boundary), eStart, eEnd,
+                NA, NA, NA,
+                curtIntNum, curtIntStart, curtIntEnd,
+                curtIntNum, prevExStart, prevExEnd,
+                curtIntNum + 1, nextExStart, nextExEnd)
+
+def annotate_exint_info(df: pd.DataFrame, db, db_intron) -> pd.DataFrame:
+    """Add the EXINT_COLS columns (ExInt_Boundary as uint8 flags, others as Int32)."""
+    values = list(workerpool.apply(df, calc_exint_info, db=db, db_intron=db_intron, axis=1)
+                  ) if len(df) else []
+    exint = pd.DataFrame(values, columns=EXINT_COLS, index=df.index)
+    exint = exint.astype({col: 'Int32' for col in EXINT_COLS[1:]})
+    exint['ExInt_Boundary'] = exint['ExInt_Boundary'].astype('uint8')
+    return pd.concat([df, exint], axis=1)
 
 
 #1.   Calculate gained exon size for pusedoexon activation
@@ -188,7 +229,7 @@ def _filtering_DS_Gain_threshold(thresholds: str, **kwargs):
         return 'FAIL'
 
 def _is_partial_effect(**kwargs):
-    strand = kwargs['ExInt_INFO']['strand']
+    strand = kwargs['Strand']
     pAG, pDG = int(kwargs['DP_AG']), int(kwargs['DP_DG'])
 
     if ((strand == '+') & (pAG < pDG)) | ((strand == '-') & (pAG > pDG)):
@@ -255,16 +296,16 @@ def _is_cryptic_Dnr_activation(thresholds: dict, **kwargs):
 def _filtering_Acp_orientation(**kwargs): 
     # 1-based
     posAG: int = int(kwargs['POS']) + int(kwargs['DP_AG'])
-    info: dict = kwargs['ExInt_INFO']
+    boundary = _boundary(kwargs)
 
-    if info == 'Warning':
+    if boundary & ExIntBoundary.NOT_FOUND:
         return 0
 
-    strand = info['strand']
-    prevExStart = info['prev_ExStart']
-    prevExEnd = info['prev_ExEnd']
+    strand = kwargs['Strand']
+    prevExStart = kwargs['prev_ExStart']
+    prevExEnd = kwargs['prev_ExEnd']
 
-    if prevExStart == '1st_Exon':
+    if boundary & ExIntBoundary.FIRST_EXON:
         return '1st_Exon'
     else:
         pass
@@ -278,15 +319,15 @@ def _filtering_Acp_orientation(**kwargs):
 def _filtering_Dnr_orientation(**kwargs):
     # 1-based
     posDG: int = int(kwargs['POS']) + int(kwargs['DP_DG'])
-    info: dict = kwargs['ExInt_INFO']
-    if info == 'Warning':
+    boundary = _boundary(kwargs)
+    if boundary & ExIntBoundary.NOT_FOUND:
         return 0    
 
-    strand = info['strand']
-    nextExStart: int = info['next_ExStart']
-    nextExEnd: int = info['next_ExEnd']
+    strand = kwargs['Strand']
+    nextExStart: int = kwargs['next_ExStart']
+    nextExEnd: int = kwargs['next_ExEnd']
 
-    if nextExStart == 'Last_Exon':
+    if boundary & ExIntBoundary.LAST_EXON:
         return 'Last_Exon'
     else:
         pass
@@ -301,19 +342,12 @@ def _filtering_Dnr_orientation(**kwargs):
 ##. Predicted changed exon size in 5-prime side and 3-prime side
 def _bp_5prime(thresholds: str, **kwargs) -> int:
     posAG: int = int(kwargs['POS']) + int(kwargs['DP_AG'])
-    info: dict = kwargs['ExInt_INFO']
-    if info == 'Warning':
-        return 0
-    if ((kwargs['ExInt_INFO']['eStart'] == 'unk') 
-        | (kwargs['ExInt_INFO']['eEnd'] == 'unk')):
-        return 0
-    if ((str(kwargs['ExInt_INFO']['eStart']).startswith('center_of_intron')) 
-        | (str(kwargs['ExInt_INFO']['eEnd']).startswith('center_of_intron'))):
+    if not _has_close_exon(kwargs):
         return 0
     
-    strand: str = info['strand']
-    eStart: int = int(info['eStart'])
-    eEnd: int = int(info['eEnd'])
+    strand: str = kwargs['Strand']
+    eStart: int = int(kwargs['eStart'])
+    eEnd: int = int(kwargs['eEnd'])
     
     if ((strand == '+') 
         & (_is_cryptic_Acp_activation(thresholds, **kwargs))
@@ -327,24 +361,13 @@ def _bp_5prime(thresholds: str, **kwargs) -> int:
         return 0
 
 def _bp_3prime(thresholds: str, **kwargs) -> int:
-    try:
-        strand: int = kwargs['ExInt_INFO']['strand']
-    except:
-        return 0
-    
-    if ((kwargs['ExInt_INFO']['eStart'] == 'unk') 
-        | (kwargs['ExInt_INFO']['eEnd'] == 'unk')):
-        return 0
-    
-    if ((str(kwargs['ExInt_INFO']['eStart']).startswith('center_of_intron')) 
-        | (str(kwargs['ExInt_INFO']['eEnd']).startswith('center_of_intron'))):
+    if not _has_close_exon(kwargs):
         return 0
 
     posDG: int = int(kwargs['POS']) + int(kwargs['DP_DG'])
-    info: dict = kwargs['ExInt_INFO']
-    strand: int = kwargs['ExInt_INFO']['strand']
-    eStart: int = int(info['eStart'])
-    eEnd: int = int(info['eEnd'])
+    strand: str = kwargs['Strand']
+    eStart: int = int(kwargs['eStart'])
+    eEnd: int = int(kwargs['eEnd'])
 
     if ((strand == '+') 
         & (_is_cryptic_Dnr_activation(thresholds, **kwargs))
@@ -360,12 +383,10 @@ def _bp_3prime(thresholds: str, **kwargs) -> int:
 
 ##. Evaluate orientation and classify Lost exon or Reteined intron
 def _classify_LEX_RIT(**kwargs):
-    try:
-        strand: int = kwargs['ExInt_INFO']['strand']
-    except:
+    if _boundary(kwargs) & ExIntBoundary.NOT_FOUND:
         return 0
     
-    strand = kwargs['ExInt_INFO']['strand']
+    strand = kwargs['Strand']
     pAL, pDL = int(kwargs['DP_AL']), int(kwargs['DP_DL'])
 
     if ((strand == '+') & (pAL < pDL)) | ((strand == '-') & (pAL > pDL)):
@@ -376,25 +397,18 @@ def _classify_LEX_RIT(**kwargs):
 
 ##. Varidate variant position from close exon boundary (50 bp or 250 bp) 
 def _calc_dist_from_exon(**kwargs):
-    try:
-        kwargs['ExInt_INFO']['eStart']
-    except:
-        return 0
-    try:
-        kwargs['ExInt_INFO']['eEnd']
-    except:
+    boundary = _boundary(kwargs)
+    if boundary & ExIntBoundary.NOT_FOUND:
         return 0
     
-    if ((str(kwargs['ExInt_INFO']['eStart']).startswith('center_of_intron')) 
-        | (str(kwargs['ExInt_INFO']['eEnd']).startswith('center_of_intron'))):
-        return int(kwargs['ExInt_INFO']['eStart'].split(':')[1])
+    if boundary & ExIntBoundary.CENTER_OF_INTRON:
+        return int(kwargs['POS']) - int(kwargs['curt_IntStart']) + 1
     
-    if ((kwargs['ExInt_INFO']['eStart'] == 'unk') 
-        | (kwargs['ExInt_INFO']['eEnd'] == 'unk')):
+    if boundary & ExIntBoundary.UNKNOWN:
         return 0
     
     pos = int(kwargs['POS'])
-    eStart, eEnd = int(kwargs['ExInt_INFO']['eStart']), int(kwargs['ExInt_INFO']['eEnd'])
+    eStart, eEnd = int(kwargs['eStart']), int(kwargs['eEnd'])
     dist_exon_start: int = pos - eStart
     dist_exon_end: int = pos - eEnd
     if ((dist_exon_start <= 0) & (dist_exon_end < 0)):
@@ -512,13 +526,11 @@ def exon_skipping(row, thresholds):
         return False
     elif ((_varidate_var_pos_50bp(**row) == 'within_50bp')
           and (lost_exon_size)):
-        info = row['ExInt_INFO']
-
         # When the variant is located in the center of intron, return True
-        if ((info['eEnd'] == 'unk') or (info['eStart'] == 'unk')):
+        if _boundary(row) & (ExIntBoundary.CENTER_OF_INTRON | ExIntBoundary.UNKNOWN):
             return True
         
-        native_exon_length = int(info['eEnd']) - int(info['eStart']) + 1
+        native_exon_length = int(row['eEnd']) - int(row['eStart']) + 1
         if lost_exon_size == native_exon_length:
             return True
         else:
@@ -554,34 +566,35 @@ def multi_exon_skipping(row, thresholds: dict):
         return "Cannot predict splicing event"
     
     if row['Exon_skipping']:
-        info = row['ExInt_INFO']
+        if not _has_close_exon(row):
+            return 'unk'
         lost_exon_size = predict_lost_exon(thresholds=thresholds, **row)
-        native_exon_size = np.abs(int(info['eEnd']) - int(info['eStart']) + 1)
+        native_exon_size = np.abs(int(row['eEnd']) - int(row['eStart']) + 1)
 
         if lost_exon_size == native_exon_size:
             return 'One exon skipping'
         elif lost_exon_size > native_exon_size:
-            print('Assumed multiple exon skipping')
-            if info['strand'] == '+':
+            logger.debug('Assumed multiple exon skipping')
+            if row['Strand'] == '+':
                 if row['SpliceType'] == 'Donor_int':
                     try:
-                        two_exons = int(info['eEnd']) - int(info['prev_ExStart']) + 1
+                        two_exons = int(row['eEnd']) - int(row['prev_ExStart']) + 1
                     except:
                         two_exons = np.nan
                 elif row['SpliceType'] == 'Acceptor_int':
                     try:
-                        two_exons = int(info['next_ExEnd']) - int(info['eStart']) + 1
+                        two_exons = int(row['next_ExEnd']) - int(row['eStart']) + 1
                     except:
                         two_exons = np.nan
             else:
                 if row['SpliceType'] == 'Donor_int':
                     try:
-                        two_exons = int(info['prev_ExEnd']) - int(info['eStart']) + 1
+                        two_exons = int(row['prev_ExEnd']) - int(row['eStart']) + 1
                     except:
                         two_exons = np.nan
                 elif row['SpliceType'] == 'Acceptor_int':
                     try:
-                        two_exons = int(info['eEnd']) - int(info['next_ExStart']) + 1
+                        two_exons = int(row['eEnd']) - int(row['next_ExStart']) + 1
                     except:
                         two_exons = np.nan
             
@@ -646,16 +659,16 @@ def anno_partial_exon_del_size(row, thresholds):
 
 
 def anno_skipped_exon_size(row, thresholds: dict):
-    if row['Exon_skipping']:
+    # <NA> when exon skipping cannot be predicted
+    if pd.notna(row['Exon_skipping']) and row['Exon_skipping']:
         if row['multiexs'] == 'One exon skipping':
             return predict_lost_exon(thresholds=thresholds, **row)
         elif row['multiexs'] == 'Two exons skipping':
-            info = row['ExInt_INFO']
-            current_exon = int(info['eEnd']) - int(info['eStart']) + 1
-            if info['strand'] == '+':
+            current_exon = int(row['eEnd']) - int(row['eStart']) + 1
+            if row['Strand'] == '+':
                 if row['SpliceType'] == 'Donor_int':
                     try:
-                        prev_exon = int(info['prev_ExEnd']) - int(info['prev_ExStart']) + 1
+                        prev_exon = int(row['prev_ExEnd']) - int(row['prev_ExStart']) + 1
                     except:
                         return np.nan
                     else:
@@ -663,7 +676,7 @@ def anno_skipped_exon_size(row, thresholds: dict):
 
                 elif row['SpliceType'] == 'Acceptor_int':
                     try:
-                        next_exon = int(info['next_ExEnd']) - int(info['eStart']) + 1
+                        next_exon = int(row['next_ExEnd']) - int(row['eStart']) + 1
                     except:
                         return np.nan
                     else:
@@ -671,14 +684,14 @@ def anno_skipped_exon_size(row, thresholds: dict):
             else:
                 if row['SpliceType'] == 'Donor_int':
                     try:
-                        prev_exon = int(info['prev_ExEnd']) - int(info['prev_ExStart']) + 1
+                        prev_exon = int(row['prev_ExEnd']) - int(row['prev_ExStart']) + 1
                     except:
                         return np.nan
                     else:
                         return current_exon + prev_exon 
                 elif row['SpliceType'] == 'Acceptor_int':
                     try:
-                        next_exon = int(info['next_ExEnd']) - int(info['eStart']) + 1
+                        next_exon = int(row['next_ExEnd']) - int(row['eStart']) + 1
                     except:
                         return np.nan
                     else:
@@ -696,7 +709,6 @@ def anno_skipped_regions(row):
     else:
         return "Cannot predict splicing event"
     
-    # info: dict = row['ExInt_INFO']
     try:
         strand: str = row['Strand']
     except:
@@ -711,7 +723,7 @@ def anno_skipped_regions(row):
             start = posVar + int(row['DP_DL'])
             end = posVar + int(row['DP_AL'])
         else:
-            print('Warning: unkown strand')
+            logger.warning(f"Unknown strand -> {row['ENST_Full']}")
             return np.nan
     else:
         return np.nan
@@ -724,16 +736,13 @@ def anno_deleted_regions(row, thresholds: dict):
     else:
         return "Cannot predict splicing event"
     
-    info: dict = row['ExInt_INFO']
     try:
         strand: str = row['Strand']
-        eStart: int = int(info['eStart'])
-        eEnd: int = int(info['eEnd'])
+        eStart: int = int(row['eStart'])
+        eEnd: int = int(row['eEnd'])
     except:
         return np.nan 
     
-    eStart: int = int(info['eStart'])
-    eEnd: int = int(info['eEnd'])
     posVar: int = int(row['POS'])
 
     if row['Part_ExDel']:
@@ -745,7 +754,7 @@ def anno_deleted_regions(row, thresholds: dict):
                 start = posVar + int(row['DP_AG'])
                 end = eEnd
             else:
-                print('Warning: unkown strand')
+                logger.warning(f"Unknown strand -> {row['ENST_Full']}")
                 return np.nan
         elif _bp_3prime(thresholds, **row) < 0:
             if strand == '+':
@@ -755,13 +764,18 @@ def anno_deleted_regions(row, thresholds: dict):
                 start = eStart
                 end = posVar + int(row['DP_DG'])
             else:
-                print('Warning: unkown strand')
+                logger.warning(f"Unknown strand -> {row['ENST_Full']}")
                 return np.nan
         else:
-            print('Warning: unkown deletion conditions')
+            logger.warning(f"Unknown deletion conditions -> {row['CHROM']}:{row['POS']}")
             return np.nan
     else:
         return np.nan
     # print(f"{row['CHROM']} {str(start)} {str(end)}")
     return f"{row['CHROM']} {str(start)} {str(end)}"
     
+
+
+def with_threshold_set(row, event_func, grid: list, **kwargs):
+    """Call event_func with the threshold set of the row (threshold sweep)."""
+    return event_func(row, thresholds=grid[row['threshold_set']], **kwargs)
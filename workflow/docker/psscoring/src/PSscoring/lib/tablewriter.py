@@ -0,0 +1,103 @@
+import os
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from .schema import table_dtypes
+
+
+TABLE_FORMATS = {'parquet': 'parquet', 'arrow': 'ipc'}
+
+
+def table_path(output_vcf: str, fmt: str) -> str:
+    """
+    Location of the annotation table written next to an output VCF,
+    e.g. sample.psscored.vcf -> sample.psscored.annotations.parquet/
+    """
+    base = output_vcf[:-3] if output_vcf.endswith('.gz') else output_vcf
+    base = base[:-4] if base.endswith('.vcf') else base
+    return f"{base}.annotations.{fmt}"
+
+def _to_text(sr: pd.Series) -> pd.Series:
+    """Any column as text; nested values (dicts, lists) as JSON text."""
+    def to_text(value):
+        if isinstance(value, (dict, list, tuple)):
+            return json.dumps(value, default=str)
+        if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+            return pd.NA
+        return str(value)
+
+    return sr.astype(object).map(to_text).astype('string')
+
+def _to_dtype(sr: pd.Series, dtype: str) -> pd.Series:
+    """
+    Cast a column to its table dtype. Columns of passthrough rows only or
+    of an empty chain hold NaN, which every dtype accepts as missing.
+    """
+    if dtype == 'string':
+        return _to_text(sr)
+    if dtype == 'category':
+        return _to_text(sr).astype('category')
+    if sr.dtype == object:
+        sr = sr.where(sr.notna(), None)
+        if dtype == 'boolean':
+            return sr.astype('boolean')
+        sr = pd.to_numeric(sr)
+    return sr.astype(dtype)
+
+def arrow_type(dtype: str):
+    import pyarrow as pa
+
+    return {
+        'string': pa.string(), 'category': pa.dictionary(pa.int32(), pa.string()),
+        'boolean': pa.bool_(), 'int32': pa.int32(), 'Int32': pa.int32(),
+        'UInt8': pa.uint8(), 'float32': pa.float32(), 'float64': pa.float64(),
+    }[dtype]
+
+def to_arrow_table(df: pd.DataFrame):
+    """
+    The annotation table with the column types of schema.table_dtypes, so
+    that the tables of all samples and runs can be read as one dataset.
+    Columns it does not list are stored as text.
+    """
+    import pyarrow as pa
+
+    known = table_dtypes()
+    dtypes = {col: known.get(col, 'string') for col in df.columns}
+    typed = pd.DataFrame({col: _to_dtype(df[col], dtype) for col, dtype in dtypes.items()},
+                         index=df.index)
+    schema = pa.schema([(col, arrow_type(dtype)) for col, dtype in dtypes.items()])
+    return pa.Table.from_pandas(typed, schema=schema, preserve_index=False)
+
+def write_table(df: pd.DataFrame, output_dir: str, fmt: str = 'parquet') -> None:
+    """
+    Write the full annotation table as a dataset partitioned by contig
+    (output_dir/CHROM=<contig>/part-0.<fmt>), so that single contigs and
+    selected columns can be read without loading the rest.
+    Args:
+        df (pd.DataFrame): Annotated DataFrame (all intermediate columns).
+        output_dir (str): Dataset directory. An existing one is removed first.
+        fmt (str): 'parquet' or 'arrow' (Arrow IPC).
+    """
+    try:
+        import pyarrow.dataset as ds
+    except ImportError:
+        raise ImportError(
+            "Writing the annotation table requires pyarrow. "
+            "Install it in the psscoring environment (conda install -c conda-forge pyarrow).")
+
+    if fmt not in TABLE_FORMATS:
+        raise ValueError(f"Table format must be one of {', '.join(TABLE_FORMATS)}.")
+
+    table = to_arrow_table(df)
+    # Partitions of contigs that this run does not write must not survive
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+    ds.write_dataset(
+        table, output_dir, schema=table.schema,
+        format=TABLE_FORMATS[fmt],
+        partitioning=['CHROM'], partitioning_flavor='hive',
+        basename_template=f"part-{{i}}.{fmt}",
+        existing_data_behavior='error')
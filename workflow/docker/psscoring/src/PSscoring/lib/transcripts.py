@@ -0,0 +1,77 @@
+"""
+Size-bounded LRU cache of per-transcript gene models.
+
+The row-wise stages look up the exons, introns and CDS of a variant's
+transcript (ENST_Full) in the GENCODE databases: IntronDist, ExInt_INFO
+(which walks the exons up to three times), CDS_Length and the pseudoexon
+check, each for every variant. Variants of one transcript usually come in
+runs, so the first lookup of a transcript reads its exons, CDS and introns
+once and later lookups, from any stage, are answered from memory. At most
+`maxsize` transcripts are kept; the least recently used one is dropped
+first. With `maxsize` 0 every lookup goes to the database.
+
+TranscriptCache.db and TranscriptCache.db_intron stand in for the gffutils
+FeatureDBs: `children(id, featuretype=..., limit=...)` of a cached feature
+type is served from the cache, with `limit` keeping the features that
+overlap the (seqid, start, end) region as gffutils does. Everything else is
+passed on to the database.
+"""
+from collections import OrderedDict
+
+DEFAULT_SIZE = 4096
+# Cached feature type -> database holding it
+FEATURE_DBS = {'exon': 'db', 'CDS': 'db', 'intron': 'db_intron'}
+
+
+class CachedFeatureDB:
+    def __init__(self, cache, db):
+        self._cache = cache
+        self._db = db
+
+    def children(self, id, featuretype=None, limit=None, **kwargs):
+        if featuretype not in FEATURE_DBS or kwargs or not isinstance(id, str) \
+                or self._cache.maxsize <= 0:
+            return self._db.children(id, featuretype=featuretype, limit=limit, **kwargs)
+        features = self._cache.features(id, featuretype)
+        if limit is not None:
+            seqid, start, end = limit
+            features = [f for f in features
+                        if f.seqid == seqid and f.start <= end and f.end >= start]
+        return iter(features)
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+
+class TranscriptCache:
+    def __init__(self, db, db_intron, maxsize: int = DEFAULT_SIZE):
+        self.maxsize = maxsize
+        self.hits, self.misses = 0, 0
+        self._dbs = {'db': db, 'db_intron': db_intron}
+        self._models = OrderedDict()
+        self.db = CachedFeatureDB(self, db)
+        self.db_intron = CachedFeatureDB(self, db_intron)
+
+    def _load(self, enst: str) -> dict:
+        return {featuretype: tuple(self._dbs[name].children(enst, featuretype=featuretype))
+                for featuretype, name in FEATURE_DBS.items()}
+
+    def features(self, enst: str, featuretype: str) -> tuple:
+        """Features of one type of transcript `enst`, in database order."""
+        model = self._models.get(enst)
+        if model is None:
+            self.misses += 1
+            model = self._load(enst)
+            self._models[enst] = model
+            if len(self._models) > self.maxsize:
+                self._models.popitem(last=False)
+        else:
+            self.hits += 1
+            self._models.move_to_end(enst)
+        return model[featuretype]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._models), 'maxsize': self.maxsize}
@@ -0,0 +1,234 @@
+"""
+Bulk decoder for the VEP (CSQ) and SpliceAI INFO fields.
+
+The header is read once to find the position of every needed subfield. Each
+record then only splits its INFO strings up to the last needed subfield and
+appends a tuple; conversions (HGVSc, strand, numeric scores, maxsplai) run
+on whole columns afterwards.
+
+Multi-allelic records and records with several SpliceAI gene entries are
+expanded in the same pass: one row per ALT allele and SpliceAI entry of that
+allele, so no separate `bcftools norm -m-` run is needed.
+"""
+import re
+from itertools import islice
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+from cyvcf2 import VCF
+
+from .schema import SPLICEAI_DS_COLS, SPLICEAI_DP_COLS
+from .genicfilter import fetch_records, has_index
+
+PARSED_COLS = [
+    'CHROM', 'POS', 'REF', 'ALT', 'GeneSymbol', 'SymbolSource', 'HGNC_ID',
+    'ENST', 'HGVSc', 'Consequence', 'EXON', 'INTRON', 'Strand',
+    'DS_AG', 'DS_AL', 'DS_DG', 'DS_DL',
+    'DP_AG', 'DP_AL', 'DP_DG', 'DP_DL', 'maxsplai', 'loftee'
+]
+# Parsed column -> CSQ subfield
+CSQ_FIELDS = {
+    'GeneSymbol': 'SYMBOL', 'SymbolSource': 'SYMBOL_SOURCE', 'HGNC_ID': 'HGNC_ID',
+    'ENST': 'Feature', 'HGVSc': 'HGVSc', 'Consequence': 'Consequence', 'EXON': 'EXON',
+    'INTRON': 'INTRON', 'Strand': 'STRAND', 'loftee': 'LoF',
+}
+SPLICEAI_FIELDS = SPLICEAI_DS_COLS + SPLICEAI_DP_COLS
+
+
+def info_format(vcf: VCF, key: str) -> list:
+    """Subfield names of a pipe-separated INFO field ("... Format: A|B|C")."""
+    description = vcf.get_header_type(key)['Description']
+    return description.split('Format: ')[1].rstrip('"').split('|')
+
+def vep_alleles(ref: str, alts: list) -> list:
+    """
+    ALT alleles as VEP writes them in the CSQ Allele subfield: when the
+    record has an indel and all alleles share their first base, that base is
+    removed ("-" if nothing is left).
+    """
+    if all(len(alt) == len(ref) for alt in alts):
+        return list(alts)
+    if all(alt[:1] == ref[:1] for alt in alts):
+        return [alt[1:] or '-' for alt in alts]
+    return list(alts)
+
+def decode_vcf(raw_vcf, threads: int = 1, records: list = None, 
+               regions: dict = None, indexed: bool = None, 
+               limit: int = None) -> pd.DataFrame:
+    """
+    Decode the CSQ and SpliceAI annotations of every ALT allele. An allele
+    gets one row per SpliceAI entry of that allele (a row with missing
+    scores if there is none). The CSQ entry of a row is the first one of the
+    allele (by ALLELE_NUM if VEP wrote it, else by Allele) whose SYMBOL is
+    the SpliceAI gene, else the first one of the allele, else the first one
+    of the record. Single-allele records with one CSQ and one SpliceAI entry
+    take a fast path.
+    Args:
+        raw_vcf (str or cyvcf2.VCF): Path ("-" for stdin) or an open VCF,
+                                     which is left open
+        threads (int): BGZF decompression threads when a path is given
+        records (list): If given, the cyvcf2 records are appended to it, so
+                        that input which cannot be read twice can be written
+                        out again (lib/vcfwriter.write_vcf)
+        regions (dict): Only decode records overlapping these regions
+                        (genicfilter.build_region_index)
+        indexed (bool): Fetch the regions through the tabix/CSI index.
+                        Defaults to whether raw_vcf is a path with an index
+        limit (int): Stop after this many records. An open VCF is left at
+                     the next record, so that it can be decoded in chunks
+    Returns:
+        pd.DataFrame: PARSED_COLS. SpliceAI scores are float64 (NaN when
+                      missing) and maxsplai is their numeric maximum; the
+                      other columns are strings.
+    """
+    opened = not isinstance(raw_vcf, VCF)
+    vcf = VCF(raw_vcf, threads=threads) if opened else raw_vcf
+    csq_format, splai_format = info_format(vcf, 'CSQ'), info_format(vcf, 'SpliceAI')
+    csq_idx = [csq_format.index(field) for field in CSQ_FIELDS.values()]
+    splai_idx = [splai_format.index(field) for field in SPLICEAI_FIELDS]
+    csq_split, splai_split = max(csq_idx) + 1, max(splai_idx) + 1
+    csq_fields, splai_fields = itemgetter(*csq_idx), itemgetter(*splai_idx)
+    no_splai = ('NA',) * len(splai_idx)
+    # Subfields used to match CSQ and SpliceAI entries to alleles and genes
+    if 'ALLELE_NUM' in csq_format:
+        csq_allele, by_number = csq_format.index('ALLELE_NUM'), True
+    else:
+        csq_allele, by_number = csq_format.index('Allele'), False
+    csq_symbol = csq_format.index('SYMBOL')
+    splai_allele, splai_symbol = splai_format.index('ALLELE'), splai_format.index('SYMBOL')
+
+    def expand(chrom, pos, ref, alts, csq, splai):
+        entries = [entry.split('|') for entry in csq.split(',')]
+        splai_entries = [entry.split('|') for entry in splai.split(',')] if splai else []
+        labels = [str(i) for i in range(1, len(alts) + 1)] if by_number else vep_alleles(ref, alts)
+        for alt, label in zip(alts, labels):
+            if len(alts) == 1:
+                allele_csq, allele_splai = entries, splai_entries
+            else:
+                allele_csq = [e for e in entries if e[csq_allele] == label] or entries[:1]
+                allele_splai = [e for e in splai_entries if e[splai_allele] == alt]
+            if not allele_splai:
+                rows.append((chrom, pos, ref, alt) + csq_fields(allele_csq[0]) + no_splai)
+            for entry in allele_splai:
+                gene_csq = next((e for e in allele_csq if e[csq_symbol] == entry[splai_symbol]),
+                                allele_csq[0])
+                rows.append((chrom, pos, ref, alt) + csq_fields(gene_csq) + splai_fields(entry))
+
+    if regions is None:
+        variants = vcf
+    else:
+        if indexed is None:
+            indexed = isinstance(raw_vcf, str) and has_index(raw_vcf)
+        variants = fetch_records(vcf, regions, indexed)
+    if limit is not None:
+        variants = islice(variants, limit)
+
+    rows = []
+    for v in variants:
+        if records is not None:
+            records.append(v)
+        info = v.INFO
+        csq, splai = info.get('CSQ'), info.get('SpliceAI')
+        alts = v.ALT
+        if len(alts) > 1 or ',' in csq or (splai and ',' in splai):
+            expand(v.CHROM, v.POS, v.REF, alts, csq, splai)
+            continue
+        # Only the fields up to the last needed one are split off
+        csq = csq_fields(csq.split('|', csq_split))
+        if splai:
+            splai = splai_fields(splai.split('|', splai_split))
+        else:
+            splai = no_splai
+        rows.append((v.CHROM, v.POS, v.REF, alts[0]) + csq + splai)
+    if opened:
+        vcf.close()
+
+    df = pd.DataFrame(
+        rows, columns=['CHROM', 'POS', 'REF', 'ALT'] + list(CSQ_FIELDS) + SPLICEAI_FIELDS)
+    if df.empty:
+        return pd.DataFrame(columns=PARSED_COLS)
+
+    # "ENST00000123.4:c.12A>G" -> "c.12A>G"; "NA" without a transcript prefix
+    df['HGVSc'] = [h.partition(':')[2] if ':' in h else 'NA' for h in df['HGVSc']]
+    df['Strand'] = np.where(df['Strand'] == '1', '+', '-')
+
+    for col in SPLICEAI_DS_COLS:
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    # NaN if any score is missing
+    df['maxsplai'] = df[SPLICEAI_DS_COLS].max(axis=1, skipna=False)
+
+    return df[PARSED_COLS]
+
+def decode_vcf_rowwise(raw_vcf: str) -> pd.DataFrame:
+    """
+    Original per-record parser (maxsplai is the lexical maximum of the score
+    strings). Kept as the reference for benchmarks/vcf_decode.py.
+    """
+    header = VCF(raw_vcf).header_iter()
+    for h in header:
+        try:
+            h['ID']
+        except KeyError:
+            continue
+        else:
+            if h['ID'] == 'CSQ':
+                vep_cols_list = h['Description'].split('Format: ')[1].rstrip('"').split('|')
+            elif h['ID'] == 'SpliceAI':
+                splai_cols_list = h['Description'].split('Format: ')[1].rstrip('"').split('|')
+            else:
+                pass
+
+    cols = PARSED_COLS
+    vepidx: dict = {col: i for i, col in enumerate(vep_cols_list)}
+    splaidx: dict = {col: i for i, col in enumerate(splai_cols_list)}
+    df = pd.DataFrame(columns=cols)
+
+    for v in VCF(raw_vcf):
+        vep: list = v.INFO.get('CSQ').split('|')
+
+        # Get HGVSc from VEP
+        try:
+            hgvsc = re.search('(?<=:).*',vep[vepidx['HGVSc']])[0]
+        except TypeError:
+            hgvsc = "NA"
+
+        # Get SpliceAI scores
+        if v.INFO.get('SpliceAI'):
+            splai: list = v.INFO.get('SpliceAI').split(',')[0].split('|')
+        else:
+            splai = ['NA'] * len(splai_cols_list)
+
+        # Convert strand to +/- 
+        strand = lambda s: '+' if s == '1' else '-'
+
+        # Get max SpliceAI scores
+        ds_ag: float = splai[splaidx['DS_AG']]
+        ds_al: float = splai[splaidx['DS_AL']]
+        ds_dg: float = splai[splaidx['DS_DG']]
+        ds_dl: float = splai[splaidx['DS_DL']]
+        if splai[splaidx['DP_AG']] == 'NA':
+            maxsplai: str = "NA"
+        maxsplai: float = max(ds_ag, ds_al, ds_dg, ds_dl)
+    
+        # Add df row
+        df = pd.concat(
+            [df, pd.DataFrame(
+                [
+                    [
+                        v.CHROM, v.POS, v.REF, v.ALT[0], 
+                        vep[vepidx['SYMBOL']], vep[vepidx['SYMBOL_SOURCE']], 
+                        vep[vepidx['HGNC_ID']], vep[vepidx['Feature']], hgvsc, 
+                        vep[vepidx['Consequence']], vep[vepidx['EXON']], 
+                        vep[vepidx['INTRON']], strand(vep[vepidx['STRAND']]), 
+                        ds_ag, ds_al, ds_dg, ds_dl, 
+                        splai[splaidx['DP_AG']], splai[splaidx['DP_AL']], 
+                        splai[splaidx['DP_DG']], splai[splaidx['DP_DL']],
+                        maxsplai, vep[vepidx['LoF']], 
+                    ]
+                ],
+                columns=cols
+                )
+            ], ignore_index=True)
+
+    return df
@@ -3,13 +3,22 @@ import pandas as pd
 from pandas import Int64Dtype
 
 
-def write_vcf(df: pd.DataFrame, raw_vcf: str, output_vcf: str) -> None:
+def write_vcf(df: pd.DataFrame, raw_vcf, output_vcf: str, 
+              records: list = None, threads: int = 1) -> None:
     """
     Write a VCF file with the priority score for pathogenic splicing SNVs.
+    PriorityScore is a Number=A field: one value per ALT allele, "." for
+    unscored alleles. An allele with several rows (one per SpliceAI gene
+    entry, see vcfdecode.decode_vcf) gets the highest of their scores.
     Args:
         df (pd.DataFrame): DataFrame containing the priority scores.
-        raw_vcf (str): Path to the input VCF file.
-        output_vcf (str): Path to the output VCF file.
+        raw_vcf (str or cyvcf2.VCF): Path to the input VCF file, which is read
+            again, or the open input VCF whose records were kept in `records`.
+        output_vcf (str): Path to the output VCF file. "-" writes to stdout,
+            a path ending with .gz is written as BGZF, .bcf as BCF.
+        records (list): Input records kept by vcfdecode.decode_vcf; required
+            when raw_vcf is an open VCF.
+        threads (int): BGZF (de)compression threads.
     """
 
     # Check if the input DataFrame is empty
@@ -21,38 +30,66 @@ def write_vcf(df: pd.DataFrame, raw_vcf: str, output_vcf: str) -> None:
     if missing_columns:
         raise ValueError(f"The input DataFrame is missing the following required columns: {', '.join(missing_columns)}")
     # Check if the input VCF file exists
-    if not isinstance(raw_vcf, str):
+    if isinstance(raw_vcf, VCF):
+        if records is None:
+            raise ValueError("The records of an open input VCF must be given.")
+    elif not isinstance(raw_vcf, str):
         raise ValueError("The input VCF file path must be a string.")
 
+    opened = records is None
+    vcf_in  = VCF(raw_vcf, threads=threads) if opened else raw_vcf
+    vcf_out = open_writer(vcf_in, output_vcf, threads)
+    write_records(vcf_out, vcf_in if opened else records, score_mapping(df))
+
+    vcf_out.close()
+    if opened:
+        vcf_in.close()
+
+def score_mapping(df: pd.DataFrame) -> dict:
+    """
+    {(CHROM, POS, REF, ALT): PriorityScore} of the scored alleles; the
+    highest score if an allele has several rows.
+    """
     # cast to int for the priority score
-    df["PriorityScore"] = df["PriorityScore"].astype(Int64Dtype())
+    df = df.assign(PriorityScore=df["PriorityScore"].astype(Int64Dtype()))
 
-    mapping = {
-        (row.CHROM, row.POS, row.REF, row.ALT): int(row.PriorityScore)
-        for row in df.itertuples(index=False)
-        if not pd.isna(row.PriorityScore)
-    }
+    mapping = {}
+    for row in df.itertuples(index=False):
+        if not pd.isna(row.PriorityScore):
+            key, score = (row.CHROM, row.POS, row.REF, row.ALT), int(row.PriorityScore)
+            mapping[key] = max(mapping.get(key, score), score)
+    return mapping
 
-    vcf_in  = VCF(raw_vcf)
+def open_writer(vcf_in: VCF, output_vcf: str, threads: int = 1) -> Writer:
+    """Open the output VCF with the header of vcf_in plus PriorityScore and write the header."""
     vcf_out = Writer(output_vcf, vcf_in)
+    if output_vcf.endswith('.gz'):
+        vcf_out.set_threads(threads)
     vcf_out.add_to_header(
-        '##INFO=<ID=PriorityScore,Number=1,Type=Integer,'
+        '##INFO=<ID=PriorityScore,Number=A,Type=Integer,'
         'Description="Priority score for pathogenic splicing SNVs '
         '(range -10 to 14; values ≥1 are screening-positive)">'
     )
 
     vcf_in.add_info_to_header({
-        "ID": "PriorityScore", "Number": "1", "Type": "Integer",
+        "ID": "PriorityScore", "Number": "A", "Type": "Integer",
         "Description": "Priority score for pathogenic splicing SNVs (range -10 to 14; values ≥1 are considered screening-positive)"
     })
     vcf_out.write_header()
+    return vcf_out
 
-
-    for var in vcf_in:
-        key = (var.CHROM, var.POS, var.REF, var.ALT[0])
-        if key in mapping:
-            var.INFO["PriorityScore"] = mapping[key]
+def write_records(vcf_out: Writer, records, mapping: dict) -> None:
+    """Write records with the PriorityScore of their alleles from score_mapping."""
+    for var in records:
+        scores = [mapping.get((var.CHROM, var.POS, var.REF, alt)) for alt in var.ALT]
+        if len(scores) == 1:
+            if scores[0] is not None:
+                var.INFO["PriorityScore"] = scores[0]
+        elif any(score is not None for score in scores):
+            # cyvcf2 sets a single integer or a string, not a list. The values
+            # are set as text and the record is parsed again with the output
+            # header, which stores them as integers with missing values (BCF).
+            var.INFO["PriorityScore"] = ','.join(
+                '.' if score is None else str(score) for score in scores)
+            var = vcf_out.variant_from_string(str(var).rstrip('\n'))
         vcf_out.write_record(var)
-    
-    vcf_out.close()
-    vcf_in.close()
\ No newline at end of file
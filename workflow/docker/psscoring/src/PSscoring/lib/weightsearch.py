@@ -0,0 +1,165 @@
+"""
+Weight search for the PriorityScore solution vector.
+
+PriorityScore is the sum of the weights of three screening codes
+(recalibrated_splai, insilico_screening, clinvar_screening). An allele with
+several rows (one per SpliceAI gene entry) gets the highest score of its
+rows, as in the output VCF. Rows are encoded as code-count vectors and
+collapsed to their distinct code combinations, and variants to their
+distinct sets of combinations (at most a few hundred of each), so a batch
+of candidate weight vectors is evaluated on the whole truth set with one
+matrix product and one np.maximum.reduceat.
+"""
+from logging import getLogger
+
+import numpy as np
+import pandas as pd
+
+from .scoring import DEFAULT_WEIGHTS, SCREENING_COLS
+
+logger = getLogger(__name__)
+
+CODES = list(DEFAULT_WEIGHTS)
+METRIC_COLS = ['TP', 'FN', 'FP', 'TN', 'sensitivity', 'specificity', 'youden']
+
+
+def encode_codes(df: pd.DataFrame, label_col: str = 'label', keys: list = None) -> tuple:
+    """
+    Encode the screening codes of labelled variants.
+    Rows with a code outside CODES (e.g. "Not available") or without a
+    label are excluded; like the output VCF, a variant is scored by its
+    remaining rows.
+    Args:
+        df (pd.DataFrame): Rows with SCREENING_COLS and a 0/1 label column.
+        label_col (str): Name of the label column (1 = pathogenic).
+        keys (list): Columns identifying a variant (every row is a variant
+                     if not given).
+    Returns:
+        tuple: (counts, groups, positives, negatives, n_excluded)
+               counts: float32 (n_combos x len(CODES)) code counts per combination
+               groups: (members, offsets); the combinations of group i are
+                       members[offsets[i]:offsets[i + 1]]
+               positives, negatives: labelled variants per group
+               n_excluded: excluded rows
+    """
+    code_idx = {code: i for i, code in enumerate(CODES)}
+    codes = df[SCREENING_COLS].astype(str)
+    known = codes.isin(CODES).all(axis=1) & df[label_col].notna()
+    if not known.any():
+        raise ValueError("No labelled variant with screening codes to evaluate.")
+
+    encoded = np.stack(
+        [codes.loc[known, col].map(code_idx).to_numpy() for col in SCREENING_COLS], axis=1)
+    labels = df.loc[known, label_col].astype(int).to_numpy()
+    if not set(np.unique(labels)) <= {0, 1}:
+        raise ValueError(f"Column {label_col} must contain 0 (benign) or 1 (pathogenic).")
+    if keys is None:
+        variant = np.arange(len(labels))
+    else:
+        variant = df.loc[known].groupby(keys, sort=False, dropna=False).ngroup().to_numpy()
+    if (np.bincount(variant, weights=labels) % np.bincount(variant)).any():
+        raise ValueError(f"Variants with conflicting {label_col} values.")
+
+    combos, combo = np.unique(encoded, axis=0, return_inverse=True)
+    counts = np.zeros((len(combos), len(CODES)), dtype=np.float32)
+    for j in range(combos.shape[1]):
+        np.add.at(counts, (np.arange(len(combos)), combos[:, j]), 1)
+
+    # Distinct combinations of each variant, then the distinct sets of them
+    pairs = np.unique(np.stack([variant, combo.reshape(-1)], axis=1), axis=0)
+    starts = np.flatnonzero(np.r_[True, pairs[1:, 0] != pairs[:-1, 0]])
+    group_idx = {}
+    group = np.array([group_idx.setdefault(tuple(members), len(group_idx))
+                      for members in np.split(pairs[:, 1], starts[1:])])
+    members = np.concatenate([np.array(m, dtype=np.intp) for m in group_idx])
+    offsets = np.r_[0, np.cumsum([len(m) for m in group_idx])[:-1]]
+
+    # Labels of the variants, in the order of pairs[starts, 0]
+    variant_labels = np.zeros(variant.max() + 1)
+    variant_labels[variant] = labels
+    variant_labels = variant_labels[pairs[starts, 0]]
+    positives = np.bincount(group, weights=variant_labels, minlength=len(group_idx))
+    totals = np.bincount(group, minlength=len(group_idx))
+
+    return counts, (members, offsets), positives, totals - positives, int((~known).sum())
+
+def evaluate(weights: np.ndarray, counts: np.ndarray, groups: tuple, positives: np.ndarray,
+             negatives: np.ndarray, threshold: float = 1.0) -> dict:
+    """
+    Confusion counts and rates of candidate weight vectors.
+    Args:
+        weights (np.ndarray): (n_candidates x len(CODES)) weights.
+        counts, groups, positives, negatives: see encode_codes.
+        threshold (float): Screening-positive cut-off (PriorityScore >= threshold).
+    Returns:
+        dict: METRIC_COLS -> arrays of length n_candidates
+    """
+    members, offsets = groups
+    scores = weights.astype(np.float32) @ counts.T
+    # Highest score of the rows of each variant
+    scores = np.maximum.reduceat(scores[:, members], offsets, axis=1)
+    called = (scores >= threshold).astype(np.float64)
+    tp = called @ positives
+    fp = called @ negatives
+    n_pos, n_neg = positives.sum(), negatives.sum()
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sensitivity = tp / n_pos
+        specificity = (n_neg - fp) / n_neg
+
+    return {'TP': tp, 'FN': n_pos - tp, 'FP': fp, 'TN': n_neg - fp,
+            'sensitivity': sensitivity, 'specificity': specificity,
+            'youden': sensitivity + specificity - 1}
+
+def _objective(metrics: dict, objective: str, min_specificity: float) -> np.ndarray:
+    value = metrics[objective].copy()
+    value[~(metrics['specificity'] >= min_specificity)] = -np.inf
+    return value
+
+def search(counts: np.ndarray, groups: tuple, positives: np.ndarray, negatives: np.ndarray,
+           n_candidates: int, min_weight: int = -10, max_weight: int = 10,
+           seed: int = 0, threshold: float = 1.0, objective: str = 'youden',
+           min_specificity: float = 0.0, top_k: int = 100,
+           batch_size: int = 1 << 16) -> pd.DataFrame:
+    """
+    Random search over integer weight vectors in [min_weight, max_weight].
+    The default weights are always evaluated as candidate 0.
+    Args:
+        objective (str): 'youden' or 'sensitivity' (maximised).
+        min_specificity (float): Candidates below this specificity are ranked last.
+        top_k (int): Number of candidates returned (0 returns all).
+    Returns:
+        pd.DataFrame: Best candidates (one column per code, METRIC_COLS,
+                      'candidate'), best first.
+    """
+    rng = np.random.default_rng(seed)
+    keep = n_candidates if top_k <= 0 else top_k
+    best_weights, best_metrics, best_ids = [], [], []
+
+    for start in range(0, n_candidates, batch_size):
+        n = min(batch_size, n_candidates - start)
+        weights = rng.integers(min_weight, max_weight + 1, size=(n, len(CODES))).astype(np.float32)
+        if start == 0:
+            weights[0] = [DEFAULT_WEIGHTS[code] for code in CODES]
+
+        metrics = evaluate(weights, counts, groups, positives, negatives, threshold)
+        value = _objective(metrics, objective, min_specificity)
+        if n > keep:
+            sel = np.argpartition(-value, keep - 1)[:keep]
+        else:
+            sel = np.arange(n)
+
+        best_weights.append(weights[sel])
+        best_metrics.append({k: v[sel] for k, v in metrics.items()})
+        best_ids.append(start + sel)
+
+    weights = np.concatenate(best_weights)
+    metrics = {k: np.concatenate([m[k] for m in best_metrics]) for k in METRIC_COLS}
+    result = pd.DataFrame(weights, columns=CODES)
+    for k in METRIC_COLS:
+        result[k] = metrics[k]
+    result['candidate'] = np.concatenate(best_ids)
+    result['objective'] = _objective(metrics, objective, min_specificity)
+
+    result = result.sort_values(['objective', 'candidate'], ascending=[False, True])
+    return result.head(keep).drop(columns=['objective']).reset_index(drop=True)
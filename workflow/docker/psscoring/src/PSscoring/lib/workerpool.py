@@ -0,0 +1,348 @@
+"""
+Persistent worker pool for the row-wise stages.
+
+The workers are started once. Before a call, every column of the frame is
+copied into shared memory unless the same column is already there from an
+earlier call; the workers map the blocks and rebuild their chunk of rows
+from them, so the numeric data is never pickled. Object columns are stored
+as factorized codes plus their distinct values. Results come back the same
+way: numeric arrays as they are, object arrays as codes and distinct values.
+
+File-backed resources are passed to the workers as lib.handles.Handle and
+opened by each worker on first use. Every result also carries the worker's
+handles.report() (e.g. its transcript cache counts), kept in worker_reports.
+
+Calls may come from several threads at once (the stage scheduler of
+lib/pipeline.py). Blocks of a column that is republished while calls are
+running are only unlinked once no call is left, since chunks of a running
+call may not have mapped them yet.
+
+Without `initialize` (or with one worker) everything runs in-process with
+DataFrame.apply, which gives the same results.
+"""
+import os
+import time
+import pickle
+import threading
+import atexit
+import itertools
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from logging import getLogger
+
+import numpy as np
+import pandas as pd
+
+from . import handles
+
+logger = getLogger(__name__)
+
+_pool = None
+_n_workers = 1
+_tokens = itertools.count()
+# column name -> (fingerprint, token, spec, shared memory blocks, kept array)
+_published = {}
+# Blocks of replaced columns, unlinked when no call is running
+_retired = []
+_running = 0
+_lock = threading.Lock()
+
+STAT_KEYS = ['calls', 'rows', 'wall_s', 'compute_s', 'publish_s', 'published_bytes',
+             'result_bytes']
+stats = dict.fromkeys(STAT_KEYS, 0)
+_thread_stats = threading.local()
+# worker process ID -> latest handles.report() of that worker
+worker_reports = {}
+
+
+def initialize(n_workers: int) -> None:
+    """Start the worker pool. Must run before resources are opened."""
+    global _pool, _n_workers
+    shutdown()
+    _n_workers = n_workers
+    if n_workers > 1:
+        # Workers share the parent's resource tracker, which otherwise would
+        # unlink the blocks when a worker exits
+        resource_tracker.ensure_running()
+        _pool = multiprocessing.get_context('fork').Pool(n_workers)
+
+def active() -> bool:
+    """True if calls are split across worker processes."""
+    return _pool is not None
+
+def shutdown() -> None:
+    global _pool
+    release()
+    worker_reports.clear()
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+
+atexit.register(shutdown)
+
+
+#===============================================================================
+# Column encoding (parent) and decoding (workers)
+#===============================================================================
+def _new_block(nbytes: int) -> shared_memory.SharedMemory:
+    return shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+
+def _put_array(arr: np.ndarray, blocks: list) -> tuple:
+    arr = np.ascontiguousarray(arr)
+    shm = _new_block(arr.nbytes)
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+    blocks.append(shm)
+    return shm.name, arr.dtype.str, arr.shape
+
+def _put_object(obj, blocks: list) -> tuple:
+    return _put_array(np.frombuffer(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL),
+                                    dtype=np.uint8), blocks)
+
+def factorize_exact(values: np.ndarray) -> tuple:
+    """
+    Factorize an object array keeping values of different types apart
+    (pd.factorize alone merges True, 1 and 1.0, or None and NaN).
+    Raises TypeError for unhashable values (lists, dicts).
+    Returns:
+        tuple: (int32 codes, object array of distinct values)
+    """
+    codes, _ = pd.factorize(values, use_na_sentinel=False)
+    types, _ = pd.factorize(np.array([type(v) for v in values], dtype=object))
+    keys = codes.astype(np.int64) * (int(types.max(initial=0)) + 1) + types
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    return inverse.reshape(-1).astype(np.int32), values[first]
+
+def _encode_column(values, blocks: list) -> tuple:
+    dtype = values.dtype
+    if isinstance(values, np.ndarray) and dtype.kind in 'biufc':
+        return ('numpy', _put_array(values, blocks))
+    if isinstance(dtype, pd.CategoricalDtype):
+        return ('category', _put_array(values.codes, blocks), _put_object(dtype, blocks))
+    if isinstance(values, pd.arrays.IntegerArray) or isinstance(values, pd.arrays.BooleanArray) \
+            or isinstance(values, pd.arrays.FloatingArray):
+        return ('masked', _put_array(values._data, blocks), _put_array(values._mask, blocks),
+                _put_object(dtype, blocks))
+    if isinstance(values, np.ndarray) and dtype == object:
+        try:
+            codes, uniques = factorize_exact(values)
+        except TypeError:
+            pass
+        else:
+            return ('codes', _put_array(codes, blocks), _put_object(uniques, blocks))
+    return ('pickle', _put_object(values, blocks))
+
+def _fingerprint(values) -> tuple:
+    if isinstance(values, np.ndarray):
+        arrays = (values,)
+    elif isinstance(values, pd.Categorical):
+        arrays = (values.codes,)
+    elif hasattr(values, '_data') and hasattr(values, '_mask'):
+        arrays = (values._data, values._mask)
+    else:
+        return (id(values),)
+    return tuple((a.__array_interface__['data'][0], a.shape, a.strides, a.dtype.str)
+                 for a in arrays) + (str(values.dtype),)
+
+def _publish(name, values) -> tuple:
+    """Put a column into shared memory unless it is already there. Returns (token, spec)."""
+    fingerprint = _fingerprint(values)
+    entry = _published.get(name)
+    if entry is not None and entry[0] == fingerprint:
+        return entry[1], entry[2]
+    if entry is not None:
+        _retire(entry[3])
+
+    start = time.perf_counter()
+    blocks = []
+    spec = _encode_column(values, blocks)
+    token = next(_tokens)
+    # Keeping the array keeps its memory from being reused by another
+    # column that would then get the same fingerprint
+    _published[name] = (fingerprint, token, spec, blocks, values)
+    _count('publish_s', time.perf_counter() - start)
+    _count('published_bytes', sum(shm.size for shm in blocks))
+    return token, spec
+
+def _unlink(blocks: list) -> None:
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+def _retire(blocks: list) -> None:
+    if _running:
+        _retired.extend(blocks)
+    else:
+        _unlink(blocks)
+
+def release() -> None:
+    """Free all published columns."""
+    with _lock:
+        for entry in _published.values():
+            _unlink(entry[3])
+        _published.clear()
+        _unlink(_retired)
+        _retired.clear()
+
+
+# Worker side: token -> decoded full-length column, and the mapped blocks
+_cache = {}
+_attached = {}
+
+def _get_array(desc: tuple, keep: list) -> np.ndarray:
+    name, dtype, shape = desc
+    shm = shared_memory.SharedMemory(name=name)
+    keep.append(shm)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+def _get_object(desc: tuple, keep: list):
+    return pickle.loads(_get_array(desc, keep).tobytes())
+
+def _decode_column(spec: tuple, keep: list):
+    kind = spec[0]
+    if kind == 'numpy':
+        return _get_array(spec[1], keep)
+    if kind == 'category':
+        return pd.Categorical.from_codes(_get_array(spec[1], keep), dtype=_get_object(spec[2], keep))
+    if kind == 'masked':
+        dtype = _get_object(spec[3], keep)
+        return dtype.construct_array_type()(_get_array(spec[1], keep), _get_array(spec[2], keep))
+    if kind == 'codes':
+        return _get_object(spec[2], keep).take(_get_array(spec[1], keep))
+    return _get_object(spec[1], keep)
+
+def _column(token: int, spec: tuple):
+    if token not in _cache:
+        keep = []
+        _cache[token] = _decode_column(spec, keep)
+        _attached[token] = keep
+    return _cache[token]
+
+def _drop_stale(live: set) -> None:
+    for token in list(_cache):
+        if token not in live:
+            del _cache[token]
+            for shm in _attached.pop(token):
+                try:
+                    shm.close()
+                except BufferError:  # still referenced by a view
+                    pass
+
+
+#===============================================================================
+# Tasks
+#===============================================================================
+def encode_result(values):
+    """Compact form of a result array: numeric as is, objects as codes."""
+    if isinstance(values, np.ndarray) and values.dtype == object:
+        try:
+            return ('codes',) + factorize_exact(values)
+        except TypeError:
+            pass
+    return ('raw', values)
+
+def decode_result(encoded):
+    if encoded[0] == 'codes':
+        return encoded[2].take(encoded[1])
+    return encoded[1]
+
+def _result_bytes(encoded) -> int:
+    return sum(getattr(a, 'nbytes', 0) for a in encoded[1:])
+
+def _values(sr: pd.Series):
+    return sr.to_numpy() if isinstance(sr.dtype, np.dtype) else sr.array
+
+def _run_chunk(task: tuple) -> tuple:
+    columns, index, live, func, args, kwargs, start, stop, is_frame = task
+    _drop_stale(live)
+
+    rows = slice(start, stop)
+    chunk_index = _column(*index)[rows]
+    if is_frame:
+        chunk = pd.DataFrame({name: _column(token, spec)[rows] for name, token, spec in columns},
+                             index=chunk_index, copy=False)
+        t0 = time.perf_counter()
+        result = chunk.apply(func, axis=1, args=args, **kwargs)
+    else:
+        name, token, spec = columns[0]
+        chunk = pd.Series(_column(token, spec)[rows], index=chunk_index, name=name, copy=False)
+        t0 = time.perf_counter()
+        result = chunk.apply(func, args=args, **kwargs)
+    compute_s = time.perf_counter() - t0
+
+    return encode_result(_values(result)), compute_s, os.getpid(), handles.report()
+
+
+def apply(obj, func, args: tuple = (), axis: int = 1, **kwargs) -> pd.Series:
+    """
+    `obj.apply(func, axis=1, args=args, **kwargs)` for a DataFrame, or
+    `obj.apply(func, args=args, **kwargs)` for a Series, split across the
+    worker pool.
+    """
+    is_frame = isinstance(obj, pd.DataFrame)
+    if _pool is None or len(obj) < 2:
+        if is_frame:
+            return obj.apply(func, axis=axis, args=args, **kwargs)
+        return obj.apply(func, args=args, **kwargs)
+
+    global _running
+    start = time.perf_counter()
+    with _lock:
+        if is_frame:
+            columns = [(name, *_publish(name, _values(obj[name]))) for name in obj.columns]
+        else:
+            columns = [(obj.name, *_publish(obj.name, _values(obj)))]
+        index = _publish(('__index__',), obj.index.to_numpy())
+        live = {entry[1] for entry in _published.values()}
+        _running += 1
+
+    bounds = np.linspace(0, len(obj), min(_n_workers, len(obj)) + 1).astype(int)
+    tasks = [(columns, index, live, func, args, kwargs, a, b, is_frame)
+             for a, b in zip(bounds[:-1], bounds[1:])]
+    try:
+        results = _pool.map(_run_chunk, tasks)
+    finally:
+        with _lock:
+            _running -= 1
+            if not _running:
+                _unlink(_retired)
+                _retired.clear()
+
+    parts = [pd.Series(decode_result(encoded), index=obj.index[a:b])
+             for (encoded, *_), a, b in zip(results, bounds[:-1], bounds[1:])]
+    out = pd.concat(parts) if len(parts) > 1 else parts[0]
+    if not is_frame:
+        out.name = obj.name
+
+    with _lock:
+        _count('calls', 1)
+        _count('rows', len(obj))
+        _count('wall_s', time.perf_counter() - start)
+        _count('compute_s', max(compute_s for _, compute_s, _, _ in results))
+        _count('result_bytes', sum(_result_bytes(encoded) for encoded, *_ in results))
+        for _, _, pid, report in results:
+            worker_reports[pid] = report
+    return out
+
+def _count(key: str, value) -> None:
+    """Add to the totals and to those of the calling thread."""
+    stats[key] += value
+    counts = getattr(_thread_stats, 'counts', None)
+    if counts is None:
+        counts = _thread_stats.counts = dict.fromkeys(STAT_KEYS, 0)
+    counts[key] += value
+
+def snapshot() -> dict:
+    """Pool activity of the calls made by the calling thread so far."""
+    counts = getattr(_thread_stats, 'counts', None)
+    return dict(counts) if counts is not None else dict.fromkeys(STAT_KEYS, 0)
+
+def overhead(before: dict, after: dict) -> dict:
+    """
+    Pool activity between two snapshots. ipc_s is the wall time of the calls
+    minus the slowest chunk's compute time, i.e. publishing columns, sending
+    tasks, rebuilding chunks and returning results.
+    """
+    delta = {k: after[k] - before[k] for k in STAT_KEYS}
+    delta['ipc_s'] = delta['wall_s'] - delta['compute_s']
+    return delta
@@ -1,56 +1,35 @@
 #!/usr/bin/env python
 
-import subprocess
-import glob
 import os
-import re
+import sys
+import json
+import time
 
-import numpy as np
-import pandas as pd
 from pathlib2 import Path
-from pandarallel import pandarallel
-import gffutils
-import pysam
 from logging import getLogger, config
-import yaml
-
-from lib import posparser, splaiparser, predeffect, anno_clinvar
-from lib.preprocess import parse_vcf
-from lib.scoring import Scoring
-from lib.vcfwriter import write_vcf
 
+# --input / --output value for stdin / stdout
+STDIO = '-'
+VCF_SUFFIXES = ('.vcf.gz', '.vcf.bgz', '.vcf', '.bcf')
 
 #===============================================================================
 # Functions 
 #===============================================================================
-def set_gtf_db(db_list: list, gff_list: list) -> tuple:
-    if len(db_list) == 0 or len(gff_list) == 0:
-        subprocess.run(
-            ["python", "/opt/psscoring/lib/generatedbs.py", "--output_dir", FLAGS.resources, 
-            "--release", FLAGS.release, "--assembly", FLAGS.assembly], 
-            shell=False, check=True, stdin=subprocess.DEVNULL)
-
-    if FLAGS.assembly == 'GRCh37':
-        db_anno_gencode = f"{FLAGS.resources}/gencode.v{FLAGS.release}lift37.annotation.gtf.db"
-        db_anno_intron = f"{FLAGS.resources}/gencode.v{FLAGS.release}lift37.annotation.intron.gtf.db"
-        gencode_gff = f"{FLAGS.resources}/gencode.v{FLAGS.release}lift37.annotation.gff3.gz"
-    elif FLAGS.assembly == 'GRCh38':
-        db_anno_gencode = f"{FLAGS.resources}/gencode.v{FLAGS.release}.annotation.gtf.db"
-        db_anno_intron = f"{FLAGS.resources}/gencode.v{FLAGS.release}.annotation.intron.gtf.db"
-        gencode_gff = f"{FLAGS.resources}/gencode.v{FLAGS.release}.annotation.gff3.gz"
-    else:
-        raise ValueError("Assembly must be either 'GRCh37' or 'GRCh38'.")
-    
-    return gffutils.FeatureDB(db_anno_gencode), gffutils.FeatureDB(db_anno_intron), gencode_gff
-
 def setup_logging(output_vcf: str, verbose: bool):
+    import yaml
+
     config_path = '/opt/psscoring/logging.yaml'
     with open(config_path, 'r') as f:
         log_cfg = yaml.safe_load(f)
 
-    out_dir = os.path.dirname(os.path.abspath(output_vcf))
-    base = os.path.splitext(os.path.basename(output_vcf))[0]
-    log_file = os.path.join(out_dir, f"{base}.log")
+    if output_vcf == STDIO:
+        # stdout carries the VCF: log to ./psscoring.log and stderr
+        log_file = 'psscoring.log'
+        log_cfg['handlers']['console']['stream'] = 'ext://sys.stderr'
+    else:
+        out_dir = os.path.dirname(os.path.abspath(output_vcf))
+        base = os.path.splitext(os.path.basename(output_vcf))[0]
+        log_file = os.path.join(out_dir, f"{base}.log")
     log_cfg['handlers']['file']['filename'] = log_file
 
     if verbose:
@@ -63,14 +42,49 @@ def setup_logging(output_vcf: str, verbose: bool):
     config.dictConfig(log_cfg)
 
 
-def map_and_calc_score(row, score_map: dict) -> int:
+def init_parallel(n_workers: int) -> None:
     """
-    PriortiyScore is the sum of the "clinvar_screening", "insilico_screening", and "recalibrated_splai"
+    Start the persistent worker pool (lib/workerpool.py). This is the only
+    place where the pool is set up; it runs before the resources are opened
+    so that the workers do not inherit open database handles.
     """
-    if row['insilico_screening'] == "Not available":
-        return np.nan
+    from lib import workerpool
+
+    os.environ['JOBLIB_TEMP_FOLDER'] = '/tmp'
+    workerpool.initialize(n_workers)
 
-    return int(score_map[row['recalibrated_splai']]) + int(score_map[row['insilico_screening']]) + int(score_map[row['clinvar_screening']])
+def run_prepare() -> None:
+    """
+    `ps.py prepare`: build all derived resources once and write the manifest
+    that scoring runs read at startup.
+    """
+    from lib.resources import prepare, MANIFEST_NAME
+
+    setup_logging(f"{FLAGS.resources}/prepare", FLAGS.verbose)
+    logger = getLogger(__name__)
+    logger.info(f"Preparing resources in {FLAGS.resources} "
+                f"(GENCODE release {FLAGS.release}, {FLAGS.assembly})...")
+    manifest = prepare(FLAGS.resources, FLAGS.release, FLAGS.assembly, FLAGS.n_workers)
+    for name, record in manifest['files'].items():
+        logger.info(f"{name:<18}: {record['path']} (sha256 {record['sha256'][:12]})")
+    logger.info(f"Manifest written to {FLAGS.resources}/{MANIFEST_NAME}")
+
+def run_prefilter() -> None:
+    """
+    `ps.py prefilter`: copy the records of --input that lie in genic regions
+    (see --transcript_flank and --splice_flank) to --output. Meant to run
+    before SpliceAI on whole-genome VCFs.
+    """
+    from lib.genicfilter import filter_vcf
+
+    setup_logging(FLAGS.output, FLAGS.verbose)
+    logger = getLogger(__name__)
+    start = time.perf_counter()
+    index = open_genic_index(load_resource_paths())
+    n_read, n_kept = filter_vcf(FLAGS.input, FLAGS.output, index, threads=FLAGS.io_threads)
+    elapsed = time.perf_counter() - start
+    logger.info(f"Genic prefilter: kept {n_kept} of {n_read} records "
+                f"({n_read - n_kept} outside genic regions) in {elapsed:.1f} s")
 
 #===============================================================================
 # Arugments parser using absl-py 
@@ -80,9 +94,17 @@ from absl import flags
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string(
-    'input', None, 'Path to input VCF file', short_name='i')
+    'input', None, 
+    'Path to input VCF file ("-" for stdin). Several VCFs can be given as a '
+    'comma-separated list or a glob pattern', short_name='i')
 flags.DEFINE_string(
-    'output', None, 'Path to output VCF file', short_name='o')
+    'sample_sheet', None, 
+    'TSV file with an "input" column (and optionally an "output" column) '
+    'listing VCFs to score in one run')
+flags.DEFINE_string(
+    'output', None, 
+    'Path to output VCF file ("-" for stdout, .gz for BGZF), or output directory '
+    'when several VCFs are scored', short_name='o')
 flags.DEFINE_string(
     'resources', None, 'Path to resources directory', short_name='r')
 flags.DEFINE_string(
@@ -91,11 +113,76 @@ flags.DEFINE_string(
     'assembly', 'GRCh37', 'Assembly version (GRCh37 or GRCh38)', short_name='a')
 flags.DEFINE_boolean(
     'raw_tsv', False, 'Output raw TSV file')
+flags.DEFINE_enum(
+    'table_format', None, ['parquet', 'arrow'],
+    'Also write the full annotation table (all intermediate columns) next to each '
+    'output VCF as a Parquet or Arrow IPC dataset partitioned by contig')
+flags.DEFINE_boolean(
+    'cohort', False, 
+    'Score each distinct variant once across all input VCFs and copy the '
+    'scores back to every sample')
+flags.DEFINE_boolean(
+    'genic_filter', False, 
+    'Skip variants outside genic regions (see --transcript_flank and --splice_flank)')
+flags.DEFINE_integer(
+    'transcript_flank', 0, 
+    'Genic regions: distance (bp) around annotated transcripts; -1 disables', 
+    lower_bound=-1)
+flags.DEFINE_integer(
+    'splice_flank', -1, 
+    'Genic regions: distance (bp) around exon-intron junctions; -1 disables', 
+    lower_bound=-1)
+flags.DEFINE_string(
+    'regions', None, 
+    'BED file of panel regions: only variants overlapping them are scored. With a '
+    'tabix/CSI-indexed input VCF only these records are read')
+flags.DEFINE_string(
+    'genes', None, 
+    'Panel genes (HGNC symbols, HGNC IDs or Ensembl gene IDs) as a comma-separated '
+    'list or a file with one gene per line; their GENCODE gene spans are added to '
+    '--regions')
+flags.DEFINE_enum(
+    'panel_output', 'subset', ['subset', 'all'],
+    'With --regions/--genes: write only the panel records (subset) or all records, '
+    'leaving those outside the panel unscored (all)')
+flags.DEFINE_string(
+    'weights', None, 
+    'JSON file with the PriorityScore weights of the screening codes s0..s15 '
+    '(e.g. written by weightsearch.py). Defaults to the published weights')
+flags.DEFINE_string(
+    'threshold_grid', None, 
+    'Threshold sweep: TSV with one threshold set per row (columns named like the '
+    'threshold flags, e.g. min_score_aldl; optional "set_id"). Variants are annotated '
+    'once and a PriorityScore matrix (variant x set) is written instead of the VCF')
+flags.DEFINE_string(
+    'checkpoint_dir', None, 
+    'Save the working table after the parse and the expensive stages (IntronDist, '
+    'exon_loc, ClinVar, ExInt_INFO, event calling, CCR) in this directory, keyed by '
+    'a hash of the input VCF and the settings. Removed when the sample is done')
+flags.DEFINE_boolean(
+    'resume', False, 
+    'Continue from the last valid checkpoint in --checkpoint_dir')
 flags.DEFINE_boolean(
     'verbose', False, 'Verbose logging')
 
 flags.DEFINE_integer(
     'n_workers', 2, 'Number of workers for parallel processing in pandas')
+flags.DEFINE_integer(
+    'stage_concurrency', 4, 
+    'Number of independent annotation stages run at the same time on the worker pool '
+    '(1 runs them one after another; has no effect with --n_workers 1)', lower_bound=1)
+flags.DEFINE_integer(
+    'transcript_cache', 4096, 
+    'Number of transcripts whose exons, introns and CDS are kept in memory for the '
+    'gene model lookups of the annotation stages (0 disables the cache)', lower_bound=0)
+flags.DEFINE_integer(
+    'io_threads', 2, 
+    'Number of threads for BGZF decompression of the input VCF and compression '
+    'of a .gz output VCF', lower_bound=1)
+flags.DEFINE_integer(
+    'stream_chunk', 20000, 
+    'Number of records of stdin or a pipe that are parsed, scored and written '
+    'at a time', lower_bound=1)
 flags.DEFINE_float(
     'min_score_aldl', 0.02, 'Minimum SpliceAI score for AL or DL')
 flags.DEFINE_float(
@@ -114,295 +201,644 @@ flags.DEFINE_float(
     'activation_score_dg', 0.2, 'Activation score for DG')
 
 
+#===============================================================================
+# Scoring pipeline
+#===============================================================================
+def load_resource_paths() -> dict:
+    from lib import resources
+    logger = getLogger(__name__)
+
+    # Resources are built once by `ps.py prepare`; here they are only looked
+    # up in its manifest. A missing manifest is prepared on the fly (under
+    # the same lock) so that existing invocations keep working.
+    try:
+        paths = resources.load_manifest(FLAGS.resources, FLAGS.release, FLAGS.assembly)
+    except FileNotFoundError:
+        logger.info("No resource manifest found, preparing resources...")
+        resources.prepare(FLAGS.resources, FLAGS.release, FLAGS.assembly, FLAGS.n_workers)
+        paths = resources.load_manifest(FLAGS.resources, FLAGS.release, FLAGS.assembly)
+    return paths
+
+def open_genic_index(paths: dict) -> dict:
+    from lib.genicfilter import build_genic_index
+
+    def flank(value):
+        return None if value < 0 else value
+
+    return build_genic_index(paths['gencode_gff'], 
+                             transcript_flank=flank(FLAGS.transcript_flank), 
+                             splice_flank=flank(FLAGS.splice_flank))
+
+def open_panel_index(paths: dict) -> dict:
+    """Merged regions of --regions and --genes, or None without a panel."""
+    from lib.genicfilter import build_region_index, gene_regions, read_bed, read_gene_list
+
+    if FLAGS.regions is None and FLAGS.genes is None:
+        return None
+    region_sets = []
+    if FLAGS.regions:
+        region_sets.append(read_bed(FLAGS.regions))
+    if FLAGS.genes:
+        region_sets.append(gene_regions(paths['gencode_gff'], read_gene_list(FLAGS.genes)))
+    return build_region_index(*region_sets)
+
+def load_weights(path: str) -> dict:
+    from lib.scoring import DEFAULT_WEIGHTS
+
+    if path is None:
+        return DEFAULT_WEIGHTS
+    with open(path) as f:
+        weights = json.load(f)
+    missing = set(DEFAULT_WEIGHTS) - set(weights)
+    if missing:
+        raise ValueError(f"{path} has no weight for {', '.join(sorted(missing))}.")
+    # PriorityScore is written as an Integer field
+    fractional = [code for code in DEFAULT_WEIGHTS if not float(weights[code]).is_integer()]
+    if fractional:
+        raise ValueError(f"{path} has non-integer weights for {', '.join(fractional)}.")
+    return {code: float(weights[code]) for code in DEFAULT_WEIGHTS}
+
+def open_resources() -> dict:
+    """
+    Open everything that does not depend on the input VCF. In batch mode this
+    is done once and shared by all samples.
+    """
+    from lib import pipeline
+    logger = getLogger(__name__)
+
+    paths = load_resource_paths()
+    logger.debug("ClinVar bcf file: %s", paths['clinvar'])
+
+    res = pipeline.open_resources(
+        paths, load_weights(FLAGS.weights),
+        open_genic_index(paths) if FLAGS.genic_filter else None, 
+        transcript_cache=FLAGS.transcript_cache)
+    res['panel'] = open_panel_index(paths)
+    if res['panel'] is not None:
+        n_intervals = sum(len(starts) for starts, _ in res['panel'].values())
+        logger.info(f"Panel: {n_intervals} intervals; records outside are "
+                    f"{'dropped' if FLAGS.panel_output == 'subset' else 'written unscored'}")
+    return res
+
+def log_stage_timings(timings: list, stages: list, wall_s: float) -> None:
+    from lib import pipeline
+    logger = getLogger(__name__)
+
+    for name, elapsed, pool in timings:
+        if pool['calls']:
+            logger.debug(f"{name}: {elapsed:.3f} s, {pool['calls']} pool call(s), "
+                         f"IPC {pool['ipc_s']:.3f} s ({pool['publish_s']:.3f} s publishing "
+                         f"{pool['published_bytes'] / 1e6:.1f} MB, "
+                         f"{pool['result_bytes'] / 1e3:.0f} kB returned)")
+        else:
+            logger.debug(f"{name}: {elapsed:.3f} s")
+    path, path_s = pipeline.critical_path(stages, timings)
+    if path:
+        logger.info(f"Stages: {wall_s:.2f} s wall, {sum(t[1] for t in timings):.2f} s in total, "
+                    f"critical path {path_s:.2f} s ({' > '.join(path)})")
+
+def log_transcript_cache() -> None:
+    """Transcript cache counts of this process and the pool workers."""
+    from lib import handles, workerpool
+    logger = getLogger(__name__)
+
+    reports = [handles.report()] + list(workerpool.worker_reports.values())
+    caches = [r['open_gene_models'] for r in reports 
+              if r.get('open_gene_models', {}).get('maxsize', 0) > 0]
+    hits = sum(cache['hits'] for cache in caches)
+    misses = sum(cache['misses'] for cache in caches)
+    if hits + misses == 0:
+        return
+    n_processes = sum(cache['hits'] + cache['misses'] > 0 for cache in caches)
+    logger.info(f"Transcript cache: {hits} hits, {misses} misses "
+                f"({hits / (hits + misses):.1%} hit rate) in {n_processes} process(es), "
+                f"{sum(cache['size'] for cache in caches)} transcripts cached "
+                f"(at most {caches[0]['maxsize']} per process)")
+
+def annotate_variants(df, res: dict, checkpoints=None):
+    """
+    Threshold-independent part of the annotation chain: exon/intron context,
+    ClinVar, CDS length, eLoF and NMD. Runs once per variant, also in sweep
+    mode.
+    """
+    from lib import pipeline
+    logger = getLogger(__name__)
+
+    timings, start = [], time.perf_counter()
+    df = pipeline.run_stages(
+        df, pipeline.ANNOTATION_STAGES, res, [], 
+        engine=pipeline.ENGINES[pipeline.PRODUCTION_ENGINE], log=logger.info, timings=timings, 
+        checkpoints=checkpoints, concurrency=FLAGS.stage_concurrency)
+    log_stage_timings(timings, pipeline.ANNOTATION_STAGES, time.perf_counter() - start)
+    return df
+
+def call_events_and_score(df, res: dict, thresholds: list, checkpoints=None):
+    """
+    Threshold-dependent part of the chain: splicing events, their sizes,
+    frame, CCRs and PriorityScore. `thresholds` is a list of threshold sets;
+    with more than one, df has a `threshold_set` column (sweep mode).
+    """
+    from lib import pipeline, workerpool
+    logger = getLogger(__name__)
+
+    timings, start = [], time.perf_counter()
+    df = pipeline.run_stages(
+        df, pipeline.EVENT_STAGES, res, thresholds, 
+        engine=pipeline.ENGINES[pipeline.PRODUCTION_ENGINE], log=logger.info, timings=timings, 
+        checkpoints=checkpoints, concurrency=FLAGS.stage_concurrency)
+    log_stage_timings(timings, pipeline.EVENT_STAGES, time.perf_counter() - start)
+    log_transcript_cache()
+    workerpool.release()
+    return df
+
+def resumes_events(checkpoints) -> bool:
+    """True if a checkpoint of the event stages exists (annotation is then skipped)."""
+    from lib import pipeline
+
+    return checkpoints is not None and \
+        checkpoints.latest([stage.name for stage in pipeline.EVENT_STAGES]) is not None
+
+def annotate_and_score(df, res: dict, thresholds_SpliceAI_parser: dict, checkpoints=None):
+    """
+    Run the annotation chain on variants parsed by `parse_vcf` and add the
+    PriorityScore column. With checkpoints (lib/checkpoint.py) the chain
+    continues after the last saved stage.
+    """
+    import pandas as pd
+    from lib.preprocess import plan_annotation
+    from lib.schema import apply_annotation_schema, memory_per_row
+    logger = getLogger(__name__)
+
+    # Rows that cannot get a score skip every GENCODE, ClinVar and CCR lookup
+    n_parsed = len(df)
+    df, passthrough, skipped = plan_annotation(df, res['genic_index'])
+    logger.info(f"Early filter: annotating {len(df)} of {n_parsed} variants "
+                f"(skipped {skipped['not_hgnc']} non-HGNC, "
+                f"{skipped['outside_genic']} outside genic regions, "
+                f"{skipped['no_spliceai']} without SpliceAI scores)")
+    passthrough = passthrough.assign(
+        insilico_screening="Not available", PriorityScore=float('nan'))
+    if df.empty:
+        return apply_annotation_schema(passthrough)
+
+    if not resumes_events(checkpoints):
+        df = annotate_variants(df, res, checkpoints)
+    df = call_events_and_score(df, res, [thresholds_SpliceAI_parser], checkpoints)
+
+    # Unscored rows keep their place in the input order
+    if not passthrough.empty:
+        df = pd.concat([df, passthrough]).sort_index()
+
+    typed = apply_annotation_schema(df)
+    logger.debug(f"Annotation table: {memory_per_row(df):.0f} bytes/row as objects, "
+                 f"{memory_per_row(typed):.0f} bytes/row typed")
+    return typed
+
+def open_checkpoints(input_vcf: str, res: dict, thresholds):
+    """
+    Checkpoints (lib/checkpoint.py) of this input and these settings under
+    --checkpoint_dir, or None. Without --resume, old ones are removed.
+    """
+    if FLAGS.checkpoint_dir is None:
+        return None
+    from lib.checkpoint import Checkpoints, make_key
+    from lib.fetch import file_digest
+    from lib.resources import manifest_checksums
+
+    # stdin or a pipe has no content to key the checkpoints by
+    if input_vcf == STDIO or not os.path.isfile(input_vcf):
+        raise app.UsageError("--checkpoint_dir needs input files (checkpoints are keyed by "
+                             "their content).")
+
+    def digest(path):
+        return file_digest(path, 'sha256') if path and os.path.isfile(path) else path
+
+    settings = {
+        'thresholds': thresholds, 'weights': res['weights'], 
+        'resources': manifest_checksums(FLAGS.resources), 
+        'release': FLAGS.release, 'assembly': FLAGS.assembly, 
+        'genic_filter': FLAGS.genic_filter, 'transcript_flank': FLAGS.transcript_flank, 
+        'splice_flank': FLAGS.splice_flank, 'regions': digest(FLAGS.regions), 
+        'genes': digest(FLAGS.genes), 'panel_output': FLAGS.panel_output,
+    }
+    checkpoints = Checkpoints(FLAGS.checkpoint_dir, make_key(digest(input_vcf), settings))
+    if not FLAGS.resume:
+        checkpoints.clear()
+    return checkpoints
+
+def log_enst_diagnostics(enst: dict) -> None:
+    logger = getLogger(__name__)
+    if enst['version_mismatch']:
+        examples = ', '.join(f"{vep} (GENCODE {gencode})" 
+                             for vep, gencode in enst['mismatched_versions'])
+        logger.warning(f"{enst['version_mismatch']} variant(s) have a VEP transcript version "
+                       f"that is not in GENCODE, e.g. {examples}. Were VEP and the "
+                       "resources built from the same GENCODE release?")
+    if enst['not_in_gencode'] or enst['outside_transcript']:
+        logger.info(f"Transcript IDs not resolved: {enst['not_in_gencode']} not in GENCODE, "
+                    f"{enst['outside_transcript']} outside the GENCODE transcript")
+
+def parse_input(input_vcf: str, res: dict, write: bool = True, checkpoints=None) -> tuple:
+    """
+    Parse one input VCF; with --regions/--genes only the panel records.
+    A regular input file is decoded and then read again by write_vcf. With
+    --panel_output subset only the panel records are written, so then the
+    input is opened here and the parsed records are kept for write_vcf.
+    Otherwise a saved parse is taken from the checkpoints. Stdin and pipes
+    are scored by score_stream instead.
+    Returns:
+        tuple: (parsed DataFrame, path or open cyvcf2.VCF, kept records or None)
+    """
+    from lib.preprocess import parse_vcf
+    from lib.genicfilter import has_index
+    from lib.checkpoint import PARSED
+
+    stream = input_vcf == STDIO or not os.path.isfile(input_vcf)
+    subset = res['panel'] is not None and FLAGS.panel_output == 'subset'
+    if write and subset:
+        from cyvcf2 import VCF
+        source, records = VCF(input_vcf, threads=FLAGS.io_threads), []
+    else:
+        source, records = input_vcf, None
+        df = checkpoints.load(PARSED) if checkpoints is not None else None
+        if df is not None:
+            getLogger(__name__).info("Resuming from the checkpoint of the parsed input")
+            return df, source, records
+
+    enst = {}
+    df = parse_vcf(raw_vcf=source, db=res['db'], threads=FLAGS.io_threads, records=records,
+                   regions=res['panel'], indexed=not stream and has_index(input_vcf), 
+                   enst_index=res['enst_index'], enst_diagnostics=enst)
+    log_enst_diagnostics(enst)
+    if checkpoints is not None:
+        checkpoints.save(PARSED, df)
+    return df, source, records
+
+def write_outputs(df, input_vcf: str, output_vcf: str, 
+                  source=None, records: list = None) -> None:
+    from lib.vcfwriter import write_vcf
+    logger = getLogger(__name__)
+
+    if FLAGS.table_format:
+        from lib.tablewriter import table_path, write_table
+
+        logger.info('Writing annotation table...')
+        write_table(df, table_path(output_vcf, FLAGS.table_format), FLAGS.table_format)
+
+    df = df[['CHROM', 'POS', 'REF', 'ALT', 'PriorityScore']].copy()
+
+    logger.info('Writing VCF file...')
+    write_vcf(df, input_vcf if source is None else source, output_vcf, 
+              records=records, threads=FLAGS.io_threads)
+
+    if FLAGS.raw_tsv:
+        logger.info('Saving raw TSV file...')
+        df.to_csv(raw_tsv_path(input_vcf), index=False, sep='\t')
+
+def score_vcf(input_vcf: str, output_vcf: str, res: dict, thresholds: dict) -> int:
+    """
+    Score one VCF and write its output VCF (and raw TSV if requested).
+    Returns the number of parsed variants.
+    """
+    checkpoints = open_checkpoints(input_vcf, res, thresholds)
+
+    ## Convert to pandas DataFrame from a input VCF file
+    df, source, records = parse_input(input_vcf, res, checkpoints=checkpoints)
+    n_variants = len(df)
+
+    df = annotate_and_score(df, res, thresholds, checkpoints)
+    write_outputs(df, input_vcf, output_vcf, source, records)
+    if checkpoints is not None:
+        checkpoints.clear()
+
+    return n_variants
+
+def score_stream(input_vcf: str, output_vcf: str, res: dict, thresholds: dict) -> int:
+    """
+    Score stdin or a pipe, which can only be read once, in chunks of
+    --stream_chunk records: each chunk is parsed, scored and written before
+    the next one is read, so memory use does not grow with the input.
+    Returns the number of parsed variants.
+    """
+    from cyvcf2 import VCF
+    from lib.preprocess import parse_vcf
+    from lib.vcfwriter import open_writer, score_mapping, write_records
+    logger = getLogger(__name__)
+
+    vcf_in = VCF(input_vcf, threads=FLAGS.io_threads)
+    vcf_out = open_writer(vcf_in, output_vcf, FLAGS.io_threads)
+    n_variants, n_records = 0, 0
+    while True:
+        records, enst = [], {}
+        df = parse_vcf(raw_vcf=vcf_in, db=res['db'], records=records, regions=res['panel'],
+                       indexed=False, enst_index=res['enst_index'], enst_diagnostics=enst,
+                       limit=FLAGS.stream_chunk)
+        if not records:
+            break
+        log_enst_diagnostics(enst)
+        n_variants, n_records = n_variants + len(df), n_records + len(records)
+        logger.info(f"Scoring records {n_records - len(records) + 1}-{n_records}...")
+
+        df = annotate_and_score(df, res, thresholds)
+        write_records(vcf_out, records, score_mapping(df))
+        if len(records) < FLAGS.stream_chunk:
+            break
+
+    vcf_out.close()
+    vcf_in.close()
+    return n_variants
+
+# Threshold flags and their keys in thresholds_SpliceAI_parser
+THRESHOLD_FLAGS = {
+    'min_score_aldl': 'TH_min_sALDL', 
+    'max_score_aldl': 'TH_max_sALDL', 
+    'min_score_agdg': 'TH_min_sAGDG', 
+    'max_score_agdg': 'TH_max_sAGDG',
+    'min_gain_exon_len': 'TH_min_GExon', 
+    'max_gain_exon_len': 'TH_max_GExon',
+    'activation_score_ag': 'TH_sAG', 
+    'activation_score_dg': 'TH_sDG',
+}
+
+def thresholds_from_flags(overrides: dict = None) -> dict:
+    overrides = overrides or {}
+    return {key: type(FLAGS[name].value)(overrides.get(name, FLAGS[name].value))
+            for name, key in THRESHOLD_FLAGS.items()}
+
+def read_threshold_grid(path: str) -> tuple:
+    """
+    Read the --threshold_grid TSV. Thresholds missing from a row (or the
+    whole column) take the value of the corresponding flag.
+    Returns:
+        tuple: (set ids, list of thresholds_SpliceAI_parser dicts)
+    """
+    import pandas as pd
+
+    grid = pd.read_csv(path, sep='\t', dtype=str)
+    unknown = set(grid.columns) - set(THRESHOLD_FLAGS) - {'set_id'}
+    if unknown:
+        raise app.UsageError(f"Unknown columns in {path}: {', '.join(sorted(unknown))}")
+    if grid.empty:
+        raise app.UsageError(f"{path} has no threshold sets.")
+
+    set_ids = grid['set_id'].tolist() if 'set_id' in grid.columns \
+        else [f"set{i}" for i in range(len(grid))]
+    if len(set(set_ids)) != len(set_ids):
+        raise app.UsageError(f"set_id values in {path} must be unique.")
+    overrides = grid.drop(columns=['set_id'], errors='ignore')
+    thresholds = [thresholds_from_flags(row.dropna().to_dict()) 
+                  for _, row in overrides.iterrows()]
+    return set_ids, thresholds
+
+def sweep_vcf(input_vcf: str, output_vcf: str, res: dict, 
+              set_ids: list, thresholds: list) -> int:
+    """
+    Threshold sweep: annotate the variants once, then call events and score
+    all threshold sets in one pass over a (variant x set) frame. Writes the
+    PriorityScore matrix to <output>.sweep.tsv and the resolved threshold
+    sets to <output>.sweep.grid.tsv. Returns the number of parsed variants.
+    """
+    import pandas as pd
+    from lib.preprocess import plan_annotation
+    logger = getLogger(__name__)
+
+    checkpoints = open_checkpoints(input_vcf, res, {'set_ids': set_ids, 'thresholds': thresholds})
+    df, _, _ = parse_input(input_vcf, res, write=False, checkpoints=checkpoints)
+    n_variants = len(df)
+    df, _, skipped = plan_annotation(df, res['genic_index'])
+    logger.info(f"Threshold sweep: {len(df)} of {n_variants} variants x {len(thresholds)} sets")
+
+    keys = ['CHROM', 'POS', 'REF', 'ALT']
+    base = os.path.splitext(output_vcf)[0]
+    if df.empty:
+        matrix = pd.DataFrame(columns=keys + set_ids)
+    else:
+        long = None
+        if not resumes_events(checkpoints):
+            df = annotate_variants(df, res, checkpoints)
+            long = pd.concat([df.assign(threshold_set=i) for i in range(len(thresholds))], 
+                             ignore_index=True)
+        long = call_events_and_score(long, res, thresholds, checkpoints)
+
+        # Same as the output VCF: the highest score of an allele's rows
+        scores = long[keys + ['threshold_set', 'PriorityScore']].astype({'CHROM': str})
+        scores = scores.groupby(keys + ['threshold_set'], sort=False, dropna=False
+                                )['PriorityScore'].max().reset_index()
+        matrix = scores.pivot(index=keys, columns='threshold_set', values='PriorityScore')
+        matrix = matrix.reindex(pd.MultiIndex.from_frame(scores[keys].drop_duplicates()))
+        matrix = matrix.astype('Int32')
+        matrix.columns = [set_ids[i] for i in matrix.columns]
+        matrix = matrix.reset_index()
+
+    matrix.to_csv(f"{base}.sweep.tsv", sep='\t', index=False)
+    grid = pd.DataFrame(thresholds, index=pd.Index(set_ids, name='set_id'))
+    grid.rename(columns={key: name for name, key in THRESHOLD_FLAGS.items()}).to_csv(
+        f"{base}.sweep.grid.tsv", sep='\t')
+    logger.info(f"Score matrix written to {base}.sweep.tsv")
+    if checkpoints is not None:
+        checkpoints.clear()
+
+    return n_variants
+
+def score_cohort(jobs: list, res: dict, thresholds: dict) -> int:
+    """
+    Cohort mode: parse every input VCF, run the annotation chain once per
+    distinct variant row, then fan the scores back out to each sample.
+    PriorityScore only depends on the variant and its VEP/SpliceAI
+    annotations, so a variant shared by several samples is scored once.
+    Returns the number of parsed variants over all samples.
+    """
+    import pandas as pd
+    logger = getLogger(__name__)
+
+    parsed, sources = [], []
+    for i, (input_vcf, _) in enumerate(jobs):
+        logger.info(f"[{i + 1}/{len(jobs)}] Parsing {input_vcf}")
+        df, source, records = parse_input(input_vcf, res)
+        sources.append((source, records))
+        df['sample_idx'] = i
+        parsed.append(df)
+    cohort = pd.concat(parsed, ignore_index=True)
+
+    # Rows are keyed on everything parse_vcf extracted, not only on
+    # CHROM/POS/REF/ALT, so samples annotated differently are not merged.
+    variant_cols = [col for col in cohort.columns if col != 'sample_idx']
+    cohort['variant_idx'] = cohort.groupby(
+        variant_cols, sort=False, dropna=False, observed=True).ngroup()
+    unique = cohort.drop_duplicates('variant_idx').drop(columns=['sample_idx'])
+    unique = unique.reset_index(drop=True)
+    logger.info(f"Cohort: {len(cohort)} variants in {len(jobs)} VCFs, "
+                f"{len(unique)} unique (dedup ratio {len(cohort) / max(len(unique), 1):.2f}x)")
+
+    scored = annotate_and_score(unique, res, thresholds)
+
+    for i, (input_vcf, output_vcf) in enumerate(jobs):
+        logger.info(f"[{i + 1}/{len(jobs)}] {input_vcf} -> {output_vcf}")
+        sample = cohort.loc[cohort['sample_idx'] == i, ['variant_idx']]
+        df = sample.merge(scored, on='variant_idx', how='inner').drop(columns=['variant_idx'])
+        write_outputs(df, input_vcf, output_vcf, *sources[i])
+
+    return len(cohort)
+
+def vcf_stem(path: str) -> str:
+    """File name of a VCF without its .vcf, .vcf.gz, .vcf.bgz or .bcf suffix."""
+    name = os.path.basename(path)
+    for suffix in VCF_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return Path(name).stem
+
+def raw_tsv_path(input_vcf: str) -> str:
+    return os.path.join(os.path.dirname(input_vcf), f"{vcf_stem(input_vcf)}.raw.tsv")
+
+def check_distinct(jobs: list, path_of, what: str) -> None:
+    """Raise a UsageError if two jobs would write the same file."""
+    seen = {}
+    for input_vcf, output_vcf in jobs:
+        path = os.path.abspath(path_of(input_vcf, output_vcf))
+        if path in seen:
+            raise app.UsageError(f"{seen[path]} and {input_vcf} would both write the "
+                                 f"{what} {path}.")
+        seen[path] = input_vcf
+
+def resolve_inputs() -> list:
+    """
+    Expand --input / --sample_sheet into (input VCF, output VCF) pairs.
+    With a single input VCF, --output is the output VCF. With several,
+    --output is a directory and each sample is written to
+    `<input name>.psscored.vcf` in it (sample.vcf.gz -> sample.psscored.vcf).
+    Two samples resolving to the same output VCF (or raw TSV) are an error.
+    """
+    import glob
+
+    if FLAGS.sample_sheet:
+        import csv
+
+        with open(FLAGS.sample_sheet) as f:
+            rows = list(csv.DictReader(f, delimiter='\t'))
+        if not rows or 'input' not in rows[0]:
+            raise app.UsageError("--sample_sheet must be a TSV file with an 'input' column.")
+        inputs = [row['input'] for row in rows]
+        outputs = [row.get('output') or None for row in rows]
+    else:
+        inputs = []
+        for item in FLAGS.input.split(','):
+            matched = sorted(glob.glob(item)) if glob.has_magic(item) else [item]
+            if not matched:
+                raise FileNotFoundError(f"No input VCF matches {item}")
+            inputs.extend(matched)
+        outputs = [None] * len(inputs)
+
+    if len(inputs) == 1 and not FLAGS.sample_sheet:
+        return [(inputs[0], FLAGS.output)]
+
+    jobs = [(input_vcf, output_vcf or f"{FLAGS.output}/{vcf_stem(input_vcf)}.psscored.vcf")
+            for input_vcf, output_vcf in zip(inputs, outputs)]
+    check_distinct(jobs, lambda input_vcf, output_vcf: output_vcf, 'output VCF')
+    if FLAGS.raw_tsv:
+        check_distinct(jobs, lambda input_vcf, output_vcf: raw_tsv_path(input_vcf), 'raw TSV')
+    os.makedirs(FLAGS.output, exist_ok=True)
+    return jobs
+
+
 #===============================================================================
 # Main function
 #===============================================================================
 def main(argv):
-    del argv  # Unused.
-    setup_logging(FLAGS.output, FLAGS.verbose)
+    if FLAGS.resources is None:
+        raise app.UsageError("--resources is required.")
+    if FLAGS.transcript_flank < 0 and FLAGS.splice_flank < 0:
+        raise app.UsageError("--transcript_flank and --splice_flank cannot both be disabled.")
+    if len(argv) > 1:
+        if argv[1:] == ['prepare']:
+            run_prepare()
+        elif argv[1:] == ['prefilter']:
+            if FLAGS.input is None or FLAGS.output is None:
+                raise app.UsageError("prefilter requires --input and --output.")
+            run_prefilter()
+        else:
+            raise app.UsageError(f"Unknown command: {' '.join(argv[1:])}")
+        return
+    if (FLAGS.input is None) == (FLAGS.sample_sheet is None):
+        raise app.UsageError("Exactly one of --input and --sample_sheet is required.")
+    if FLAGS.output is None:
+        raise app.UsageError("--output is required.")
+    if FLAGS.threshold_grid and FLAGS.cohort:
+        raise app.UsageError("--threshold_grid cannot be combined with --cohort.")
+    if FLAGS.resume and FLAGS.checkpoint_dir is None:
+        raise app.UsageError("--resume requires --checkpoint_dir.")
+    if FLAGS.checkpoint_dir and FLAGS.cohort:
+        raise app.UsageError("--checkpoint_dir cannot be combined with --cohort.")
+
+    jobs = resolve_inputs()
+    batch = len(jobs) > 1 or FLAGS.sample_sheet is not None
+    if batch and any(input_vcf == STDIO for input_vcf, _ in jobs):
+        raise app.UsageError("stdin (-) can only be scored as the only input VCF.")
+    if FLAGS.raw_tsv and any(input_vcf == STDIO for input_vcf, _ in jobs):
+        raise app.UsageError("--raw_tsv is written next to the input VCF and needs an input file.")
+    if FLAGS.checkpoint_dir and any(input_vcf == STDIO or not os.path.isfile(input_vcf) 
+                                    for input_vcf, _ in jobs):
+        raise app.UsageError("--checkpoint_dir needs input files (checkpoints are keyed by "
+                             "their content).")
+    if FLAGS.panel_output == 'all' and (FLAGS.regions or FLAGS.genes) \
+            and any(input_vcf == STDIO or not os.path.isfile(input_vcf) for input_vcf, _ in jobs):
+        raise app.UsageError("--panel_output all reads the input VCF again and needs an input file.")
+    if (FLAGS.table_format or FLAGS.cohort) \
+            and any(input_vcf == STDIO or not os.path.isfile(input_vcf) for input_vcf, _ in jobs):
+        raise app.UsageError("Stdin and pipes are scored in chunks; --table_format and --cohort "
+                             "need input files.")
+    if FLAGS.output == STDIO and (batch or FLAGS.table_format or FLAGS.threshold_grid):
+        raise app.UsageError("--output - (stdout) only takes the scored VCF of a single "
+                             "input; it cannot be combined with --table_format or "
+                             "--threshold_grid.")
+    setup_logging(f"{FLAGS.output}/psscoring" if batch else FLAGS.output, FLAGS.verbose)
     logger = getLogger(__name__)
-    os.environ['JOBLIB_TEMP_FOLDER'] = '/tmp' 
-    pandarallel.initialize(nb_workers=FLAGS.n_workers, 
-                           progress_bar=False, verbose=1, use_memory_fs=False
-                           ) 
+
+    init_parallel(FLAGS.n_workers)
 
     # Display the input arguments
     logger.info(f"""
                 Input args
                 ----------------
-                Input VCF    : {FLAGS.input}
+                Input VCF    : {FLAGS.input or FLAGS.sample_sheet} ({len(jobs)} file(s))
                 Output VCF   : {FLAGS.output}
                 Resources dir: {FLAGS.resources}
                 """)
 
-    thresholds_SpliceAI_parser: dict = {
-        'TH_min_sALDL': FLAGS.min_score_aldl, 
-        'TH_max_sALDL': FLAGS.max_score_aldl, 
-        'TH_min_sAGDG': FLAGS.min_score_agdg, 
-        'TH_max_sAGDG': FLAGS.max_score_agdg,
-        'TH_min_GExon': FLAGS.min_gain_exon_len, 
-        'TH_max_GExon': FLAGS.max_gain_exon_len,
-        'TH_sAG': FLAGS.activation_score_ag, 
-        'TH_sDG': FLAGS.activation_score_dg
-    }
+    thresholds_SpliceAI_parser: dict = thresholds_from_flags()
+    if FLAGS.threshold_grid:
+        set_ids, threshold_grid = read_threshold_grid(FLAGS.threshold_grid)
+        logger.info(f"Threshold sweep over {len(set_ids)} sets from {FLAGS.threshold_grid}")
 
-    # raw_vcf: str = FLAGS.input
-    fp = Path(FLAGS.input)
-    fp_stem, fp_dir = fp.stem, fp.parent
-
-    ## eLoF genes list (only HGNC IDs) 
-    elof_path = "/opt/psscoring/eLoF_genes.tsv"
-    elofs = pd.read_table(
-        elof_path, usecols=['HGNC_ID'], sep='\t')
-    elofs_hgnc_ids_with_prefix = elofs['HGNC_ID'].unique().tolist()
-    elofs_hgnc_ids = [re.sub('HGNC:', '', hgnc) for hgnc in elofs_hgnc_ids_with_prefix]
-    
-    # Find gencode GTF file databases (gencode.*.annotation.gtf.db) in resources directory.
-    db_list = glob.glob(f"{FLAGS.resources}/gencode.*.annotation.gtf.db")
-    gff_list = glob.glob(f"{FLAGS.resources}/gencode.*.annotation.gff3.gz")
-    db, db_intron, gencode_gff = set_gtf_db(db_list, gff_list)
-    
-    # Generate gff3 index file using pysam
-    tbi_path = f"{gencode_gff}.tbi"
-    if not os.path.exists(tbi_path):
-        logger.info("Re-compressing and sorting GFF3 for BGZF+Tabix...")
-        sorted_bgz = f"{gencode_gff}.sorted.gz"
-        cmd = (
-            f"gunzip -c {gencode_gff} | "
-            f"sort -k1,1 -k4,4n | "
-            f"bgzip -c > {sorted_bgz}"
-        )
-        subprocess.run(cmd, shell=True, check=True)
-        os.replace(sorted_bgz, gencode_gff)
-
-        logger.info("Indexing sorted BGZF-compressed GFF3 with tabix...")
-        subprocess.run(
-            ["tabix", "-f", "-p", "gff", gencode_gff],
-            check=True
-        )
-        logger.info("Tabix index created successfully.")
-
-    # Find a processed ClinVar bcf file in resources directory.
-    clinvar_file_list = glob.glob(f"{FLAGS.resources}/Filtered_BCF_{FLAGS.assembly}_*-*/clinvar_{FLAGS.assembly}.germline.nocoflicted.bcf.gz")
-    clinvar_file_index = glob.glob(f"{FLAGS.resources}/Filtered_BCF_{FLAGS.assembly}_*-*/clinvar_{FLAGS.assembly}.germline.nocoflicted.bcf.gz.*i")
-    if len(clinvar_file_list) == 0 or len(clinvar_file_index) == 0:
-        raise FileNotFoundError(
-            f"Cannot find the processed ClinVar bcf file in {FLAGS.resources} directory. "
-            f"Please check the directory and try again."
-            f"You can generate it using the 'ss_generate_clinvar_dataset.sh' script.")
-    else:
-        clinvar_file = clinvar_file_list[0]
-        clinvar_file_index = clinvar_file_index[0]
-        logger.debug("ClinVar bcf file: %s", clinvar_file)
-        logger.debug("ClinVar bcf index file: %s", clinvar_file_index)
-    
-    # Find CCRs file in resources directory.
-    ccrs_auto_file_list = glob.glob(f"{FLAGS.resources}/ccrs.autosomes.*.bed.gz")
-    ccrs_x_file_list = glob.glob(f"{FLAGS.resources}/ccrs.xchrom.*.bed.gz")
-    if len(ccrs_auto_file_list) == 0 or len(ccrs_x_file_list) == 0:
-        subprocess.run(['/opt/psscoring/dlccrs.sh', FLAGS.resources], 
-                       shell=False, check=True, stdin=subprocess.DEVNULL)
-        ccrs_auto = glob.glob(f"{FLAGS.resources}/ccrs.autosomes.*.bed.gz")[0]
-        ccrs_x = glob.glob(f"{FLAGS.resources}/ccrs.xchrom.*.bed.gz")[0]
-    else:
-        ccrs_auto = ccrs_auto_file_list[0]
-        ccrs_x = ccrs_x_file_list[0]
+    start = time.perf_counter()
+    res = open_resources()
 
-    ## Convert to pandas DataFrame from a input VCF file
-    df = parse_vcf(raw_vcf=FLAGS.input, db=db)
-
-    logger.info('Calculate the distance to the nearest splice site in intron variant...')
-    df['IntronDist'] = df.apply(
-        posparser.signed_distance_to_exon_boundary, 
-        db=db, db_intron=db_intron, axis=1)
-
-    logger.info('Classify "Canonical" splice site or "Non-canonical" splice site...')
-    df = posparser.classifying_canonical(df)
-
-    df['Ex_or_Int'] = np.where(
-        df['IntronDist'] == "[Warning] Invalid ENST ID", "[Warning] Invalid ENST ID",
-        np.where(df['IntronDist'].isnull(), 'Exonic', 'Intronic'))
-
-    tbx_anno = pysam.TabixFile(gencode_gff)
-    df['exon_loc'] = df.apply(
-        posparser.calc_exon_loc, tabixfile=tbx_anno, enstcolname='ENST', axis=1)
-    df = pd.concat([df, df['exon_loc'].str.split(':', expand=True)], axis=1)
-    df.rename(columns={0: 'ex_up_dist', 1: 'ex_down_dist'}, inplace=True)
-    df.drop(columns=['exon_loc'], inplace=True)
-
-    #2-2. Select minimum distance from upstream distance and downstream distance
-    df['exon_pos'] = df.parallel_apply(posparser.select_exon_pos, axis=1)
-    #2-3. Relative exon location
-    df['prc_exon_loc'] = df.parallel_apply(posparser.calc_prc_exon_loc, axis=1)
-
-    #2-4. Decision exonic splice sites (1 nt in acceptor site or 3 nts on Donor site)
-    df['exon_splice_site'] = df.parallel_apply(posparser.extract_splicing_region, axis=1)
-
-    #3.   Additional Splicing information
-    logger.info('Annotating splicing information...')
-    #3-1. Annotate splicing type ('Exonic Acceptor' etc.)
-    df['SpliceType'] = df.parallel_apply(posparser.select_donor_acceptor, axis=1)
-
-    #5.   Annotate ClinVar varaints interpretations
-    logger.info('Annotating ClinVar varaints interpretations...')
-    # clinvar_file = '../../../clinvar/Filtered_BCF_GRCh37_20241211-044124/clinvar_GRCh37.germline.nocoflicted.bcf.gz'
-    cln_bcf = pysam.VariantFile(clinvar_file)
-    df['clinvar_same_pos'] = df.apply(
-        anno_clinvar.anno_same_pos_vars, cln_bcf=cln_bcf, axis=1)
-    df['clinvar_same_motif'] = df.apply(
-        anno_clinvar.anno_same_motif_vars, cln_bcf=cln_bcf, axis=1)
-    df['same_motif_clinsigs'] = df['clinvar_same_motif'].parallel_apply(
-        anno_clinvar.extract_same_motif_clinsigs)
-
-    logger.info('Parsing SpliceAI results...')
-    logger.info('Annotating Exon/Intron position information...')
-    df['ExInt_INFO'] = df.apply(
-        splaiparser.calc_exint_info, db=db, db_intron=db_intron, axis=1)
-
-    #6-3. Predict splicing effects
-    df['Pseudoexon'] = df.apply(
-        splaiparser.pseudoexon_activation,
-        thresholds=thresholds_SpliceAI_parser, 
-        db_intron=db_intron,
-        axis=1)
-
-    df['Part_IntRet'] = df.parallel_apply(
-        splaiparser.partial_intron_retention,
-        thresholds=thresholds_SpliceAI_parser, 
-        axis=1)
-
-    df['Part_ExDel'] = df.parallel_apply(
-        splaiparser.partial_exon_deletion,
-        thresholds=thresholds_SpliceAI_parser, 
-        axis=1)
-
-    df['Exon_skipping'] = df.parallel_apply(
-        splaiparser.exon_skipping, 
-        thresholds=thresholds_SpliceAI_parser, 
-        axis=1)
-                                            
-    df['Int_Retention'] = df.parallel_apply(
-        splaiparser.intron_retention, 
-        thresholds=thresholds_SpliceAI_parser, 
-        axis=1)
-
-    df['multiexs'] = df.parallel_apply(
-        splaiparser.multi_exon_skipping, 
-        thresholds=thresholds_SpliceAI_parser, 
-        axis=1)
-
-    #7.   Annotate aberrant splicing size (bp)
-    logger.info('Annotating aberrant splicing size (bp)...')
-    #7-1. Annotate size of 
-    df['Size_Part_ExDel'] = df.parallel_apply(
-        splaiparser.anno_partial_exon_del_size, 
-        thresholds=thresholds_SpliceAI_parser, 
-        axis=1)
-
-    #7-3. Annotate size of partial intron retention
-    df['Size_Part_IntRet'] = df.parallel_apply(
-        splaiparser.anno_partial_intron_retention_size, 
-        thresholds=thresholds_SpliceAI_parser,
-        axis=1)
-
-    #7-2. Annotate size of pseudoexon
-    df['Size_pseudoexon'] = df.parallel_apply(
-        splaiparser.anno_gained_exon_size, 
-        thresholds=thresholds_SpliceAI_parser, 
-        axis=1)
-
-    #7-4. Annotate size of intron retention
-    df['Size_IntRet'] = df.parallel_apply(
-        splaiparser.anno_intron_retention_size, 
-        thresholds=thresholds_SpliceAI_parser,
-        axis=1)
-
-    #7-5. Annotate size of exon skipping
-    df['Size_skipped_exon'] = df.parallel_apply(
-        splaiparser.anno_skipped_exon_size, 
-        thresholds=thresholds_SpliceAI_parser,
-        axis=1)
-
-    df['variant_id'] = df['CHROM'].astype(str) + '-' \
-        + df['POS'].astype(str) + '-' + df['REF'] + '-' + df['ALT']
-
-    #8.   Evaluate splicing effects
-    logger.info('Predicting CDS change...')
-    #8-1. Predict CDS change
-    df['CDS_Length'] = df.apply(predeffect.calc_cds_len, db=db, axis=1)
-    df['is_10%_truncation'] = df.apply(predeffect.calc_cds_len_shorten, axis=1)
-
-    #8-2. Determine if the gene is included in eLoFs genes
-    df['is_eLoF'] = df.parallel_apply(
-        predeffect.elofs_judge, elofs_hgnc_ids=elofs_hgnc_ids, axis=1
-        )
-
-    #8-3. Determine causing NMD or not
-    df['is_NMD_at_Canon'] = df.parallel_apply(predeffect.nmd_judge, axis=1)
-
-    cannot_predict: str = 'Cannot predict splicing event'
-    df['Size_Part_ExDel'] = df['Size_Part_ExDel'].replace(cannot_predict, np.nan)
-    df['Size_Part_IntRet'] = df['Size_Part_IntRet'].replace(cannot_predict, np.nan)
-    df['Size_pseudoexon'] = df['Size_pseudoexon'].replace(cannot_predict, np.nan)
-    df['Size_IntRet'] = df['Size_IntRet'].replace(cannot_predict, np.nan)
-    df['Size_skipped_exon'] = df['Size_skipped_exon'].replace(cannot_predict, np.nan)
-
-    df['is_Frameshift_Part_ExDel'] = df['Size_Part_ExDel'].parallel_apply(
-        predeffect.frame_check)
-    df['is_Frameshift_Part_IntRet'] = df['Size_Part_IntRet'].parallel_apply(
-        predeffect.frame_check)
-    df['is_Frameshift_pseudoexon'] = df['Size_pseudoexon'].parallel_apply(
-        predeffect.frame_check)
-    df['is_Frameshift_IntRet'] = df['Size_IntRet'].parallel_apply(
-        predeffect.frame_check)
-    df['is_Frameshift_skipped_exon'] = df['Size_skipped_exon'].parallel_apply(
-        predeffect.frame_check)
-    df['is_Frameshift'] = df[['is_Frameshift_Part_ExDel', 
-                            'is_Frameshift_Part_IntRet', 
-                            'is_Frameshift_pseudoexon', 
-                            'is_Frameshift_IntRet', 
-                            'is_Frameshift_skipped_exon'
-                            ]].any(axis=1)
-
-    #9.   CCRs
-    logger.info('Setting up CCRs info...')
-    #9-1. Annotate truncated regions 
-    df['skipped_region'] = df.parallel_apply(
-        splaiparser.anno_skipped_regions, axis=1)
-    df['deleted_region'] = df.parallel_apply(
-        splaiparser.anno_deleted_regions, 
-        thresholds=thresholds_SpliceAI_parser, axis=1)
-
-    #9-2. Intersect with CCRs
-    logger.info('Annotating CCRs score')
-    df = predeffect.anno_ccr_score(df, autoccr=ccrs_auto, xccr=ccrs_x)
-
-    # Extract data with SymbolSource == 'HGNC'
-    df = df[df['SymbolSource'] == 'HGNC']
-
-    logger.info('Scoring...')
-    scoring = Scoring()
-    df['insilico_screening'] = df.parallel_apply(scoring.insilico_screening, axis=1)
-    df['clinvar_screening'] = df.parallel_apply(scoring.clinvar_screening, axis=1)
-    df['recalibrated_splai'] = df.parallel_apply(scoring.recal_scores_in_canon, axis=1)
-
-    solution = {'s1': 9.0, 's2': 6.0, 's3': 0.0, 's4': -5.0, 
-                's5': -3.0, 's6': 0.0, 's7': 2.0, 's8': 3.0, 's9': 2.0,
-                's10': 4.0, 's11': 2.0, 's12': -1.0, 's13': 0.0, 's14': 1.0, 
-                's15': -5.0, 's0': 0.0}
-
-    df['PriorityScore'] = df.parallel_apply(map_and_calc_score, args=(solution,), axis=1)
-    df = df[['CHROM', 'POS', 'REF', 'ALT', 'PriorityScore']]
-
-    logger.info('Writing VCF file...')
-    write_vcf(df, FLAGS.input, FLAGS.output)
-
-    if FLAGS.raw_tsv:
-        logger.info('Saving raw TSV file...')
-        df.to_csv(
-            f"{fp_dir}/{fp_stem}.raw.tsv", index=False, sep='\t')
-
-    print("Done!")
+    total_variants = 0
+    if FLAGS.cohort:
+        total_variants = score_cohort(jobs, res, thresholds_SpliceAI_parser)
+    else:
+        for i, (input_vcf, output_vcf) in enumerate(jobs, 1):
+            sample_start = time.perf_counter()
+            if batch:
+                logger.info(f"[{i}/{len(jobs)}] {input_vcf} -> {output_vcf}")
+            if FLAGS.threshold_grid:
+                n_variants = sweep_vcf(input_vcf, output_vcf, res, set_ids, threshold_grid)
+            elif input_vcf == STDIO or not os.path.isfile(input_vcf):
+                n_variants = score_stream(input_vcf, output_vcf, res, thresholds_SpliceAI_parser)
+            else:
+                n_variants = score_vcf(input_vcf, output_vcf, res, thresholds_SpliceAI_parser)
+            elapsed = time.perf_counter() - sample_start
+            total_variants += n_variants
+            logger.info(f"{Path(input_vcf).name}: {n_variants} variants in {elapsed:.1f} s "
+                        f"({n_variants / elapsed:.1f} variants/s)")
+
+    if batch or FLAGS.cohort:
+        elapsed = time.perf_counter() - start
+        mode = 'Cohort' if FLAGS.cohort else 'Batch'
+        logger.info(f"{mode}: {len(jobs)} VCFs, {total_variants} variants in {elapsed:.1f} s "
+                    f"({total_variants / elapsed:.1f} variants/s, including resource setup)")
+
+    print("Done!", file=sys.stderr if FLAGS.output == STDIO else sys.stdout)
 
 if __name__ == '__main__':
     app.run(main)
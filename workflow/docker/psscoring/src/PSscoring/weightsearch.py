@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""Fit the PriorityScore weights of the screening codes s0..s15 on a truth set.
+
+Reads annotation tables written by `ps.py --table_format` (or TSVs with the
+same columns), joins them with labelled variants and evaluates
+`--n_candidates` random integer weight vectors in batches. The best
+candidates and their sensitivity/specificity at PriorityScore >= 1 are
+written to `<output>.candidates.tsv`, the best weights to
+`<output>.weights.json` (usable with `ps.py --weights`).
+"""
+import os
+import glob
+import json
+import time
+
+import numpy as np
+import pandas as pd
+from absl import app
+from absl import flags
+from absl import logging
+
+from lib.scoring import DEFAULT_WEIGHTS, SCREENING_COLS
+from lib.weightsearch import CODES, METRIC_COLS, encode_codes, evaluate, search
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string(
+    'table', None,
+    'Annotation table(s): Parquet/Arrow datasets written by ps.py --table_format, '
+    'or TSV files. Comma-separated list or glob pattern', short_name='t')
+flags.DEFINE_string(
+    'labels', None,
+    'TSV with CHROM, POS, REF, ALT and the label column. Not needed when the '
+    'tables already have the label column', short_name='l')
+flags.DEFINE_string(
+    'label_col', 'label', 'Label column (1 = pathogenic, 0 = benign)')
+flags.DEFINE_string(
+    'output', None, 'Output prefix', short_name='o')
+flags.DEFINE_integer(
+    'n_candidates', 1_000_000, 'Number of candidate weight vectors')
+flags.DEFINE_integer(
+    'min_weight', -10, 'Smallest candidate weight')
+flags.DEFINE_integer(
+    'max_weight', 10, 'Largest candidate weight')
+flags.DEFINE_integer(
+    'seed', 0, 'Random seed')
+flags.DEFINE_float(
+    'threshold', 1.0, 'Screening-positive cut-off (PriorityScore >= threshold)')
+flags.DEFINE_enum(
+    'objective', 'youden', ['youden', 'sensitivity'], 'Metric to maximise')
+flags.DEFINE_float(
+    'min_specificity', 0.0, 'Rank candidates below this specificity last')
+flags.DEFINE_integer(
+    'top_k', 100, 'Number of best candidates to report (0 reports all)')
+flags.mark_flags_as_required(['table', 'output'])
+
+KEY_COLS = ['CHROM', 'POS', 'REF', 'ALT']
+
+
+def read_table(path: str, columns: list) -> pd.DataFrame:
+    if os.path.isdir(path):
+        import pyarrow.dataset as ds
+
+        fmt = 'ipc' if path.rstrip('/').endswith('.arrow') else 'parquet'
+        dataset = ds.dataset(path, format=fmt, partitioning='hive')
+        columns = [col for col in columns if col in dataset.schema.names]
+        return dataset.to_table(columns=columns).to_pandas()
+
+    df = pd.read_csv(path, sep='\t', dtype={'CHROM': str})
+    return df[[col for col in columns if col in df.columns]]
+
+def load_truth_set() -> pd.DataFrame:
+    paths = []
+    for item in FLAGS.table.split(','):
+        matched = sorted(glob.glob(item)) if glob.has_magic(item) else [item]
+        if not matched:
+            raise FileNotFoundError(f"No table matches {item}")
+        paths.extend(matched)
+
+    columns = KEY_COLS + SCREENING_COLS + [FLAGS.label_col]
+    df = pd.concat([read_table(path, columns) for path in paths], ignore_index=True)
+    df = df.astype({'CHROM': str, 'POS': int})
+    for col in SCREENING_COLS:
+        if col not in df.columns:
+            raise ValueError(f"Column {col} is missing from the annotation tables.")
+
+    if FLAGS.labels:
+        labels = pd.read_csv(FLAGS.labels, sep='\t', dtype={'CHROM': str})
+        labels = labels[KEY_COLS + [FLAGS.label_col]].drop_duplicates()
+        conflicting = labels.duplicated(KEY_COLS, keep=False)
+        if conflicting.any():
+            raise ValueError(f"{FLAGS.labels} has conflicting labels for "
+                             f"{conflicting.sum()} rows, e.g. "
+                             f"{labels.loc[conflicting, KEY_COLS].iloc[0].tolist()}")
+        df = df.drop(columns=[FLAGS.label_col], errors='ignore').merge(
+            labels, on=KEY_COLS, how='inner')
+    elif FLAGS.label_col not in df.columns:
+        raise app.UsageError(f"The tables have no {FLAGS.label_col} column; pass --labels.")
+
+    # Every row is kept: like the output VCF, encode_codes scores an allele
+    # with several SpliceAI gene entries by the highest score of its rows
+    return df
+
+def main(argv):
+    del argv  # Unused.
+    df = load_truth_set()
+    counts, groups, positives, negatives, n_excluded = encode_codes(
+        df, FLAGS.label_col, keys=KEY_COLS)
+    logging.info('%d labelled variants (%d pathogenic, %d benign) in %d code combinations, '
+                 '%d excluded rows (no label or no score)', positives.sum() + negatives.sum(),
+                 positives.sum(), negatives.sum(), len(counts), n_excluded)
+
+    default = evaluate(np.array([[DEFAULT_WEIGHTS[code] for code in CODES]]),
+                       counts, groups, positives, negatives, FLAGS.threshold)
+    logging.info('Default weights: %s', ', '.join(
+        f"{k}={v[0]:.4g}" for k, v in default.items()))
+
+    start = time.perf_counter()
+    best = search(counts, groups, positives, negatives, FLAGS.n_candidates,
+                  min_weight=FLAGS.min_weight, max_weight=FLAGS.max_weight,
+                  seed=FLAGS.seed, threshold=FLAGS.threshold, objective=FLAGS.objective,
+                  min_specificity=FLAGS.min_specificity, top_k=FLAGS.top_k)
+    elapsed = time.perf_counter() - start
+    logging.info('Evaluated %d candidates in %.2f s (%.0f candidates/s)',
+                 FLAGS.n_candidates, elapsed, FLAGS.n_candidates / elapsed)
+
+    best.to_csv(f"{FLAGS.output}.candidates.tsv", sep='\t', index=False)
+    weights = {code: float(best.loc[0, code]) for code in CODES}
+    with open(f"{FLAGS.output}.weights.json", 'w') as f:
+        json.dump(weights, f, indent=2)
+    logging.info('Best candidate %d: %s', best.loc[0, 'candidate'], ', '.join(
+        f"{k}={best.loc[0, k]:.4g}" for k in METRIC_COLS))
+    logging.info('Weights written to %s.weights.json', FLAGS.output)
+
+
+if __name__ == '__main__':
+    app.run(main)
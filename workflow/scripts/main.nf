@@ -4,13 +4,20 @@ params.input_vcf = ''
 params.output_dir = params.output_dir ?: "${workflow.launchDir}"
 params.out_root = "${params.output_dir}/PS_scoring_" + new Date().format('yyyyMMdd-HHmmss')
 
-include { SPLICEAI; VEP; PS } from './module/processes.nf'
+include { GENIC_FILTER; SPLICEAI; VEP; PS } from './module/processes.nf'
 
 workflow {
-    Channel.fromPath(params.input_vcf)
+    input_ch = Channel.fromPath(params.input_vcf)
         | map { it -> 
                 tuple(it, "${it}.*i", "${params.reference}", "${params.annotation_gtf}") 
                 }
+
+    // Keep only variants in genic regions before SpliceAI (whole-genome input)
+    if (params.genic_prefilter) {
+        input_ch = GENIC_FILTER(input_ch)
+    }
+
+    input_ch
         | SPLICEAI
         | VEP
         | PS
@@ -1,3 +1,28 @@
+process GENIC_FILTER {
+    input:
+    tuple path(input_vcf), path(input_tbi), 
+          path(reference_fasta), path(annotation_gtf)
+
+    output:
+    tuple path('*.genic.vcf.gz'), path('*.genic.vcf.gz.tbi'), 
+          path(reference_fasta), path(annotation_gtf)
+
+    script:
+    """
+    bash -c "
+      source /opt/conda/etc/profile.d/conda.sh && \\
+      conda activate psscoring && \\
+      /opt/psscoring/ps.py prefilter \\
+        --input ${input_vcf} \\
+        --output ${input_vcf.simpleName}.genic.vcf.gz \\
+        --resources /ps_resources \\
+        --assembly ${params.assembly} \\
+        --transcript_flank=${params.genic_transcript_flank} \\
+        --splice_flank=${params.genic_splice_flank}
+    "
+    """
+}
+
 process SPLICEAI {
     input:
     tuple path(input_vcf), path(input_tbi), 